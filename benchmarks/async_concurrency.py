@@ -0,0 +1,167 @@
+'''
+Compares the threaded WSGI mode (gunicorn, src/gunicorn.conf.py) with the
+asyncio ASGI mode (uvicorn, src/asgi.py) serving catalog reads as the number
+of concurrent clients grows. Both run as real servers with the same number
+of worker processes. A WSGI worker handles at most --threads requests at
+once and queues the rest; an ASGI worker takes every request and only waits
+for pooled connections.
+
+Each client keeps one HTTP/1.1 connection open and sends requests back to
+back, cycling through paged book listings, title lookups and searches on a
+generated dataset (src/db/generate.py presets). For every mode and level of
+concurrency it reports requests per second, latency percentiles and errors.
+The clients run in this process, on the same machine as the servers.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/async_concurrency.py --preset small --concurrency 1 8 32 128
+'''
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.parse import quote
+
+import bench_utils
+from index_plans import seed
+from src.db.generate import PRESETS, title
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+HOST = '127.0.0.1'
+
+def catalog_paths(dataset, count = 300):
+    paths = []
+    for i in range(count):
+        book_id = 1 + i * 7919 % dataset.books
+        if (i % 3 == 0):
+            paths.append('/books?after=%d&limit=50' % (book_id - 1))
+        elif (i % 3 == 1):
+            paths.append('/books/' + quote(title(book_id)))
+        else:
+            paths.append('/books/search?q=' + quote(title(book_id).split(' ')[0]) + '&limit=10')
+    return paths
+
+def start_server(mode, port, workers, threads):
+    if (mode == 'wsgi'):
+        command = ['gunicorn', 'server:app', '--bind', '%s:%d' % (HOST, port), '--workers', str(workers),
+                   '--threads', str(threads), '--access-logfile', '/dev/null']
+    else:
+        command = ['uvicorn', 'asgi:app', '--host', HOST, '--port', str(port), '--workers', str(workers),
+                   '--no-access-log', '--log-level', 'warning']
+    server = subprocess.Popen(command, cwd = SRC)
+
+    deadline = time.time() + 30
+    while True:
+        try:
+            urllib.request.urlopen('http://%s:%d/books?limit=1' % (HOST, port), timeout = 1).read()
+            return server
+        except OSError:
+            if (time.time() > deadline or server.poll() != None):
+                server.kill()
+                sys.exit('%s server did not start' % mode)
+            time.sleep(0.2)
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if (name.lower() == 'content-length'):
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+'''
+One client: sends requests one after another on a kept-alive connection,
+reconnecting if the server closes it, until the deadline.
+'''
+async def client(port, paths, offset, deadline, latencies, errors):
+    reader = writer = None
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % paths.__len__()]
+        i += 1
+        start = time.perf_counter()
+        try:
+            if (writer == None):
+                reader, writer = await asyncio.open_connection(HOST, port)
+            writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, HOST)).encode())
+            status = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError):
+            errors['connection'] = errors.get('connection', 0) + 1
+            writer = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if (status != 200):
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    if (writer != None):
+        writer.close()
+
+async def load(port, paths, concurrency, seconds):
+    latencies = []
+    errors = {}
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*[client(port, paths, i * 37, deadline, latencies, errors)
+                           for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    result = bench_utils.latency_summary(latencies)
+    result['requests_per_s'] = round(latencies.__len__() / elapsed, 1)
+    result['errors'] = errors
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset', choices = PRESETS.keys(), default = 'small',
+        help = 'dataset size, see src/db/generate.py')
+    parser.add_argument('--concurrency', type = int, nargs = '+', default = [1, 4, 16, 64, 256])
+    parser.add_argument('--seconds', type = float, default = 10.0, help = 'time per concurrency level')
+    parser.add_argument('--workers', type = int, default = 1, help = 'worker processes per server')
+    parser.add_argument('--threads', type = int, default = 4, help = 'request threads per WSGI worker')
+    parser.add_argument('--modes', nargs = '+', choices = ['wsgi', 'asgi'], default = ['wsgi', 'asgi'])
+    args = parser.parse_args(argv)
+
+    sizes = PRESETS[args.preset]
+    dataset = seed(sizes['books'], sizes['users'], sizes['libraries'], sizes['checkouts'])
+    apply_migrations()
+    exec_commit('VACUUM ANALYZE')
+    paths = catalog_paths(dataset)
+
+    result = {'preset': args.preset, 'workers': args.workers, 'threads': args.threads, 'modes': {}}
+    for port, mode in enumerate(args.modes, 8101):
+        server = start_server(mode, port, args.workers, args.threads)
+        try:
+            # warm the caches and pools before timing
+            asyncio.run(load(port, paths, 4, 2))
+            levels = {}
+            for concurrency in args.concurrency:
+                print('%s, %d clients' % (mode, concurrency), file = sys.stderr)
+                levels[str(concurrency)] = asyncio.run(load(port, paths, concurrency, args.seconds))
+            result['modes'][mode] = levels
+        finally:
+            stop_server(server)
+
+    print(json.dumps(result, indent = 4))
+    print('%-8s %6s %10s %10s %10s %8s' % ('mode', 'conc', 'req/s', 'p50 ms', 'p99 ms', 'errors'), file = sys.stderr)
+    for mode, levels in result['modes'].items():
+        for concurrency, level in levels.items():
+            print('%-8s %6s %10.1f %10.2f %10.2f %8d' % (mode, concurrency, level['requests_per_s'],
+                level['p50_ms'], level['p99_ms'], sum(level['errors'].values())), file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Compares the trigger maintained availability summaries (book_availability,
+library_totals) with the live library_stock joins they replace, and
+measures what the triggers add to a stock update such as a checkout.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/availability.py --books 200000 --libraries 50
+'''
+import argparse
+import json
+import random
+
+import bench_utils
+from index_plans import seed
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit, exec_get_all, exec_get_one
+
+LIVE = {
+    'availability, page of books': """
+        SELECT library_stock.book_id,
+        string_agg(libraries.library_name, ', ' ORDER BY library_stock.library_id)
+        FROM library_stock
+        INNER JOIN libraries ON libraries.library_id = library_stock.library_id
+        WHERE library_stock.book_id = ANY(%(book_ids)s)
+        GROUP BY library_stock.book_id""",
+    'total at one library': """
+        SELECT sum(book_copies) FROM library_stock
+        WHERE library_id = %(library_id)s""",
+    'totals of every library': """
+        SELECT libraries.library_name, count(library_stock.book_id), sum(library_stock.book_copies)
+        FROM libraries
+        LEFT JOIN library_stock ON library_stock.library_id = libraries.library_id
+        GROUP BY libraries.library_name ORDER BY libraries.library_name""",
+}
+
+SUMMARY = {
+    'availability, page of books': """
+        SELECT book_id, libraries FROM book_availability
+        WHERE book_id = ANY(%(book_ids)s)""",
+    'total at one library': """
+        SELECT copies FROM library_totals
+        WHERE library_id = %(library_id)s""",
+    'totals of every library': """
+        SELECT libraries.library_name, library_totals.titles, library_totals.copies
+        FROM libraries
+        LEFT JOIN library_totals ON library_totals.library_id = libraries.library_id
+        ORDER BY libraries.library_name""",
+}
+
+STOCK_UPDATE = """
+    UPDATE library_stock SET book_copies = (book_copies + %(change)s)
+    WHERE library_id = %(library_id)s AND book_id = %(book_id)s"""
+
+def sample_arguments(books, libraries, count, page):
+    arguments = []
+    for _ in range(count):
+        first = random.randint(1, max(1, books - page))
+        arguments.append({'book_ids': list(range(first, first + page)),
+                          'library_id': random.randint(1, libraries)})
+    return arguments
+
+# whole-table queries take no arguments and are timed fewer times
+WHOLE_TABLE_SAMPLES = 10
+
+def time_queries(queries, arguments, repeat):
+    results = {}
+    for name, sql in queries.items():
+        samples = arguments[:WHOLE_TABLE_SAMPLES] if '%(' not in sql else arguments
+        results[name] = bench_utils.latency_summary(bench_utils.time_calls(
+            lambda args: exec_get_all(sql, args), [(a,) for a in samples], repeat))
+    return results
+
+def time_stock_updates(arguments):
+    stocked = [exec_get_one("""
+        SELECT library_id, book_id FROM library_stock
+        WHERE book_id = ANY(%(book_ids)s) LIMIT 1""", args) for args in arguments]
+    calls = [({'library_id': row[0], 'book_id': row[1], 'change': change},)
+             for row in stocked if row != None for change in (-1, 1)]
+    return bench_utils.latency_summary(
+        bench_utils.time_calls(lambda args: exec_commit(STOCK_UPDATE, args), calls))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type = int, default = 200000)
+    parser.add_argument('--libraries', type = int, default = 50)
+    parser.add_argument('--page', type = int, default = 100, help = 'books per availability lookup')
+    parser.add_argument('--samples', type = int, default = 200)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--seed', type = int, default = 344)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    seed(args.books, 1, args.libraries, 0)
+    apply_migrations()
+    exec_commit('VACUUM ANALYZE')
+
+    arguments = sample_arguments(args.books, args.libraries, args.samples, args.page)
+    # warm up the buffer cache and connection pool
+    time_queries(LIVE, arguments, 1)
+    time_queries(SUMMARY, arguments, 1)
+
+    result = {'books': args.books, 'libraries': args.libraries, 'page': args.page,
+              'live': time_queries(LIVE, arguments, args.repeat),
+              'summary': time_queries(SUMMARY, arguments, args.repeat)}
+
+    result['stock update'] = {'with triggers': time_stock_updates(arguments)}
+    exec_commit('ALTER TABLE library_stock DISABLE TRIGGER USER')
+    try:
+        result['stock update']['without triggers'] = time_stock_updates(arguments)
+    finally:
+        exec_commit('ALTER TABLE library_stock ENABLE TRIGGER USER')
+
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+Shared helpers for the benchmark scripts.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+'''
+Returns the p-th percentile (0-100) of a list of numbers, nearest rank.
+'''
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(ordered.__len__() - 1, round(p / 100 * ordered.__len__() + 0.5) - 1))
+    return ordered[rank]
+
+'''
+Summarizes a list of latencies in seconds as milliseconds.
+'''
+def latency_summary(latencies):
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        'count': ms.__len__(),
+        'mean_ms': round(sum(ms) / ms.__len__(), 3) if ms else 0.0,
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(max(ms), 3) if ms else 0.0,
+    }
+
+'''
+Calls fn once per argument tuple, repeat times over, and returns the latency
+of every call in seconds.
+'''
+def time_calls(fn, arguments, repeat = 1):
+    latencies = []
+    for _ in range(repeat):
+        for args in arguments:
+            start = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - start)
+    return latencies
@@ -0,0 +1,75 @@
+'''
+Measures catalog search latency (library.search_catalog) on a large
+synthetic catalog and reports p50/p95/p99. Where pg_trgm is installed,
+--full-text-only measures the search used where it is not.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/catalog_search.py --books 1000000
+'''
+import argparse
+import json
+
+import bench_utils
+import index_plans
+from src.db import library
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit, exec_get_all
+
+def seed(books):
+    # load before migrating so the indexes are built in bulk
+    index_plans.seed(books, 1, 1, 0)
+    apply_migrations()
+    # settle the fresh rows (hint bits, visibility map) as on a live catalog
+    exec_commit('VACUUM ANALYZE inventory, book_search')
+
+QUERY_KINDS = ['single word', 'two words', 'exact title', 'author surname', 'misspelled']
+
+def sample_queries(count):
+    rows = exec_get_all("""
+        SELECT title, author FROM inventory
+        WHERE title LIKE '%% %% %%'
+        ORDER BY book_id LIMIT %(count)s""", {'count': count})
+    queries = {kind: [] for kind in QUERY_KINDS}
+    for title, author in rows:
+        words = title.split(' ')
+        queries['single word'].append(words[0])
+        queries['two words'].append(words[0] + ' ' + words[1])
+        queries['exact title'].append('"' + title + '"')
+        queries['author surname'].append(author.split(' ')[-1])
+        # swap two letters, so the words match nothing and pg_trgm takes over
+        queries['misspelled'].append(words[0][0] + words[0][2] + words[0][1] + words[0][3:])
+    return queries
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type = int, default = 1000000)
+    parser.add_argument('--queries', type = int, default = 100, help = 'catalog rows to derive queries from')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--skip-seed', action = 'store_true', help = 'reuse the data already loaded')
+    parser.add_argument('--full-text-only', action = 'store_true', help = 'search without pg_trgm even if installed')
+    args = parser.parse_args(argv)
+
+    if (not args.skip_seed):
+        seed(args.books)
+
+    if (args.full_text_only):
+        library._trigram_search = False
+
+    queries = sample_queries(args.queries)
+    every_query = [(q,) for kind in QUERY_KINDS for q in queries[kind]]
+    # warm up the cache and connection pool
+    bench_utils.time_calls(library.search_catalog, every_query)
+
+    result = {'books': args.books, 'trigram': library.trigram_search_available(), 'by_kind': {}}
+    latencies = []
+    for kind in QUERY_KINDS:
+        kind_latencies = bench_utils.time_calls(library.search_catalog, [(q,) for q in queries[kind]], args.repeat)
+        result['by_kind'][kind] = bench_utils.latency_summary(kind_latencies)
+        latencies += kind_latencies
+
+    result.update(bench_utils.latency_summary(latencies))
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
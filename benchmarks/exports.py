@@ -0,0 +1,72 @@
+'''
+Measures the streaming loan export (/exports/checkouts) on a large checkout
+table: time to the first row, total time, throughput and how much the
+process's peak memory grew while streaming.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/exports.py --checkouts 5000000
+'''
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+import bench_utils
+from index_plans import seed
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def export(client, export_format):
+    start = time.perf_counter()
+    response = client.get('/exports/checkouts', query_string = {'format': export_format},
+        buffered = False)
+
+    first_row = None
+    size = 0
+    lines = 0
+    for chunk in response.response:
+        lines += chunk.count(b'\n')
+        size += chunk.__len__()
+        # the csv header is sent before the query runs, so wait for a row
+        if (first_row == None and lines > (1 if export_format == 'csv' else 0)):
+            first_row = time.perf_counter() - start
+    response.close()
+
+    elapsed = time.perf_counter() - start
+    rows = lines - 1 if export_format == 'csv' else lines
+    return {'rows': rows, 'mb': round(size / 1e6, 1), 'first_row_ms': round(first_row * 1000, 1),
+            'total_s': round(elapsed, 2), 'rows_per_s': round(rows / elapsed)}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type = int, default = 100000)
+    parser.add_argument('--users', type = int, default = 50000)
+    parser.add_argument('--libraries', type = int, default = 50)
+    parser.add_argument('--checkouts', type = int, default = 5000000)
+    args = parser.parse_args(argv)
+
+    from server import app
+    seed(args.books, args.users, args.libraries, args.checkouts)
+    apply_migrations()
+    exec_commit('VACUUM ANALYZE')
+
+    client = app.test_client()
+    result = {'checkouts': args.checkouts}
+    for export_format in ['csv', 'ndjson']:
+        before = peak_rss_mb()
+        result[export_format] = export(client, export_format)
+        result[export_format]['peak_rss_growth_mb'] = round(peak_rss_mb() - before, 1)
+
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
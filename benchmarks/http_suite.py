@@ -0,0 +1,230 @@
+'''
+Runs every route registered in src/server.py in-process through Flask's test
+client against a generated dataset (src/db/generate.py presets), and reports latency percentiles, requests
+per second and database queries per request for each one.
+
+Each route has one or more cases below. A route added to the server without a
+case makes the suite fail, so the results always cover the whole API. Cases
+run for up to --seconds or --requests each, after one untimed warm-up request,
+and streamed bodies are read in full inside the timing.
+
+Results are written as JSON (--output). Pass an earlier run's file as
+--compare to list the cases whose p50 latency or throughput got worse by more
+than --tolerance. The exit status is 1 if any did.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/http_suite.py --preset small --output before.json
+    python benchmarks/http_suite.py --preset small --compare before.json
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import bench_utils
+from index_plans import seed
+from src.db.generate import PRESETS, title
+from src.db.migrate import apply_migrations
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# the app's own copy of the module (imported as db.*), whose stats it records
+from db.swen344_db_utils import collect_query_stats, exec_commit, exec_get_one
+
+BENCH_USER = ('Bench User', 'bench@example.com', 'benchuser', 'benchpass')
+LOGIN_USER = ('Bench Login', 'login@example.com', 'benchlogin', 'benchpass')
+
+'''
+Request builders, keyed by (method, rule). Each case is (name, build) where
+build(i, ctx) returns the keyword arguments for client.open(). Anything a
+request needs that is not part of it (a fresh account to delete) is made in
+build, outside the timing.
+'''
+def book_title(i, ctx):
+    return title(1 + i % ctx['books'])
+
+def stocked_library(i, ctx):
+    return ctx['dataset'].stock(1 + i % ctx['books'])[0][0]
+
+def throwaway_account(i, ctx):
+    from db import library
+    username = 'bench-%s-%d' % (ctx['run'], i)
+    library.create_account('Bench %d' % i, 'bench%d@example.com' % i, username, 'x')
+    key = library.login(username, 'x')['Login successful.']
+    return {'query_string': {'username': username}, 'headers': {'session': str(key)}}
+
+CASES = {
+    ('GET', '/'): [('hello', lambda i, ctx: {})],
+    ('POST', '/login'): [('login', lambda i, ctx: {'data': {'username': LOGIN_USER[2], 'password': LOGIN_USER[3]}})],
+    ('GET', '/user'): [('user loans', lambda i, ctx: {'query_string': {'user_id': 1 + i % ctx['users']}})],
+    ('POST', '/user'): [('create account', lambda i, ctx: {'data': {'name': 'New %s %d' % (ctx['run'], i),
+        'contact_info': 'new%d@example.com' % i, 'username': 'new-%s-%d' % (ctx['run'], i), 'password': 'x'}})],
+    ('PUT', '/user'): [('edit account', lambda i, ctx: {'data': {'username': BENCH_USER[2],
+        'contact_info': 'bench%d@example.com' % i}, 'headers': {'session': ctx['key']}})],
+    ('DELETE', '/user'): [('delete account', throwaway_account)],
+    ('GET', '/users'): [
+        ('users page', lambda i, ctx: {'query_string': {'after': i * 100 % ctx['users'], 'limit': 100}}),
+        ('all users', lambda i, ctx: {}),
+    ],
+    ('POST', '/checkout'): [('checkout', lambda i, ctx: {'data': {'library_id': stocked_library(i, ctx),
+        'title': book_title(i, ctx), 'username': BENCH_USER[2], 'checkout_date': '2022-01-01'},
+        'headers': {'session': ctx['key']}})],
+    ('GET', '/sessions/stats'): [('session stats', lambda i, ctx: {})],
+    ('GET', '/books'): [
+        ('books page', lambda i, ctx: {'query_string': {'after': i * 100 % ctx['books'], 'limit': 100}}),
+        ('all books', lambda i, ctx: {}),
+    ],
+    ('GET', '/books/search'): [('search', lambda i, ctx: {'query_string': {'q': book_title(i, ctx)}})],
+    ('GET', '/books/suggest'): [('suggest', lambda i, ctx: {'query_string': {'prefix': book_title(i, ctx)[:4]}})],
+    ('GET', '/books/<type>'): [('books by type', lambda i, ctx: {'path': '/books/' + ['fiction', 'non-fiction'][i % 2]})],
+    ('GET', '/books/<type>/<string>'): [('books by type and term',
+        lambda i, ctx: {'path': '/books/fiction/' + book_title(i, ctx)})],
+    ('GET', '/reports/libraries'): [('library report', lambda i, ctx: {})],
+    ('GET', '/reports/loans'): [('loan report', lambda i, ctx: {'query_string': {'from': '2022-03-01', 'to': '2022-03-31'}})],
+    ('GET', '/exports/checkouts'): [('export checkouts', lambda i, ctx: {'query_string': {'format': 'ndjson'}})],
+    ('GET', '/exports/libraries/<int:library_id>/history'): [('export library history',
+        lambda i, ctx: {'path': '/exports/libraries/%d/history' % (1 + i % ctx['libraries'])})],
+    ('GET', '/exports/users/<int:user_id>/history'): [('export user history',
+        lambda i, ctx: {'path': '/exports/users/%d/history' % (1 + i % ctx['users'])})],
+    ('GET', '/metrics'): [('metrics', lambda i, ctx: {})],
+}
+
+'''
+Lists the (method, rule) pairs the app serves, leaving out static files and
+the HEAD and OPTIONS methods Flask adds itself.
+'''
+def app_routes(app):
+    routes = []
+    for rule in app.url_map.iter_rules():
+        if (rule.endpoint == 'static'):
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            routes.append((method, rule.rule))
+    return sorted(routes)
+
+def run_case(client, method, rule, build, ctx, max_requests, max_seconds):
+    latencies = []
+    queries = []
+    db_ms = []
+    statuses = {}
+
+    def send(i):
+        kwargs = build(i, ctx)
+        path = kwargs.pop('path', rule)
+        # a streamed body runs its queries after the request's own stats have
+        # been reported in the headers, so they land in these instead
+        with collect_query_stats() as streamed:
+            start = time.perf_counter()
+            response = client.open(path, method = method, **kwargs)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            response.close()
+        return response, elapsed, streamed
+
+    send(0)
+    deadline = time.perf_counter() + max_seconds
+    i = 1
+    while i <= max_requests and (i == 1 or time.perf_counter() < deadline):
+        response, elapsed, streamed = send(i)
+        latencies.append(elapsed)
+        queries.append(int(response.headers.get('X-DB-Queries', 0)) + streamed.queries)
+        db_ms.append(float(response.headers.get('X-DB-Time', 0)) + streamed.db_time * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        i += 1
+
+    result = bench_utils.latency_summary(latencies)
+    result['requests_per_s'] = round(latencies.__len__() / sum(latencies), 1)
+    result['queries_per_request'] = round(sum(queries) / queries.__len__(), 2)
+    result['db_ms_per_request'] = round(sum(db_ms) / db_ms.__len__(), 3)
+    result['statuses'] = {str(code): count for code, count in sorted(statuses.items())}
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+            text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+'''
+Prints the cases of a run next to a baseline run and returns the names of
+those whose p50 latency rose, or whose throughput fell, by more than the
+tolerance (a fraction).
+'''
+def compare(result, baseline, tolerance):
+    regressions = []
+    print('%-28s %12s %12s %8s %12s %12s' % ('case', 'p50 ms', 'was', 'change', 'req/s', 'was'))
+    for name, case in result['cases'].items():
+        old = baseline['cases'].get(name)
+        if (old == None):
+            print('%-28s %12.3f %12s' % (name, case['p50_ms'], 'new'))
+            continue
+        change = case['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0.0
+        slower = change > tolerance or case['requests_per_s'] < old['requests_per_s'] * (1 - tolerance)
+        print('%-28s %12.3f %12.3f %+7.0f%% %12.1f %12.1f%s' % (name, case['p50_ms'], old['p50_ms'],
+            change * 100, case['requests_per_s'], old['requests_per_s'], '  REGRESSED' if slower else ''))
+        if (slower):
+            regressions.append(name)
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset', choices = PRESETS.keys(), default = 'tiny',
+        help = 'dataset size, see src/db/generate.py')
+    parser.add_argument('--requests', type = int, default = 200, help = 'most timed requests per case')
+    parser.add_argument('--seconds', type = float, default = 5.0, help = 'time budget per case')
+    parser.add_argument('--only', action = 'append', help = 'run only the named cases')
+    parser.add_argument('--output', help = 'write the results to this JSON file')
+    parser.add_argument('--compare', help = 'JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    args = parser.parse_args(argv)
+
+    from server import app
+    from db import library
+
+    missing = [route for route in app_routes(app) if route not in CASES]
+    if missing:
+        sys.exit('No benchmark case for: ' + ', '.join('%s %s' % route for route in missing))
+
+    sizes = PRESETS[args.preset]
+    dataset = seed(sizes['books'], sizes['users'], sizes['libraries'], sizes['checkouts'])
+    apply_migrations()
+    exec_commit('VACUUM ANALYZE')
+    # the tables were replaced under the app, so start its caches afresh
+    library.sessions.clear()
+    library.catalog_published(exec_get_one("SELECT notify_catalog(ARRAY['reset'])")[0], 'reset')
+    for account in [BENCH_USER, LOGIN_USER]:
+        library.create_account(*account)
+
+    ctx = {'books': dataset.books, 'users': dataset.users, 'libraries': dataset.libraries,
+           'dataset': dataset, 'run': str(int(time.time())),
+           'key': str(library.login(BENCH_USER[2], BENCH_USER[3])['Login successful.'])}
+    result = {'commit': git_commit(), 'preset': args.preset, 'dataset': sizes, 'cases': {}}
+
+    client = app.test_client()
+    for method, rule in app_routes(app):
+        for name, build in CASES[(method, rule)]:
+            if (args.only and name not in args.only):
+                continue
+            print('%s %s (%s)' % (method, rule, name), file = sys.stderr)
+            case = run_case(client, method, rule, build, ctx, args.requests, args.seconds)
+            case['route'] = '%s %s' % (method, rule)
+            result['cases'][name] = case
+
+    if (args.output):
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent = 4)
+    else:
+        print(json.dumps(result, indent = 4))
+
+    if (args.compare):
+        with open(args.compare) as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
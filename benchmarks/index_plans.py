@@ -0,0 +1,87 @@
+'''
+Shows the hot-path query plans before and after the index migrations on a
+scaled-up copy of the library schema.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/index_plans.py --books 200000 --users 50000 --checkouts 500000
+'''
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.db.generate import author, generate, title, username
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit, exec_get_one, exec_sql_file
+
+HOT_QUERIES = [
+    ('session check', """
+        SELECT * FROM users
+        WHERE username = '%s' AND session_key = '1234'""" % username(4242)),
+    ('search by title', "SELECT * FROM inventory WHERE title = '%s'" % title(4242)),
+    ('search by author', "SELECT * FROM inventory WHERE author = '%s'" % author(42)),
+    ('library stock', """
+        SELECT book_copies FROM library_stock
+        WHERE library_id = 7 AND book_id = 4242"""),
+    ('availability', "SELECT library_id FROM library_stock WHERE book_id = 4242"),
+    ('user loans', "SELECT * FROM checkout WHERE user_id = 4242 AND book_id = 17"),
+    ('library history', "SELECT * FROM checkout WHERE library_id = 7"),
+]
+
+'''
+Loads a generated dataset (src/db/generate.py) into the bare schema, before
+the migrations, and returns its Dataset. Options go to generate.Dataset.
+'''
+def seed(books, users, libraries, checkouts, **options):
+    exec_sql_file('src/db/library_schema.sql')
+    dataset, _ = generate(books = books, users = users, libraries = libraries,
+        checkouts = checkouts, **options)
+    return dataset
+
+def scan_nodes(plan):
+    node = plan['Node Type']
+    if 'Relation Name' in plan:
+        node += ' on ' + plan['Relation Name']
+    if 'Index Name' in plan:
+        node += ' using ' + plan['Index Name']
+    nodes = [node]
+    for child in plan.get('Plans', []):
+        nodes += scan_nodes(child)
+    return [node for node in nodes if 'Scan' in node]
+
+def explain(sql):
+    plan = exec_get_one('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql)[0][0]
+    return ', '.join(scan_nodes(plan['Plan'])), plan['Execution Time']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type = int, default = 200000)
+    parser.add_argument('--users', type = int, default = 50000)
+    parser.add_argument('--libraries', type = int, default = 50)
+    parser.add_argument('--checkouts', type = int, default = 500000)
+    parser.add_argument('--json', action = 'store_true', help = 'print results as JSON')
+    args = parser.parse_args(argv)
+
+    seed(args.books, args.users, args.libraries, args.checkouts)
+    before = [explain(sql) for _, sql in HOT_QUERIES]
+    apply_migrations()
+    exec_commit('ANALYZE')
+    after = [explain(sql) for _, sql in HOT_QUERIES]
+
+    results = [{'query': name, 'before': {'plan': b[0], 'ms': b[1]}, 'after': {'plan': a[0], 'ms': a[1]}}
+        for (name, _), b, a in zip(HOT_QUERIES, before, after)]
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+        return
+
+    for result in results:
+        print(result['query'])
+        print('    before: %-80s %9.3f ms' % (result['before']['plan'], result['before']['ms']))
+        print('    after:  %-80s %9.3f ms' % (result['after']['plan'], result['after']['ms']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Times the nightly late fee job on a large checkout table where every
+generated loan was left open (open_share 1.0), so nearly all are overdue:
+one set-based statement, the chunked run, a repeat run for the same date
+(nothing to change) and the next night's run. For comparison, it also times
+the row at a time approach (read each loan, work out the fee in Python,
+update it) on a sample and extrapolates.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/late_fees.py --checkouts 10000000
+'''
+import argparse
+import json
+import time
+from datetime import date
+
+import bench_utils
+from index_plans import seed
+from src.db.generate import late_fee
+from src.db.late_fees import accrue_late_fees, DEFAULT_CHUNK_SIZE
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit, exec_get_all
+
+def row_at_a_time(as_of, sample):
+    start = time.perf_counter()
+    loans = exec_get_all("""
+        SELECT user_id, book_id, due_date FROM checkout
+        WHERE return_date IS NULL AND due_date < %(as_of)s
+        ORDER BY user_id LIMIT %(sample)s""", {'as_of': as_of, 'sample': sample})
+    for user_id, book_id, due_date in loans:
+        exec_commit("""
+            UPDATE checkout SET late_fees = %(fee)s
+            WHERE user_id = %(user_id)s AND book_id = %(book_id)s AND due_date = %(due_date)s""",
+            {'fee': late_fee((as_of - due_date).days), 'user_id': user_id,
+             'book_id': book_id, 'due_date': due_date})
+    elapsed = time.perf_counter() - start
+    return {'loans': loans.__len__(), 'seconds': round(elapsed, 2),
+            'loans_per_s': round(loans.__len__() / elapsed)}
+
+def run(as_of, chunk_size):
+    result = accrue_late_fees(as_of, chunk_size)
+    result['loans_per_s'] = round(result['loans'] / result['seconds']) if result['seconds'] else 0
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type = int, default = 100000)
+    parser.add_argument('--users', type = int, default = 50000)
+    parser.add_argument('--libraries', type = int, default = 50)
+    parser.add_argument('--checkouts', type = int, default = 10000000)
+    parser.add_argument('--chunk-size', type = int, default = DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--sample', type = int, default = 5000)
+    args = parser.parse_args(argv)
+
+    seed(args.books, args.users, args.libraries, args.checkouts, open_share = 1.0)
+    apply_migrations()
+    exec_commit('VACUUM ANALYZE')
+
+    result = {'checkouts': args.checkouts, 'chunk_size': args.chunk_size}
+    sample = row_at_a_time(date(2025, 2, 1), args.sample)
+    sample['extrapolated_s'] = round(args.checkouts / sample['loans_per_s'])
+    result['row at a time'] = sample
+
+    result['single statement'] = run('2025-02-01', 0)
+    result['chunked'] = run('2025-02-02', args.chunk_size)
+    # a fresh run for a date that is already up to date writes nothing
+    exec_commit("DELETE FROM late_fee_runs WHERE as_of = '2025-02-02'")
+    result['repeat'] = run('2025-02-02', args.chunk_size)
+    result['next night'] = run('2025-02-03', args.chunk_size)
+
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
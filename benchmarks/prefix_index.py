@@ -0,0 +1,87 @@
+'''
+Reports build time, memory footprint and lookup latency of the in-memory
+title/author prefix index (db.suggest.PrefixIndex) for a synthetic catalog.
+Needs no database.
+
+    python benchmarks/prefix_index.py --titles 1000000 --authors 100000
+'''
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+import bench_utils
+from src.db.suggest import PrefixIndex, TITLE, AUTHOR
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'te', 'vin', 'dor', 'sel', 'an', 'bri', 'cor', 'da',
+    'el', 'fa', 'gor', 'hal', 'is', 'jo', 'kel', 'lu', 'mar', 'nor', 'ol', 'pa', 'quin',
+    'ros', 'sa', 'tor', 'ul', 'val', 'wen', 'xa', 'yor', 'zel']
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))).capitalize()
+
+def catalog(titles, authors, seed):
+    rng = random.Random(seed)
+    names = [word(rng) + ' ' + word(rng) for _ in range(authors)]
+    books = [(' '.join(word(rng) for _ in range(rng.randint(1, 5))), rng.choice(names))
+        for _ in range(titles)]
+    return books
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--titles', type = int, default = 1000000)
+    parser.add_argument('--authors', type = int, default = 100000)
+    parser.add_argument('--lookups', type = int, default = 10000)
+    parser.add_argument('--seed', type = int, default = 344)
+    args = parser.parse_args(argv)
+
+    books = catalog(args.titles, args.authors, args.seed)
+
+    def entries():
+        for title, author in books:
+            yield title, TITLE
+            yield author, AUTHOR
+
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.build(entries())
+    build_seconds = time.perf_counter() - start
+
+    # measured on a second build, since tracing slows allocation down. The
+    # original title and author strings already exist, so this is what the
+    # index adds on top of them: lowercase keys and the three lists.
+    traced = PrefixIndex()
+    tracemalloc.start()
+    traced.build(entries())
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    # prefixes of 1 to 6 characters taken from real titles, as typed
+    rng = random.Random(args.seed)
+    prefixes = []
+    for _ in range(args.lookups):
+        title = rng.choice(books)[0]
+        prefixes.append((title[:rng.randint(1, 6)],))
+    latencies = bench_utils.time_calls(index.suggest, prefixes)
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add('Added Title %d' % i, TITLE)
+    add_seconds = (time.perf_counter() - start) / 1000
+
+    result = {
+        'titles': args.titles,
+        'authors': args.authors,
+        'entries': index.__len__(),
+        'build_seconds': round(build_seconds, 3),
+        'memory_mb': round(retained / 2 ** 20, 1),
+        'peak_build_memory_mb': round(peak / 2 ** 20, 1),
+        'add_ms': round(add_seconds * 1000, 3),
+        'suggest': bench_utils.latency_summary(latencies),
+    }
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Compares the loan and library reports computed from the loan_totals and
+library_totals rollups with the same aggregations over the raw checkout and
+library_stock rows, for the whole history and for a one month range.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/reports.py --checkouts 10000000
+'''
+import argparse
+import json
+
+import bench_utils
+from index_plans import seed
+from src.db import library
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_commit, exec_get_all
+
+LIVE_LOANS = """
+    SELECT libraries.library_id, libraries.library_name, count(checkout.library_id),
+    count(checkout.return_date),
+    round(sum(checkout.return_date - checkout.check_out_date)::DECIMAL / NULLIF(count(checkout.return_date), 0), 2),
+    COALESCE(sum(checkout.late_fees), 0)
+    FROM libraries
+    LEFT JOIN checkout ON checkout.library_id = libraries.library_id
+    AND (%(start)s::date IS NULL OR checkout.check_out_date >= %(start)s::date)
+    AND (%(end)s::date IS NULL OR checkout.check_out_date <= %(end)s::date)
+    GROUP BY ROLLUP ((libraries.library_id, libraries.library_name))
+    ORDER BY GROUPING(libraries.library_id), libraries.library_name"""
+
+LIVE_LIBRARIES = """
+    SELECT libraries.library_id, libraries.library_name, stock.titles, stock.copies, loans.loans
+    FROM libraries
+    LEFT JOIN (SELECT library_id, count(*) AS titles, sum(book_copies) AS copies
+        FROM library_stock GROUP BY library_id) AS stock ON stock.library_id = libraries.library_id
+    LEFT JOIN (SELECT library_id, count(*) AS loans FROM checkout
+        WHERE (%(start)s::date IS NULL OR check_out_date >= %(start)s::date)
+        AND (%(end)s::date IS NULL OR check_out_date <= %(end)s::date)
+        GROUP BY library_id) AS loans ON loans.library_id = libraries.library_id
+    ORDER BY libraries.library_name"""
+
+RANGES = {'all loans': (None, None), 'one month': ('2022-03-01', '2022-03-31')}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type = int, default = 100000)
+    parser.add_argument('--users', type = int, default = 50000)
+    parser.add_argument('--libraries', type = int, default = 50)
+    parser.add_argument('--checkouts', type = int, default = 2000000)
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args(argv)
+
+    seed(args.books, args.users, args.libraries, args.checkouts)
+    apply_migrations()
+    exec_commit('VACUUM ANALYZE')
+
+    result = {'checkouts': args.checkouts, 'libraries': args.libraries}
+    for name, (start, end) in RANGES.items():
+        calls = [(start, end)]
+        result[name] = {
+            'loan report': {
+                'live': bench_utils.latency_summary(bench_utils.time_calls(
+                    lambda s, e: exec_get_all(LIVE_LOANS, {'start': s, 'end': e}), calls, args.repeat)),
+                'rollup': bench_utils.latency_summary(bench_utils.time_calls(
+                    library.get_loan_report, calls, args.repeat)),
+            },
+            'library report': {
+                'live': bench_utils.latency_summary(bench_utils.time_calls(
+                    lambda s, e: exec_get_all(LIVE_LIBRARIES, {'start': s, 'end': e}), calls, args.repeat)),
+                'rollup': bench_utils.latency_summary(bench_utils.time_calls(
+                    library.get_library_report, calls, args.repeat)),
+            },
+        }
+
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Times what a server start or worker boot pays before it can serve: importing
+db.library and the whole app (server) in a fresh interpreter, and running
+the migration command on an up to date schema. Each is run --repeat times in
+new processes, and each import also reports whether it opened a database
+connection. For comparison it times a schema rebuild (migrate --rebuild),
+which importing db.library used to run.
+
+WARNING: rebuilds the library tables in the configured database.
+
+    python benchmarks/startup.py --repeat 20
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import bench_utils
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Times the import inside the child, so interpreter start up is not counted.
+IMPORT = '''
+import time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+import db.swen344_db_utils as db
+print(elapsed, db._pool is not None)
+'''
+
+def run(args):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable] + args, cwd = SRC, capture_output = True,
+        text = True, check = True).stdout
+    return time.perf_counter() - start, output
+
+def time_import(module, repeat):
+    imports = []
+    processes = []
+    connected = False
+    for _ in range(repeat):
+        process, output = run(['-c', IMPORT % module])
+        elapsed, opened = output.split()
+        imports.append(float(elapsed))
+        processes.append(process)
+        connected = connected or opened == 'True'
+    result = bench_utils.latency_summary(imports)
+    result['process_p50_ms'] = bench_utils.latency_summary(processes)['p50_ms']
+    result['opened_connection'] = connected
+    return result
+
+def time_command(args, repeat):
+    return bench_utils.latency_summary([run(args)[0] for _ in range(repeat)])
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type = int, default = 10)
+    args = parser.parse_args(argv)
+
+    run(['-m', 'db.migrate', '--rebuild'])
+    # warm the bytecode cache, as on a deployed server
+    run(['-c', 'import server'])
+
+    result = {
+        'import db.library': time_import('db.library', args.repeat),
+        'import server': time_import('server', args.repeat),
+        'migrate (up to date)': time_command(['-m', 'db.migrate'], args.repeat),
+        'migrate --rebuild': time_command(['-m', 'db.migrate', '--rebuild'], args.repeat),
+    }
+    print(json.dumps(result, indent = 4))
+
+if __name__ == '__main__':
+    main()
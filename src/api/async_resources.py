@@ -0,0 +1,239 @@
+import json
+from functools import wraps
+from urllib.parse import parse_qsl
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from db import async_library, library
+from db.suggest import DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS
+from api.books import Books
+from api.users import User, Users
+from api.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from api.conditional import version_etag
+
+# The async endpoints served by asgi.py. Requests and responses match the
+# Flask resources of the same routes, whose formatting they reuse.
+
+'''
+Reads a request's arguments from its query string and its form or JSON
+body, as reqparse does.
+Returns:
+    (dict): Argument names mapped to their (string) values.
+'''
+async def read_args(request):
+    args = dict(request.query_params)
+    content_type = request.headers.get('content-type', '')
+    if (content_type.startswith('application/json')):
+        args.update(await request.json())
+    elif (content_type.startswith('application/x-www-form-urlencoded')):
+        args.update(parse_qsl((await request.body()).decode(), keep_blank_values = True))
+    return args
+
+'''
+Answers an HTTPException with a JSON message, as Flask-RESTful does. An
+argument error's message maps the argument to what is wrong with it, like
+reqparse's.
+'''
+async def http_error(request, error):
+    return JSONResponse({'message': error.detail}, status_code = error.status_code)
+
+def int_arg(args, name, default = None):
+    value = args.get(name)
+    if (value == None):
+        return default
+    try:
+        return int(value)
+    except ValueError as error:
+        raise HTTPException(400, {name: str(error)})
+
+def required_arg(args, name, help):
+    if (args.get(name) == None):
+        raise HTTPException(400, {name: help})
+    return args[name]
+
+'''
+Returns the session key a request sends in its session header, see
+api.users.session_key.
+'''
+def session_key(request):
+    key = request.headers.get('session')
+    if (key == None):
+        raise HTTPException(400, 'A session header is required.')
+    return key
+
+'''
+Parses the optional paging arguments, see api.pagination.parse_page_args.
+'''
+def page_args(request):
+    args = dict(request.query_params)
+    after = int_arg(args, 'after')
+    limit = int_arg(args, 'limit')
+    stream = args.get('stream')
+
+    if (stream != None and stream != 'ndjson'):
+        raise HTTPException(400, 'Unsupported stream format, use stream=ndjson.')
+
+    if (after != None or limit != None):
+        after = after if after != None else 0
+        limit = limit if limit != None else DEFAULT_PAGE_SIZE
+        if (limit < 1 or limit > MAX_PAGE_SIZE):
+            raise HTTPException(400, f'limit must be between 1 and {MAX_PAGE_SIZE}.')
+
+    return after, limit, stream
+
+def page_response(request, output, rows, limit):
+    headers = {}
+    if (rows.__len__() == limit):
+        base_url = str(request.url.replace(query = ''))
+        headers['Link'] = f'<{base_url}?after={rows[-1][0]}&limit={limit}>; rel="next"'
+    return JSONResponse(output, headers = headers)
+
+def ndjson_response(batches, format_batch):
+    async def generate():
+        async for rows in batches:
+            items = await format_batch(rows)
+            yield ''.join(json.dumps(item, default=str) + '\n' for item in items)
+
+    return StreamingResponse(generate(), media_type = 'application/x-ndjson')
+
+'''
+Decorator for endpoints whose responses depend only on the catalog and the
+URL, see api.conditional.catalog_conditional.
+'''
+def catalog_conditional(endpoint):
+    @wraps(endpoint)
+    async def conditional_endpoint(request):
+        etag = version_etag(async_library.catalog_version())
+        if (etag == None):
+            return await endpoint(request)
+
+        headers = {'ETag': '"%s"' % etag}
+        if (matches_etag(request.headers.get('if-none-match', ''), etag)):
+            return Response(status_code = 304, headers = headers)
+
+        response = await endpoint(request)
+        response.headers.update(headers)
+        return response
+
+    return conditional_endpoint
+
+def matches_etag(if_none_match, etag):
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if (tag.startswith('W/')):
+            tag = tag[2:]
+        if (tag == '*' or tag.strip('"') == etag):
+            return True
+    return False
+
+async def hello_world(request):
+    rows = await async_library.exec_get_all('SELECT id, foo FROM example_table')
+    return JSONResponse(dict(rows))
+
+async def login(request):
+    args = await read_args(request)
+    return JSONResponse(await async_library.login(args.get('username'), args.get('password')))
+
+async def user(request):
+    if (request.method == 'GET'):
+        user_id = int_arg(dict(request.query_params), 'user_id')
+        checkouts = await async_library.get_user_books(user_id)
+        return JSONResponse(User.format_loans(checkouts))
+
+    args = await read_args(request)
+    if (request.method == 'POST'):
+        message = await async_library.create_account(args.get('name'), args.get('contact_info'),
+            args.get('username'), args.get('password'))
+    elif (request.method == 'PUT'):
+        message = await async_library.edit_account(args.get('username'), args.get('contact_info'),
+            session_key(request))
+    else:
+        message = await async_library.delete_account(request.query_params.get('username'),
+            session_key(request))
+    return JSONResponse(message)
+
+async def users(request):
+    after, limit, stream = page_args(request)
+
+    if (stream != None):
+        async def format_batch(rows):
+            return Users.format_user_records(rows)
+        return ndjson_response(async_library.stream_all_users(), format_batch)
+
+    elif (limit != None):
+        rows = await async_library.get_users_page(after, limit)
+        return page_response(request, Users.format_users(rows), rows, limit)
+
+    else:
+        return JSONResponse(Users.format_users(await async_library.get_all_users()))
+
+async def checkout(request):
+    args = await read_args(request)
+    message = await async_library.checkout_book(int_arg(args, 'library_id'), args.get('title'),
+        args.get('username'), session_key(request), args.get('checkout_date'))
+    return JSONResponse(message)
+
+async def session_stats(request):
+    return JSONResponse(library.sessions.stats())
+
+@catalog_conditional
+async def books(request):
+    after, limit, stream = page_args(request)
+
+    if (stream != None):
+        async def format_batch(rows):
+            availability = await async_library.get_libraries_for_books([row[0] for row in rows])
+            return Books.format_book_records(rows, availability)
+        return ndjson_response(async_library.stream_all_books(), format_batch)
+
+    elif (limit != None):
+        rows, availability = await async_library.get_books_page(after, limit)
+        return page_response(request, Books.format_books(rows, availability), rows, limit)
+
+    else:
+        rows, availability = await async_library.get_all_books()
+        return JSONResponse(Books.format_books(rows, availability))
+
+async def search_books(request):
+    args = dict(request.query_params)
+    query = required_arg(args, 'q', 'A search query is required.')
+    limit = int_arg(args, 'limit', library.DEFAULT_SEARCH_LIMIT)
+    if (limit < 1 or limit > library.MAX_SEARCH_LIMIT):
+        raise HTTPException(400, f'limit must be between 1 and {library.MAX_SEARCH_LIMIT}.')
+
+    rows, availability = await async_library.search_catalog(query, limit)
+    if (rows.__len__() == 0):
+        return JSONResponse([])
+
+    # best match first
+    output = Books.format_books(rows, availability)
+    for row in rows:
+        output[row[0]]['rank'] = round(row[-1], 4)
+    return JSONResponse(output)
+
+async def suggest_books(request):
+    args = dict(request.query_params)
+    prefix = required_arg(args, 'prefix', 'A prefix is required.')
+    k = int_arg(args, 'k', DEFAULT_SUGGESTIONS)
+    if (k < 1 or k > MAX_SUGGESTIONS):
+        raise HTTPException(400, f'k must be between 1 and {MAX_SUGGESTIONS}.')
+
+    return JSONResponse(await async_library.get_suggestions(prefix, k))
+
+@catalog_conditional
+async def books_single_term(request):
+    type = request.path_params['type']
+    if (type in library.BOOK_TYPES):
+        rows, availability = await async_library.get_books_by_type(type)
+    else:
+        rows, availability = await async_library.search_by_title_or_author(type)
+        if (rows.__len__() == 0):
+            return JSONResponse([])
+    return JSONResponse(Books.format_books(rows, availability))
+
+@catalog_conditional
+async def books_multiple_terms(request):
+    rows, availability = await async_library.search_by_multiple_terms(
+        request.path_params['type'], request.path_params['string'])
+    if (rows.__len__() == 0):
+        return JSONResponse([])
+    return JSONResponse(Books.format_books(rows, availability))
@@ -1,15 +1,21 @@
 from urllib.parse import parse_qs, urlparse
-from flask_restful import Resource
+from flask_restful import Resource, abort, reqparse
 from db import library, swen344_db_utils
+from api.pagination import *
+from api.conditional import catalog_conditional
+from db.suggest import DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS
 
 class Books(Resource):
     '''
-    Helper method that returns the passed in books in a neat format.
+    Helper method that returns the passed in books in a neat format. The
+    libraries stocking them are looked up unless availability is given.
     '''
-    def format_books(books):
+    def format_books(books, availability = None):
         final = {}
         book_dict = {}
         temp_dict = {}
+        if (availability == None):
+            availability = library.get_libraries_for_books([book[0] for book in books])
 
         for book in books:
             id = book[0]
@@ -19,7 +25,7 @@ class Books(Resource):
             publish_date = book[4]
             summary = book[5]
             copies = book[6]
-            libraries = library.get_libraries_with_book(id)
+            libraries = availability.get(id, '')
 
             temp_dict = {'title': title, 'type': book_type, 'author': author,
                 'publish date': publish_date, 'summary': summary, 'copies': copies,
@@ -30,30 +36,84 @@ class Books(Resource):
         
         return final
 
+    '''
+    Helper method that formats the passed in books as a list of records
+    carrying their id, for streamed responses.
+    '''
+    def format_book_records(books, availability = None):
+        records = []
+        for id, book in Books.format_books(books, availability).items():
+            record = {'id': id}
+            record.update(book)
+            records.append(record)
+
+        return records
+
+    @catalog_conditional
     def get(self):
-        books = library.get_all_books()
+        args = parse_page_args()
+
+        if (args['stream'] != None):
+            return ndjson_response(library.stream_all_books(), Books.format_book_records)
+
+        elif (is_paged(args)):
+            books = library.get_books_page(args['after'], args['limit'])
+            output = Books.format_books(books)
+            return page_response(output, books, args['limit'])
+
+        else:
+            books = library.get_all_books()
+            output = Books.format_books(books)
+            return output
+
+class SearchBooks(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('q', type = str, location = 'args', required = True,
+            help = 'A search query is required.')
+        parser.add_argument('limit', type = int, location = 'args',
+            default = library.DEFAULT_SEARCH_LIMIT)
+        args = parser.parse_args()
+
+        if (args['limit'] < 1 or args['limit'] > library.MAX_SEARCH_LIMIT):
+            abort(400, message = f'limit must be between 1 and {library.MAX_SEARCH_LIMIT}.')
+
+        books = library.search_catalog(args['q'], args['limit'])
+        if (books.__len__() == 0):
+            output = []
+            return output
+
+        # best match first
         output = Books.format_books(books)
+        for book in books:
+            output[book[0]]['rank'] = round(book[-1], 4)
+
         return output
 
+class SuggestBooks(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('prefix', type = str, location = 'args', required = True,
+            help = 'A prefix is required.')
+        parser.add_argument('k', type = int, location = 'args', default = DEFAULT_SUGGESTIONS)
+        args = parser.parse_args()
+
+        if (args['k'] < 1 or args['k'] > MAX_SUGGESTIONS):
+            abort(400, message = f'k must be between 1 and {MAX_SUGGESTIONS}.')
+
+        return library.get_suggestions(args['prefix'], args['k'])
+
 class SearchBooksSingleTerm(Resource):
+    @catalog_conditional
     def get(self, type):
-        if (type == 'fiction'):
-            books = library.get_fiction_books()
-            output = Books.format_books(books)
-            return output
-
-        elif (type == 'non-fiction'):
-            books = library.get_nonfiction_books()
+        if (type in library.BOOK_TYPES):
+            books = library.get_books_by_type(type)
             output = Books.format_books(books)
             return output
 
         else:
-            if (library.search_by_title(type).__len__() != 0):
-                books = library.search_by_title(type)
-                output = Books.format_books(books)
-                return output
-            elif (library.search_by_author(type).__len__() != 0):
-                books = library.search_by_author(type)
+            books = library.search_by_title_or_author(type)
+            if (books.__len__() != 0):
                 output = Books.format_books(books)
                 return output
             else:
@@ -61,6 +121,7 @@ class SearchBooksSingleTerm(Resource):
                 return output
 
 class SearchBooksMultipleTerms(Resource):
+    @catalog_conditional
     def get(self, type, string):
         books = library.search_by_multiple_terms(type, string)
         if (books.__len__() != 0):
@@ -0,0 +1,51 @@
+from functools import wraps
+from flask import Response
+from flask_restful import request
+from db import library
+
+'''
+Returns the entity tag of the current catalog version, None while the
+version is unknown.
+'''
+def catalog_etag():
+    return version_etag(library.catalog_version())
+
+def version_etag(version):
+    if (version == None):
+        return None
+    return 'catalog-%d' % version
+
+'''
+Decorator for GET methods whose responses depend only on the catalog and the
+request URL. Responses carry a strong ETag of the catalog version, and a
+matching If-None-Match is answered with 304 Not Modified before the method
+runs, so without touching the database. The version is read before the
+response is built, so a change made meanwhile gives the client a tag that is
+already outdated rather than one that is reused.
+'''
+def catalog_conditional(get):
+    @wraps(get)
+    def conditional_get(*args, **kwargs):
+        etag = catalog_etag()
+        if (etag == None):
+            return get(*args, **kwargs)
+
+        headers = {'ETag': '"%s"' % etag}
+        if (request.if_none_match.contains_weak(etag)):
+            return Response(status = 304, headers = headers)
+
+        result = get(*args, **kwargs)
+        if (isinstance(result, Response)):
+            result.headers.extend(headers)
+            return result
+        if (isinstance(result, tuple) and result.__len__() == 2):
+            result = result + ({},)
+        if (isinstance(result, tuple) and result.__len__() == 3):
+            output, status, extra = result
+            headers.update(extra)
+            return output, status, headers
+        if (isinstance(result, tuple)):
+            return result
+        return result, 200, headers
+
+    return conditional_get
@@ -0,0 +1,48 @@
+from flask_restful import Resource, abort, reqparse
+from db import library
+from api.pagination import csv_response, ndjson_response
+
+'''
+Parses the export format, csv (the default) or ndjson.
+'''
+def parse_export_format():
+    parser = reqparse.RequestParser()
+    parser.add_argument('format', type = str, location = 'args', default = 'csv')
+    args = parser.parse_args()
+
+    if (args['format'] not in ('csv', 'ndjson')):
+        abort(400, message = 'Unsupported export format, use format=csv or format=ndjson.')
+
+    return args['format']
+
+'''
+Streams the batches of rows in the requested format. Rows are read from a
+server-side cursor and written as they arrive, so memory use does not grow
+with the export and the first rows go out before the query has finished.
+Parameters:
+    batches(generator): Lists of rows from one of the library.stream_* functions.
+    columns(list): The column names, used as the CSV header and NDJSON keys.
+    name(str): Base name of the downloaded file.
+Returns:
+    (Response): A chunked streaming response.
+'''
+def export_response(batches, columns, name):
+    if (parse_export_format() == 'ndjson'):
+        return ndjson_response(batches, lambda rows: [dict(zip(columns, row)) for row in rows])
+
+    return csv_response(batches, columns, name + '.csv')
+
+class CheckoutExport(Resource):
+    def get(self):
+        return export_response(library.stream_checkouts(), library.CHECKOUT_EXPORT_COLUMNS,
+            'checkouts')
+
+class LibraryHistoryExport(Resource):
+    def get(self, library_id):
+        return export_response(library.stream_all_histories(library_id),
+            library.HISTORY_EXPORT_COLUMNS, f'library-{library_id}-history')
+
+class UserHistoryExport(Resource):
+    def get(self, user_id):
+        return export_response(library.stream_user_history(user_id),
+            library.USER_HISTORY_EXPORT_COLUMNS, f'user-{user_id}-history')
@@ -0,0 +1,48 @@
+import logging
+import time
+from flask import g, request
+from db.swen344_db_utils import start_query_stats, stop_query_stats
+
+logger = logging.getLogger(__name__)
+
+'''
+Collects the database work done by each request and reports it in X-DB-*
+response headers and an INFO log line:
+    X-DB-Queries: statements run
+    X-DB-Rows: rows returned or changed
+    X-DB-Time: milliseconds spent in the database
+    X-DB-Connection-Time: milliseconds spent waiting for pooled connections
+A streamed response runs its queries while the body is sent, after the
+headers have gone out, so its headers only count the work done before that.
+Parameter:
+    app(Flask): The application to instrument.
+'''
+def init_app(app):
+    app.before_request(start_request_stats)
+    app.after_request(add_request_stats)
+    app.teardown_request(stop_request_stats)
+
+def start_request_stats():
+    g.request_started = time.perf_counter()
+    g.query_stats, g.query_stats_token = start_query_stats()
+
+def add_request_stats(response):
+    stats = g.get('query_stats')
+    if (stats == None):
+        return response
+
+    summary = stats.summary()
+    response.headers['X-DB-Queries'] = str(summary['queries'])
+    response.headers['X-DB-Rows'] = str(summary['rows'])
+    response.headers['X-DB-Time'] = '%.3f' % summary['db_ms']
+    response.headers['X-DB-Connection-Time'] = '%.3f' % summary['connection_ms']
+    logger.info('%s %s %s: %d queries, %d rows, %.1f ms db, %.1f ms connect, %.1f ms total',
+        request.method, request.full_path.rstrip('?'), response.status_code,
+        summary['queries'], summary['rows'], summary['db_ms'], summary['connection_ms'],
+        (time.perf_counter() - g.request_started) * 1000)
+    return response
+
+def stop_request_stats(error = None):
+    token = g.pop('query_stats_token', None)
+    if (token != None):
+        stop_query_stats(token)
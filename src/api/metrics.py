@@ -0,0 +1,214 @@
+import threading
+import time
+import weakref
+from flask import Response, g, request
+from flask_restful import Resource
+from db import library
+from db.swen344_db_utils import get_pool
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+'''
+Request metrics kept per thread, so recording a request takes no lock:
+each thread only ever writes its own counters and a scrape adds every
+thread's counters together. A thread's counters are registered (under
+the lock) the first time it records anything. When the thread exits
+they are added to a retired total and dropped, so totals never go
+backwards and a server starting a thread per request does not keep a
+set of counters for each.
+
+Counters are keyed by (name, labels); histograms by labels, holding a
+count per bucket, then the count above the last bucket, the sum and the
+count of observations.
+'''
+class Registry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = {}
+        self._retired = ({}, {})
+
+    def _counters(self):
+        try:
+            return self._local.counters
+        except AttributeError:
+            counters = self._local.counters = ({}, {})
+            # a thread's locals are released as it exits, and with them owner
+            owner = self._local.owner = _Owner()
+            with self._lock:
+                self._threads[id(counters)] = counters
+            weakref.finalize(owner, self._retire, counters)
+            return counters
+
+    def _retire(self, counters):
+        with self._lock:
+            del self._threads[id(counters)]
+            _add_counters(self._retired, counters)
+
+    def inc(self, name, labels=(), amount=1):
+        counters = self._counters()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, labels, seconds):
+        histograms = self._counters()[1]
+        histogram = histograms.get(labels)
+        if (histogram == None):
+            histogram = histograms[labels] = [0] * (self.buckets.__len__() + 3)
+        for i, bound in enumerate(self.buckets):
+            if (seconds <= bound):
+                histogram[i] += 1
+                break
+        else:
+            histogram[-3] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    '''
+    Returns the counters and histograms of every thread added up.
+    '''
+    def collect(self):
+        totals = ({}, {})
+        with self._lock:
+            threads = list(self._threads.values())
+            _add_counters(totals, self._retired)
+        for counters in threads:
+            _add_counters(totals, counters)
+        return totals
+
+'''
+Lives as long as a thread's counters are in use, see Registry._counters.
+'''
+class _Owner:
+    pass
+
+def _add_counters(totals, added):
+    # copying is atomic, so a thread adding a key can't break the loop
+    for key, value in added[0].copy().items():
+        totals[0][key] = totals[0].get(key, 0) + value
+    for labels, histogram in added[1].copy().items():
+        total = totals[1].setdefault(labels, [0] * histogram.__len__())
+        for i, value in enumerate(list(histogram)):
+            total[i] += value
+
+registry = Registry()
+
+'''
+Records every request in the registry: requests by route, method and status,
+latency histograms by route and method, the queries and database time spent
+(from the request's query stats) and how many requests are in flight. The
+route is the URL rule, so /books/<type> is one series whatever the type.
+Latency is measured until the response is returned, which for a streamed
+response is before its body is sent.
+Parameter:
+    app(Flask): The application to instrument.
+'''
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(record_request)
+    app.teardown_request(finish_request)
+
+def start_request():
+    g.metrics_started = time.perf_counter()
+    registry.inc('http_requests_in_flight')
+
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule != None else 'unmatched'
+    registry.inc('http_requests_total', (('route', route), ('method', request.method),
+        ('status', str(response.status_code))))
+    registry.observe((('route', route), ('method', request.method)),
+        time.perf_counter() - g.metrics_started)
+
+    stats = g.get('query_stats')
+    if (stats != None):
+        registry.inc('http_request_db_queries_total', (('route', route),), stats.queries)
+        registry.inc('http_request_db_seconds_total', (('route', route),), stats.db_time)
+    return response
+
+def finish_request(error = None):
+    if (g.pop('metrics_started', None) != None):
+        registry.inc('http_requests_in_flight', amount = -1)
+
+HELP = {
+    'http_requests_total': ('counter', 'Requests handled, by route, method and status.'),
+    'http_requests_in_flight': ('gauge', 'Requests being handled right now.'),
+    'http_request_db_queries_total': ('counter', 'Database queries run by requests, by route.'),
+    'http_request_db_seconds_total': ('counter', 'Seconds requests spent in the database, by route.'),
+    'http_request_duration_seconds': ('histogram', 'Request latency, by route and method.'),
+    'db_pool_connections': ('gauge', 'Pooled database connections, by state.'),
+    'db_pool_max_connections': ('gauge', 'Most connections the pool will open.'),
+    'cache_entries': ('gauge', 'Entries in each in-process cache.'),
+    'cache_hits_total': ('counter', 'Cache lookups answered from the cache.'),
+    'cache_misses_total': ('counter', 'Cache lookups that went to the database.'),
+    'cache_evictions_total': ('counter', 'Entries evicted to keep caches within their size.'),
+    'cache_hit_ratio': ('gauge', 'Hits over lookups since the process started.'),
+}
+
+def format_labels(labels):
+    if (not labels):
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels) + '}'
+
+def format_value(value):
+    if (isinstance(value, float)):
+        return repr(round(value, 6))
+    return str(value)
+
+'''
+Renders the registry and the pool and cache stats in the Prometheus text
+exposition format (version 0.0.4).
+Returns:
+    (str): One line per sample, each family preceded by its HELP and TYPE.
+'''
+def render_metrics():
+    counters, histograms = registry.collect()
+
+    pool = get_pool().stats()
+    for state in ['idle', 'in_use']:
+        counters[('db_pool_connections', (('state', state),))] = pool[state]
+    counters[('db_pool_max_connections', ())] = pool['max']
+
+    for cache, stats in [('sessions', library.sessions.stats()), ('catalog', library.catalog.stats())]:
+        labels = (('cache', cache),)
+        counters[('cache_entries', labels)] = stats['size']
+        counters[('cache_hits_total', labels)] = stats['hits']
+        counters[('cache_misses_total', labels)] = stats['misses']
+        counters[('cache_evictions_total', labels)] = stats['evictions']
+        counters[('cache_hit_ratio', labels)] = float(stats['hit_ratio'])
+
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        samples = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+        if (name == 'http_request_duration_seconds'):
+            samples = sorted(histograms.items())
+        if (not samples and name != 'http_requests_in_flight'):
+            continue
+
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if (name == 'http_requests_in_flight' and not samples):
+            samples = [((), 0)]
+
+        if (kind != 'histogram'):
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+            continue
+
+        for labels, histogram in samples:
+            cumulative = 0
+            for bound, count in zip(registry.buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', str(bound)),)), cumulative))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(histogram[-2])))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), histogram[-1]))
+
+    return '\n'.join(lines) + '\n'
+
+class Metrics(Resource):
+    def get(self):
+        return Response(render_metrics(), content_type = CONTENT_TYPE)
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+from flask import Response
+from flask_restful import abort, reqparse, request
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+'''
+Parses the optional paging query string shared by the list resources:
+    after(int): Keyset cursor - the last id of the previous page.
+    limit(int): Page size, at most MAX_PAGE_SIZE.
+    stream(str): 'ndjson' to stream the whole collection instead.
+Returns:
+    (dict): The parsed arguments.
+'''
+def parse_page_args():
+    parser = reqparse.RequestParser()
+    parser.add_argument('after', type = int, location = 'args')
+    parser.add_argument('limit', type = int, location = 'args')
+    parser.add_argument('stream', type = str, location = 'args')
+    args = parser.parse_args()
+
+    if (args['stream'] != None and args['stream'] != 'ndjson'):
+        abort(400, message = 'Unsupported stream format, use stream=ndjson.')
+
+    if (args['after'] != None or args['limit'] != None):
+        if (args['after'] == None):
+            args['after'] = 0
+        if (args['limit'] == None):
+            args['limit'] = DEFAULT_PAGE_SIZE
+        if (args['limit'] < 1 or args['limit'] > MAX_PAGE_SIZE):
+            abort(400, message = f'limit must be between 1 and {MAX_PAGE_SIZE}.')
+
+    return args
+
+'''
+Checks whether the parsed arguments ask for a single page.
+'''
+def is_paged(args):
+    return args['limit'] != None
+
+'''
+Builds the response for one page. When the page is full a Link header
+points at the next page.
+Parameters:
+    output(dict): The formatted page.
+    rows(list): The rows the page was built from, ordered by id.
+    limit(int): The requested page size.
+Returns:
+    (tuple): Body, status code and headers.
+'''
+def page_response(output, rows, limit):
+    headers = {}
+    if (rows.__len__() == limit):
+        next_after = rows[-1][0]
+        headers['Link'] = f'<{request.base_url}?after={next_after}&limit={limit}>; rel="next"'
+    return output, 200, headers
+
+'''
+Streams a collection as newline delimited JSON, one object per line.
+Parameters:
+    batches(generator): Lists of rows, e.g. from exec_stream.
+    format_batch(function): Turns a list of rows into a list of dicts.
+Returns:
+    (Response): A chunked streaming response.
+'''
+def ndjson_response(batches, format_batch):
+    def generate():
+        for rows in batches:
+            yield ''.join(json.dumps(item, default=str) + '\n' for item in format_batch(rows))
+
+    return Response(generate(), mimetype = 'application/x-ndjson')
+
+'''
+Streams rows as CSV, a header line first and then one chunk per batch.
+Parameters:
+    batches(generator): Lists of rows, e.g. from exec_stream.
+    header(list): The column names.
+    filename(str): Name offered to clients saving the download.
+Returns:
+    (Response): A chunked streaming response.
+'''
+def csv_response(batches, header, filename):
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        yield buffer.getvalue()
+
+        for rows in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+
+    return Response(generate(), mimetype = 'text/csv',
+        headers = {'Content-Disposition': f'attachment; filename={filename}'})
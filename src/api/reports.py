@@ -0,0 +1,60 @@
+from flask_restful import Resource, abort, inputs, reqparse
+from db import library
+
+'''
+Parses the optional check out date range shared by the reports:
+    from(str): First check out date counted, YYYY-MM-DD.
+    to(str): Last check out date counted, YYYY-MM-DD.
+Returns:
+    (tuple): The start and end dates, None when not given.
+'''
+def parse_date_range():
+    parser = reqparse.RequestParser()
+    parser.add_argument('from', type = inputs.date, location = 'args')
+    parser.add_argument('to', type = inputs.date, location = 'args')
+    args = parser.parse_args()
+
+    start = args['from'].date() if args['from'] != None else None
+    end = args['to'].date() if args['to'] != None else None
+    if (start != None and end != None and start > end):
+        abort(400, message = 'from must not be after to.')
+
+    return start, end
+
+class LibraryReport(Resource):
+    def get(self):
+        start, end = parse_date_range()
+
+        final = {}
+        for library_id, name, titles, copies, loans, open_loans, late_fees in \
+                library.get_library_report(start, end):
+            final[library_id] = {'name': name, 'titles': titles, 'copies': copies,
+                'loans': loans, 'checked out': open_loans, 'late fees': float(late_fees)}
+
+        return final
+
+class LoanReport(Resource):
+    def get(self):
+        start, end = parse_date_range()
+        rows = library.get_loan_report(start, end)
+
+        by_library = {}
+        for library_id, name, loans, returned, average_days, late_fees in rows[:-1]:
+            by_library[library_id] = LoanReport.format_loans(loans, returned, average_days, late_fees)
+            by_library[library_id]['name'] = name
+
+        final = LoanReport.format_loans(*rows[-1][2:])
+        final['from'] = str(start) if start != None else None
+        final['to'] = str(end) if end != None else None
+        final['libraries'] = by_library
+        return final
+
+    '''
+    Helper method that formats one line of the loan report.
+    '''
+    def format_loans(loans, returned, average_days, late_fees):
+        if (average_days != None):
+            average_days = float(average_days)
+
+        return {'loans': loans, 'returned': returned,
+            'average days borrowed': average_days, 'late fees': float(late_fees)}
@@ -1,6 +1,17 @@
 import json
-from flask_restful import Resource, reqparse, request
+from flask_restful import Resource, abort, reqparse, request
 from db import library
+from api.pagination import *
+
+'''
+Returns the session key a request sends in its session header, aborting
+with 400 Bad Request when there is none.
+'''
+def session_key():
+    key = request.headers.get('session')
+    if (key == None):
+        abort(400, message = 'A session header is required.')
+    return key
 
 class Login(Resource):
     def post(self):
@@ -12,27 +23,18 @@ class Login(Resource):
         username = args['username']
         password = args['password']
 
-        if (library.login(username, password).__len__() == 2):
-            result = library.login(username, password)
-            return result
-
-        else:
-            result = library.login(username, password)
-            return result
+        result = library.login(username, password)
+        return result
 
 class User(Resource):
-    def get(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('user_id', type = id)
-        args = parser.parse_args()
-        user_id = args['user_id']
-
+    '''
+    Helper method that returns the passed in loans in a neat format.
+    '''
+    def format_loans(checkouts):
         final = {}
         checkout_list = {}
         temp_dict = {}
 
-        checkouts = library.get_user_books(user_id)
-
         for book in checkouts:
             book_id = book[0]
             title = book[1]
@@ -49,6 +51,15 @@ class User(Resource):
             final.update(checkout_list)
 
         return final
+
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('user_id', type = id)
+        args = parser.parse_args()
+        user_id = args['user_id']
+
+        checkouts = library.get_user_books(user_id)
+        return User.format_loans(checkouts)
     
     def post(self):
         parser = reqparse.RequestParser()
@@ -74,14 +85,14 @@ class User(Resource):
 
         username = args['username']
         contact = args['contact_info']
-        key = request.headers['session']
+        key = session_key()
 
         message = library.edit_account(username, contact, key)
         return message
 
     def delete(self):
         username = request.args.get('username')
-        key = request.headers['session']
+        key = session_key()
 
         message = library.delete_account(username, key)
         return message
@@ -99,15 +110,16 @@ class Checkout(Resource):
         title = args['title']
         username = args['username']
         checkout_date = args['checkout_date']
-        key = request.headers['session']
+        key = session_key()
 
         message = library.checkout_book(library_id, title, username, key, checkout_date)
         return message
 
 class Users(Resource):
-    def get(self):
-        users = library.get_all_users()
-
+    '''
+    Helper method that returns the passed in users in a neat format.
+    '''
+    def format_users(users):
         final = {}
         user_dict = {}
         temp_dict = {}
@@ -122,4 +134,31 @@ class Users(Resource):
 
             final.update(user_dict)
 
-        return final
\ No newline at end of file
+        return final
+
+    '''
+    Helper method that formats the passed in users as a list of records
+    carrying their id, for streamed responses.
+    '''
+    def format_user_records(users):
+        return [{'id': user[0], 'name': user[1], 'contact': user[2]} for user in users]
+
+    def get(self):
+        args = parse_page_args()
+
+        if (args['stream'] != None):
+            return ndjson_response(library.stream_all_users(), Users.format_user_records)
+
+        elif (is_paged(args)):
+            users = library.get_users_page(args['after'], args['limit'])
+            output = Users.format_users(users)
+            return page_response(output, users, args['limit'])
+
+        else:
+            users = library.get_all_users()
+            return Users.format_users(users)
+
+
+class SessionStats(Resource):
+    def get(self):
+        return library.sessions.stats()
@@ -0,0 +1,38 @@
+'''
+The asyncio serving mode: the catalog, user, checkout and login routes of
+server.py as an ASGI app on the asyncpg pool. Reports, exports and /metrics
+are only served by server.py.
+    cd src && uvicorn asgi:app --port 8001 --workers 4
+'''
+import asyncio
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.routing import Route
+from api.async_resources import *
+from db import async_db_utils, library
+
+@asynccontextmanager
+async def lifespan(app):
+    await async_db_utils.init_pool()
+    # the listener is a thread on its own connection, so start it off the
+    # loop, then build the type-ahead index once it has reset the caches
+    await asyncio.to_thread(library.catalog_listener.running)
+    await asyncio.to_thread(library.load_suggestions)
+    yield
+    library.catalog_listener.stop()
+    await async_db_utils.close_pool()
+
+app = Starlette(lifespan = lifespan, exception_handlers = {HTTPException: http_error}, routes = [
+    Route('/', hello_world),
+    Route('/login', login, methods = ['POST']),
+    Route('/user', user, methods = ['GET', 'POST', 'PUT', 'DELETE']),
+    Route('/users', users),
+    Route('/checkout', checkout, methods = ['POST']),
+    Route('/sessions/stats', session_stats),
+    Route('/books', books),
+    Route('/books/search', search_books),
+    Route('/books/suggest', suggest_books),
+    Route('/books/{type}', books_single_term),
+    Route('/books/{type}/{string}', books_multiple_terms),
+])
@@ -0,0 +1,126 @@
+import functools
+import re
+import time
+import asyncpg
+from .swen344_db_utils import (DEFAULT_POOL_MAX, DEFAULT_POOL_MIN, DEFAULT_POOL_TIMEOUT,
+                               DEFAULT_SLOW_QUERY_MS, DEFAULT_STREAM_BATCH, MAX_LOGGED_SQL,
+                               current_query_stats, load_config, logger, normalize_sql)
+
+_pool = None
+
+_PARAMETER = re.compile(r"%\((\w+)\)s|%%")
+
+'''
+Rewrites a statement written for psycopg2, with %(name)s parameters and
+%% for a literal %, into asyncpg's numbered $1 parameters. Returns the
+new statement and the parameter names in order, so the sync and async
+layers can share their SQL.
+'''
+@functools.lru_cache(maxsize=1024)
+def positional_sql(sql):
+    names = []
+
+    def number(match):
+        if (match.group(0) == '%%'):
+            return '%'
+        if (match.group(1) not in names):
+            names.append(match.group(1))
+        return '$%d' % (names.index(match.group(1)) + 1)
+
+    return _PARAMETER.sub(number, sql), tuple(names)
+
+def _bind(sql, args):
+    statement, names = positional_sql(sql)
+    return statement, [args[name] for name in names]
+
+'''
+(Re)creates the event loop's connection pool, sized like the sync pool
+by pool_min and pool_max in config/db.yml. Must be called, and the pool
+used, from one event loop.
+'''
+async def init_pool(minconn=None, maxconn=None):
+    global _pool
+    config = load_config()
+    if (minconn == None):
+        minconn = config.get('pool_min', DEFAULT_POOL_MIN)
+    if (maxconn == None):
+        maxconn = config.get('pool_max', DEFAULT_POOL_MAX)
+    await close_pool()
+    _pool = await asyncpg.create_pool(database=config['database'], user=config['user'],
+                                      password=config['password'], host=config['host'],
+                                      port=config['port'], min_size=minconn, max_size=maxconn)
+    return _pool
+
+def get_pool():
+    if (_pool == None):
+        raise RuntimeError('the async connection pool is not initialized, call init_pool() first')
+    return _pool
+
+async def close_pool():
+    global _pool
+    if (_pool != None):
+        pool, _pool = _pool, None
+        await pool.close()
+
+def _record(sql, seconds, rows):
+    stats = current_query_stats()
+    if (stats != None):
+        stats.add_query(sql, seconds, rows)
+
+    threshold = load_config().get('slow_query_ms', DEFAULT_SLOW_QUERY_MS)
+    if (threshold != None and seconds * 1000 >= threshold):
+        logger.warning('slow query (%.1f ms, %d rows): %s', seconds * 1000, rows,
+                       normalize_sql(sql)[:MAX_LOGGED_SQL])
+
+async def _run(method, sql, args):
+    statement, values = _bind(sql, args)
+    pool = get_pool()
+    start = time.perf_counter()
+    conn = await pool.acquire(timeout=load_config().get('pool_timeout', DEFAULT_POOL_TIMEOUT))
+    stats = current_query_stats()
+    if (stats != None):
+        stats.add_connection(time.perf_counter() - start)
+    result = None
+    start = time.perf_counter()
+    try:
+        result = await getattr(conn, method)(statement, *values)
+        return result
+    finally:
+        seconds = time.perf_counter() - start
+        await pool.release(conn)
+        _record(sql, seconds, _row_count(result))
+
+def _row_count(result):
+    if (isinstance(result, list)):
+        return result.__len__()
+    if (isinstance(result, str)):
+        # a command status such as 'UPDATE 3'
+        count = result.rsplit(' ', 1)[-1]
+        return int(count) if count.isdigit() else 0
+    return int(result != None)
+
+async def exec_get_one(sql, args={}):
+    row = await _run('fetchrow', sql, args)
+    return tuple(row) if row != None else None
+
+async def exec_get_all(sql, args={}):
+    return [tuple(row) for row in await _run('fetch', sql, args)]
+
+async def exec_commit(sql, args={}):
+    return await _run('execute', sql, args)
+
+'''
+Yields a query's rows in lists of up to batch_size through a server-side
+cursor, like the sync exec_stream. The pooled connection is held until
+the generator is exhausted or closed.
+'''
+async def exec_stream(sql, args={}, batch_size=DEFAULT_STREAM_BATCH):
+    statement, values = _bind(sql, args)
+    async with get_pool().acquire() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(statement, *values)
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if (not rows):
+                    break
+                yield [tuple(row) for row in rows]
@@ -0,0 +1,329 @@
+import asyncio
+import hashlib
+import secrets
+from datetime import date
+from . import library
+from .library import BOOK_TYPES, DEFAULT_SEARCH_LIMIT, SEARCH_CANDIDATES, catalog, sessions, suggestions
+from .async_db_utils import *
+from .suggest import DEFAULT_SUGGESTIONS
+
+# The catalog, user and checkout calls of library.py for the async API, on
+# the asyncpg pool. They share the sync module's session cache, catalog cache
+# (kept coherent by its catalog listener thread) and type-ahead index, and
+# its SQL where a statement is more than a simple lookup.
+
+'''
+Checks a username and password and, if they match, stores and returns a
+new session key, with a single statement.
+Parameters:
+    username(str): A user's username.
+    password(str): The password.
+Returns:
+    (dict): The session key, or a message if the login failed.
+'''
+async def login(username, password):
+    hashed = hashlib.sha512(password.encode()).hexdigest()
+    key = secrets.randbits(32)
+
+    user = await exec_get_one("""
+        UPDATE users
+        SET session_key = %(key)s
+        WHERE username = %(username)s
+        AND password = %(password)s
+        RETURNING id""",
+        {'key': str(key), 'username': username, 'password': hashed})
+
+    if (user != None):
+        sessions.put(username, key, user[0])
+        return {'Login successful.': str(key)}
+
+    return 'Login unsuccessful, incorrect password.'
+
+'''
+Checks a username and session key, consulting the session cache before
+the database.
+Returns:
+    (int): The user's id, None if the session is not valid.
+'''
+async def authenticate(username, key):
+    user_id = sessions.get(username, key)
+    if (user_id != None):
+        return user_id
+
+    user = await exec_get_one("""
+        SELECT id FROM users
+        WHERE username = %(username)s
+        AND session_key = %(key)s""",
+        {'username': username, 'key': str(key)})
+
+    if (user == None):
+        return None
+
+    sessions.put(username, key, user[0])
+    return user[0]
+
+async def get_all_users():
+    return await exec_get_all("SELECT * FROM users ORDER BY id ASC")
+
+async def get_users_page(after, limit):
+    return await exec_get_all("""
+        SELECT id, name, contact_info FROM users
+        WHERE id > %(after)s
+        ORDER BY id ASC LIMIT %(limit)s""",
+        {'after': after, 'limit': limit})
+
+def stream_all_users(batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT id, name, contact_info FROM users
+        ORDER BY id ASC""", batch_size=batch_size)
+
+async def get_user_books(id):
+    return await exec_get_all("""
+        SELECT checkout.book_id, inventory.title, inventory.author, libraries.library_name,
+        check_out_date, due_date, return_date
+        FROM checkout
+        INNER JOIN inventory ON inventory.book_id = checkout.book_id
+        INNER JOIN libraries ON libraries.library_id = checkout.library_id
+        WHERE checkout.user_id = %(id)s ORDER BY title ASC""", {'id': id})
+
+'''
+Creates an account unless one with the same name and username exists, with
+a single statement.
+Returns:
+    (str): Message indicating success or not.
+'''
+async def create_account(name, contact_info, username, password):
+    hashed = hashlib.sha512(password.encode()).hexdigest()
+    created = await exec_get_one("""
+        INSERT INTO users (name, contact_info, username, password)
+        SELECT %(name)s, %(contact_info)s, %(username)s, %(password)s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM users
+            WHERE name = %(name)s
+            AND username = %(username)s)
+        RETURNING id""",
+        {'name': name, 'contact_info': contact_info, 'username': username, 'password': hashed})
+
+    if (created != None):
+        return 'Account created successfully.'
+
+    return 'Request failed, cannot create account - user already exists.'
+
+async def edit_account(username, contact_info, key):
+    user_id = await authenticate(username, key)
+
+    if (user_id != None):
+        user = await exec_get_one("""
+            UPDATE users
+            SET contact_info = %(info)s
+            WHERE id = %(user_id)s
+            AND session_key = %(key)s
+            RETURNING id""",
+            {'info': contact_info, 'user_id': user_id, 'key': str(key)})
+
+        if (user != None):
+            return "User's account info updated successfully."
+
+        sessions.invalidate(username)
+
+    return 'Cannot update account info, user does not exist.'
+
+async def delete_account(username, key):
+    user_id = await authenticate(username, key)
+
+    if (user_id != None):
+        user = await exec_get_one("""
+            DELETE FROM users
+            WHERE id = %(user_id)s
+            AND session_key = %(key)s
+            RETURNING id""",
+            {'user_id': user_id, 'key': str(key)})
+        sessions.invalidate(username)
+
+        if (user != None):
+            return 'Account successfully deleted.'
+
+    return 'Cannot remove user, does not exist or wrong session key.'
+
+'''
+Checks out a book with library.CHECKOUT_SQL, see library.checkout_book.
+Parameter:
+    check_out_date(str): The date the book is checked out, YYYY-MM-DD.
+Returns:
+    (str): A message indicating whether the book was checked out.
+'''
+async def checkout_book(library_id, title, username, key, check_out_date):
+    result = await exec_get_one(library.CHECKOUT_SQL,
+        {'library_id': library_id, 'title': title, 'username': username,
+         'key': str(key), 'check_out_date': date.fromisoformat(check_out_date)})
+    return library.checkout_outcome(result, title, username, key)
+
+# The app starts the listener as it starts up; requests only read whether it
+# is connected, as starting it or waiting for it would block the event loop.
+def _caching():
+    return library.catalog_listener.listening()
+
+'''
+Returns the catalog version for HTTP validators, see library.catalog_version.
+Returns:
+    (int): The catalog version, None while unknown or not listening.
+'''
+def catalog_version():
+    if (not _caching()):
+        return None
+    return catalog.version()
+
+'''
+Returns the library names that stock each of the given books, through the
+catalog cache. See library.get_libraries_for_books.
+Returns:
+    (dict): Book id mapped to a comma separated string of library names.
+'''
+async def get_libraries_for_books(book_ids):
+    if (not book_ids):
+        return {}
+
+    if (not _caching()):
+        return dict(await _load_availability(list(book_ids)))
+
+    generation = catalog.generation()
+    found = catalog.lookup([('availability', book_id) for book_id in book_ids])
+    libraries = {key[1]: names for key, names in found.items()}
+
+    missing = [book_id for book_id in book_ids if book_id not in libraries]
+    if (missing):
+        loaded = dict(await _load_availability(missing))
+        loaded = {book_id: loaded.get(book_id, '') for book_id in missing}
+        catalog.put_many({('availability', book_id): names for book_id, names in loaded.items()},
+                         generation)
+        libraries.update(loaded)
+
+    return {book_id: names for book_id, names in libraries.items() if names}
+
+async def _load_availability(book_ids):
+    return await exec_get_all("""
+        SELECT book_id, libraries FROM book_availability
+        WHERE book_id = ANY(%(book_ids)s)""", {'book_ids': book_ids})
+
+'''
+Runs a book query and looks up where its books are stocked. When both have
+to be read from the database, the two run at the same time on two pooled
+connections: the availability query selects the same books itself, so it
+does not wait for the book rows. That is the case when the catalog cache is
+not in use, or when a cached listing (key) has to be reloaded. Otherwise
+the books are read first and their availability comes from the cache,
+which usually needs no query at all. A statement too costly to run twice,
+such as a search, is never repeated for its availability.
+Parameters:
+    sql(str): A query selecting inventory rows, book_id first.
+    args(dict): Its parameters.
+    key(tuple): The catalog cache key for the books, None to not cache them.
+    repeatable(bool): Whether the statement is cheap enough to run twice.
+Returns:
+    (tuple): The books (tuples) and a dict of book id to library names.
+'''
+async def books_with_availability(sql, args={}, key=None, repeatable=True):
+    caching = _caching()
+    if (caching and key != None):
+        generation = catalog.generation()
+        found = catalog.lookup([key])
+        if (key in found):
+            books = found[key]
+            return books, await get_libraries_for_books([book[0] for book in books])
+
+    if ((caching and key == None) or not repeatable):
+        books = await exec_get_all(sql, args)
+        return books, await get_libraries_for_books([book[0] for book in books])
+
+    books, availability = await asyncio.gather(
+        exec_get_all(sql, args),
+        exec_get_all("""
+            SELECT book_id, libraries FROM book_availability
+            WHERE book_id IN (SELECT books.book_id FROM (""" + sql + """) AS books)""", args))
+    availability = dict(availability)
+
+    if (caching):
+        catalog.put_many({key: books}, generation)
+        catalog.put_many({('availability', book[0]): availability.get(book[0], '') for book in books},
+                         generation)
+
+    return books, {book_id: names for book_id, names in availability.items() if names}
+
+async def get_all_books():
+    return await books_with_availability("""
+        SELECT * FROM inventory
+        ORDER BY book_id ASC""", key=('books', 'all'))
+
+async def get_books_page(after, limit):
+    return await books_with_availability("""
+        SELECT * FROM inventory
+        WHERE book_id > %(after)s
+        ORDER BY book_id ASC LIMIT %(limit)s""",
+        {'after': after, 'limit': limit})
+
+def stream_all_books(batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT * FROM inventory
+        ORDER BY book_id ASC""", batch_size=batch_size)
+
+async def get_books_by_type(type):
+    if (type not in BOOK_TYPES):
+        return [], {}
+
+    return await books_with_availability("""
+        SELECT * FROM inventory
+        WHERE inventory.book_type = %(book_type)s
+        ORDER BY inventory.book_id ASC""",
+        {'book_type': BOOK_TYPES[type]}, key=('books', BOOK_TYPES[type]))
+
+async def search_by_title_or_author(term):
+    return await books_with_availability("""
+        SELECT * FROM inventory
+        WHERE inventory.title = %(term)s
+        OR inventory.author = %(term)s
+        ORDER BY inventory.book_id""", {'term': term})
+
+async def search_by_multiple_terms(type, string):
+    if (type not in BOOK_TYPES):
+        return [], {}
+
+    return await books_with_availability("""
+        SELECT * FROM inventory
+        WHERE inventory.book_type = %(book_type)s
+        AND (inventory.author = %(term)s OR inventory.title = %(term)s)
+        ORDER BY inventory.book_id""",
+        {'book_type': BOOK_TYPES[type], 'term': string})
+
+_trigram_search = None
+
+async def trigram_search_available():
+    global _trigram_search
+    if (_trigram_search == None):
+        _trigram_search = (await exec_get_one("""
+            SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"""))[0]
+    return _trigram_search
+
+'''
+Ranked full-text search, see library.search_catalog.
+Returns:
+    (tuple): Books (tuples) with their rank appended, best match first, and
+    a dict of book id to library names.
+'''
+async def search_catalog(query, limit=DEFAULT_SEARCH_LIMIT):
+    if (await trigram_search_available()):
+        sql = library.TRIGRAM_SEARCH_SQL
+    else:
+        sql = library.RANKED_SEARCH_SQL
+    args = {'query': query, 'limit': limit, 'candidates': SEARCH_CANDIDATES}
+    return await books_with_availability(sql, args, repeatable=False)
+
+'''
+Returns type-ahead suggestions, see library.get_suggestions. The app builds
+the index as it starts up; a rebuild after a catalog change reads and sorts
+the whole catalog, so it runs in a worker thread, and the index's build lock
+makes every call arriving meanwhile wait for that one build.
+'''
+async def get_suggestions(prefix, k=DEFAULT_SUGGESTIONS):
+    if (not suggestions.built):
+        return await asyncio.to_thread(library.get_suggestions, prefix, k)
+    return suggestions.suggest(prefix, k)
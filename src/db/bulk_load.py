@@ -0,0 +1,141 @@
+import argparse
+import csv
+import io
+import sys
+import time
+from .swen344_db_utils import *
+
+# CSV rows copied and merged per transaction.
+DEFAULT_BATCH_SIZE = 50000
+
+'''
+Streams a catalog CSV (same layout as src/db/Library.csv: title, author(s),
+comments, category, sub-category, copies) into the database.
+
+Rows are sent in batches with COPY FROM STDIN into a temporary staging
+table and then merged: titles already in inventory get their copies added,
+new titles are inserted. When a library is given, the copies are also
+added to that library's stock. Each batch is its own transaction, so an
+interrupted load keeps every batch that finished. Each batch notifies the
+'catalog' channel on commit so server processes drop their cached catalog.
+Parameters:
+    filename(str): Path to the csv file.
+    library_id(int): Optional library to stock the books at.
+    batch_size(int): Number of csv rows per batch.
+    progress(function): Optional callback, called after each batch with the
+    number of rows loaded so far.
+    on_batch(function): Optional callback, called with each committed batch
+    of (title, author, summary, book_type, copies) rows.
+Returns:
+    (dict): Row count, updated and inserted title counts.
+'''
+def load_catalog_csv(filename, library_id=None, batch_size=DEFAULT_BATCH_SIZE, progress=None,
+                     on_batch=None):
+    totals = {'rows': 0, 'updated': 0, 'inserted': 0}
+
+    with open(filename, newline='', encoding='utf-8-sig') as csv_file:
+        csv_reader = csv.reader(csv_file)
+        next(csv_reader)
+
+        batch = []
+        for record in csv_reader:
+            # title, author, summary, book_type, copies
+            batch.append((record[0], record[1], record[2], record[3], record[5]))
+            if (batch.__len__() == batch_size):
+                _load_batch(batch, library_id, totals, progress, on_batch)
+                batch = []
+
+        if (batch):
+            _load_batch(batch, library_id, totals, progress, on_batch)
+
+    return totals
+
+def _load_batch(batch, library_id, totals, progress, on_batch):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+
+    with transaction() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS catalog_staging(
+                title TEXT,
+                author TEXT,
+                summary TEXT,
+                book_type TEXT,
+                copies INTEGER
+            ) ON COMMIT DELETE ROWS""")
+        cur.copy_expert("""
+            COPY catalog_staging(title, author, summary, book_type, copies)
+            FROM STDIN WITH (FORMAT csv)""", buffer)
+        cur.execute("""
+            WITH batch AS (
+                SELECT title, min(author) AS author, min(summary) AS summary,
+                min(book_type) AS book_type, sum(COALESCE(copies, 0)) AS copies
+                FROM catalog_staging
+                GROUP BY title
+            ), existing AS (
+                SELECT DISTINCT ON (inventory.title) inventory.book_id, inventory.title
+                FROM inventory INNER JOIN batch ON batch.title = inventory.title
+                ORDER BY inventory.title, inventory.book_id
+            ), updated AS (
+                UPDATE inventory SET copies = (inventory.copies + batch.copies)
+                FROM existing INNER JOIN batch ON batch.title = existing.title
+                WHERE inventory.book_id = existing.book_id
+                RETURNING inventory.book_id, batch.copies
+            ), inserted AS (
+                INSERT INTO inventory(title, book_type, author, publish_date, summary, copies)
+                SELECT title, book_type, author, NULL, summary, copies FROM batch
+                WHERE NOT EXISTS (SELECT 1 FROM existing WHERE existing.title = batch.title)
+                RETURNING book_id, copies
+            ), stocked AS (
+                INSERT INTO library_stock(library_id, book_id, book_copies)
+                SELECT %(library_id)s::integer, book_id, copies
+                FROM (SELECT * FROM updated UNION ALL SELECT * FROM inserted) AS merged
+                WHERE %(library_id)s::integer IS NOT NULL
+                ON CONFLICT (library_id, book_id)
+                DO UPDATE SET book_copies = (library_stock.book_copies + EXCLUDED.book_copies)
+            )
+            SELECT (SELECT count(*) FROM updated), (SELECT count(*) FROM inserted)""",
+            {'library_id': library_id})
+        updated, inserted = cur.fetchone()
+        # tell every server process the catalog changed, delivered on commit
+        events = ['inventory:*']
+        if (library_id != None):
+            events.append('stock:*')
+        if (inserted > 0):
+            events.append('title:*')
+        cur.execute("SELECT notify_catalog(%(events)s)", {'events': events})
+
+    totals['rows'] += batch.__len__()
+    totals['updated'] += updated
+    totals['inserted'] += inserted
+
+    if (on_batch != None):
+        on_batch(batch)
+    if (progress != None):
+        progress(totals['rows'])
+
+'''
+Command line entry point:
+    cd src && python -m db.bulk_load ../src/db/Library.csv --library-id 1
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk load a catalog csv file into inventory.')
+    parser.add_argument('filename')
+    parser.add_argument('--library-id', type=int, default=None,
+                        help='also add the copies to this library\'s stock')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+
+    def report(rows):
+        elapsed = time.monotonic() - start
+        print('%d rows loaded (%.0f rows/s)' % (rows, rows / max(elapsed, 1e-9)), file=sys.stderr)
+
+    totals = load_catalog_csv(args.filename, args.library_id, args.batch_size, report)
+    print('Loaded %d rows: %d new titles, %d existing titles updated in %.2fs' %
+          (totals['rows'], totals['inserted'], totals['updated'], time.monotonic() - start))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
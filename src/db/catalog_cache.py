@@ -0,0 +1,229 @@
+import os
+import select
+import threading
+from collections import OrderedDict, deque
+from .swen344_db_utils import connect
+
+# Entries kept in memory (book listings plus per-book availability).
+DEFAULT_MAXSIZE = 100000
+# NOTIFY channel that catalog writers publish to.
+CATALOG_CHANNEL = 'catalog'
+# Seconds between wake-ups of the listener when no notification arrives.
+LISTEN_POLL_SECONDS = 5
+# Seconds a caller waits for the listener's first connection.
+LISTEN_START_TIMEOUT = 5
+# Recently heard versions remembered, in case a writer reports its own
+# version after the listener already heard it.
+SEEN_VERSIONS = 1000
+
+'''
+A thread-safe, size-bounded LRU cache for catalog reads.
+
+Keys are tuples such as ('books', 'all') or ('availability', book_id).
+Every invalidation bumps a generation counter; a value loaded while an
+invalidation happened is not stored, so a slow read racing a write can
+never put stale data back into the cache.
+
+The cache also tracks the catalog version its entries reflect: the last
+version heard from the listener. A process that wrote a change itself
+reports the version it published, and the version is unknown (None)
+until the listener hears it.
+'''
+class CatalogCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._version = None
+        self._awaiting = set()
+        self._seen = deque(maxlen=SEEN_VERSIONS)
+
+    '''
+    Returns the cached value for key, calling loader() on a miss.
+    '''
+    def get_or_load(self, key, loader):
+        found = self.lookup([key])
+        if (key in found):
+            return found[key]
+
+        generation = self.generation()
+        value = loader()
+        self.put_many({key: value}, generation)
+        return value
+
+    '''
+    Returns a dict of the cached values among keys, counting hits and misses.
+    '''
+    def lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if (key in self._entries):
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    '''
+    Stores values loaded at the given generation, unless it is stale.
+    '''
+    def put_many(self, values, generation):
+        with self._lock:
+            if (generation != self._generation):
+                return
+            for key, value in values.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while (self._entries.__len__() > self.maxsize):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    '''
+    Drops every entry whose key starts with kind, e.g. 'books'.
+    '''
+    def invalidate_kind(self, kind):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for key in [key for key in self._entries if key[0] == kind]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    '''
+    Makes the version unknown, e.g. after notifications were missed.
+    '''
+    def forget_version(self):
+        with self._lock:
+            self._version = None
+            self._awaiting.clear()
+
+    def version(self):
+        with self._lock:
+            if (self._awaiting):
+                return None
+            return self._version
+
+    '''
+    Records a version heard from the listener.
+    '''
+    def version_seen(self, version):
+        with self._lock:
+            self._version = version
+            self._awaiting.discard(version)
+            self._seen.append(version)
+
+    '''
+    Records a version this process published and has yet to hear.
+    '''
+    def expect_version(self, version):
+        with self._lock:
+            if (version not in self._seen):
+                self._awaiting.add(version)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': self._entries.__len__(), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+'''
+Listens for catalog NOTIFY events on a dedicated connection in a daemon
+thread and hands each payload to a callback.
+
+The cache may only be trusted while the listener is connected: until
+the first connection, and after any connection loss, running() is
+False. on_reconnect is called whenever a connection is (re)established,
+since notifications sent while disconnected are lost. The thread is
+restarted transparently in a forked child process.
+'''
+class CatalogListener:
+    def __init__(self, callback, on_reconnect, channel=CATALOG_CHANNEL):
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self.channel = channel
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._listening = threading.Event()
+        self._stopping = threading.Event()
+
+    '''
+    Starts the listener if needed and reports whether it is connected.
+    '''
+    def running(self):
+        if (self._pid != os.getpid() or self._thread == None or not self._thread.is_alive()):
+            with self._lock:
+                if (self._pid != os.getpid() or self._thread == None or not self._thread.is_alive()):
+                    self._start()
+            self._listening.wait(LISTEN_START_TIMEOUT)
+        return self._listening.is_set()
+
+    '''
+    Reports whether the listener is connected, without starting it or waiting.
+    '''
+    def listening(self):
+        return self._pid == os.getpid() and self._listening.is_set()
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._listening = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='catalog-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._listening.clear()
+
+    def _run(self):
+        while (not self._stopping.is_set()):
+            conn = None
+            try:
+                conn = connect()
+                conn.autocommit = True
+                conn.cursor().execute('LISTEN ' + self.channel)
+                self.on_reconnect()
+                self._listening.set()
+
+                while (not self._stopping.is_set()):
+                    if (select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], [])):
+                        continue
+                    conn.poll()
+                    while (conn.notifies):
+                        notify = conn.notifies.pop(0)
+                        self.callback(notify.payload)
+            except Exception:
+                self._listening.clear()
+                self._stopping.wait(1)
+            finally:
+                if (conn != None):
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+        self._listening.clear()
@@ -0,0 +1,345 @@
+import argparse
+import bisect
+import hashlib
+import io
+import random
+import sys
+import time
+from array import array
+from datetime import date
+from itertools import accumulate
+from .swen344_db_utils import *
+
+# Rows sent per COPY, each in its own transaction.
+DEFAULT_BATCH_SIZE = 100000
+DEFAULT_SEED = 344
+# Generated loans run up to this date, over HISTORY_DAYS before it.
+DEFAULT_END_DATE = date(2024, 12, 31)
+HISTORY_DAYS = 5 * 365
+LOAN_DAYS = 14
+# Share of loans from before the last RECENT_DAYS that were never returned.
+DEFAULT_OPEN_SHARE = 0.02
+# Share of loans from the last RECENT_DAYS still out.
+RECENT_OPEN_SHARE = 0.7
+RECENT_DAYS = 2 * LOAN_DAYS
+# Zipf exponents: how much the most popular books and most active users
+# outweigh the rest.
+BOOK_SKEW = 1.0
+USER_SKEW = 0.8
+# Every generated user can log in with this password.
+PASSWORD = 'password'
+
+# Sizes for benchmarks and load tests, by name.
+PRESETS = {
+    'tiny': {'books': 1000, 'users': 1000, 'libraries': 10, 'checkouts': 10000},
+    'small': {'books': 100000, 'users': 100000, 'libraries': 50, 'checkouts': 1000000},
+    'medium': {'books': 1000000, 'users': 1000000, 'libraries': 200, 'checkouts': 10000000},
+    'large': {'books': 5000000, 'users': 2000000, 'libraries': 500, 'checkouts': 50000000},
+}
+
+# 1,600 pronounceable words from two syllables, for titles, authors and names.
+WORDS = [a + b
+    for a in ['ka', 'lo', 'mi', 'ra', 'te', 'vin', 'dor', 'sel', 'an', 'bri',
+              'cor', 'da', 'el', 'fa', 'gor', 'hal', 'is', 'jo', 'kel', 'lu',
+              'mar', 'nor', 'ol', 'pa', 'quin', 'ros', 'sa', 'tor', 'ul', 'val',
+              'wen', 'xa', 'yor', 'zel', 'bel', 'cas', 'dun', 'fen', 'gil', 'hem']
+    for b in ['a', 'on', 'ar', 'eth', 'ir', 'um', 'os', 'wyn', 'el', 'ia',
+              'ard', 'ic', 'en', 'or', 'ath', 'is', 'un', 'ell', 'ax', 'ory',
+              'ane', 'ik', 'ow', 'ur', 'ess', 'an', 'et', 'ine', 'ok', 'ul',
+              'ire', 'ast', 'om', 'yl', 'ent', 'ost', 'ay', 'ew', 'ith', 'ond']]
+
+'''
+Returns the title of a generated book. Titles are three words, different for
+every book id below 1600^3.
+'''
+def title(book_id):
+    # multiplying by a number coprime with 1600^3 permutes the ids
+    n = (book_id * 1234577) % 4096000000
+    return ' '.join(WORDS[n // 1600 ** i % 1600].capitalize() for i in range(3))
+
+'''
+Returns the name of a generated author.
+'''
+def author(author_id):
+    return '%s %sson' % (WORDS[(author_id * 31) % 1600].capitalize(),
+                         WORDS[(author_id * 17 + author_id // 1600) % 1600].capitalize())
+
+'''
+Returns the username of a generated user.
+'''
+def username(user_id):
+    return 'user%d' % user_id
+
+'''
+Late fee for a loan returned days_late days after it was due. Mirrors the
+late_fee() SQL function (migration 002) for loans written straight to COPY.
+'''
+def late_fee(days_late):
+    if (days_late <= 0):
+        return 0
+    if (days_late <= 6):
+        return days_late * 0.25
+    return 6 * 0.25 + 2 * (days_late - 6)
+
+def _mix(x):
+    # splitmix64, a cheap well-spread hash for per-book choices
+    x = (x + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+'''
+A deterministic synthetic library: the same sizes and seed always give
+the same rows, whatever the batch size.
+
+Book popularity follows a Zipf distribution over a shuffled ranking, so
+the most borrowed books are spread through the id range, and popular
+books are stocked at more libraries. Borrowers are Zipf distributed as
+well. Loans are spread evenly over HISTORY_DAYS up to end_date and
+written in date order, as a live table grows. Most are returned within
+the loan period, some late with the late fee charged, and like
+return_book leave no due date behind. Loans from the last RECENT_DAYS
+are mostly still out, as is open_share of the older ones, which are
+overdue.
+'''
+class Dataset:
+    def __init__(self, books, users, libraries, checkouts, seed=DEFAULT_SEED,
+                 end_date=DEFAULT_END_DATE, open_share=DEFAULT_OPEN_SHARE):
+        if (min(books, users, libraries) < 1 or checkouts < 0):
+            raise ValueError('a dataset needs at least one book, user and library')
+        self.books = books
+        self.users = users
+        self.libraries = libraries
+        self.checkouts = checkouts
+        self.seed = seed
+        self.end_date = end_date
+        self.open_share = open_share
+        self.authors = max(1, books // 10)
+
+        self.book_by_rank = self._ranking('books', books)
+        self.book_rank = array('i', [0]) * (books + 1)
+        for rank, book_id in enumerate(self.book_by_rank):
+            self.book_rank[book_id] = rank
+        self.user_by_rank = self._ranking('users', users)
+        # library steps coprime with the library count visit every library
+        self.step = next(step for step in [7, 11, 13, 1] if libraries % step != 0 or step == 1)
+
+    def _random(self, stream):
+        return random.Random('%s:%s' % (self.seed, stream))
+
+    def _ranking(self, stream, count):
+        ranking = array('i', range(1, count + 1))
+        self._random(stream).shuffle(ranking)
+        return ranking
+
+    def _zipf_weights(self, count, skew):
+        return list(accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+    def _stocking(self, book_id):
+        # how many libraries stock the book, the first of them and the copies
+        rank = self.book_rank[book_id]
+        h = _mix(self.seed * 1000003 + book_id)
+        return (1 + int((self.libraries - 1) / (1 + rank * 200 / self.books)),
+                h % self.libraries, 1 + (h >> 32) % 3)
+
+    '''
+    Returns the (library_id, copies) stock of a book. The most popular book
+    is at every library, the least popular at about one in forty.
+    '''
+    def stock(self, book_id):
+        count, first, copies = self._stocking(book_id)
+        return [((first + i * self.step) % self.libraries + 1, copies) for i in range(count)]
+
+    def library_rows(self):
+        names = self._ranking('libraries', 1600)
+        for library_id in range(1, self.libraries + 1):
+            name = WORDS[names[(library_id - 1) % 1600] - 1].capitalize() + ' Library'
+            if (library_id > 1600):
+                name += ' %d' % ((library_id - 1) // 1600 + 1)
+            yield '%d\t%s\n' % (library_id, name)
+
+    def book_rows(self):
+        author_weights = self._zipf_weights(self.authors, 1.0)
+        rng = self._random('authors')
+        for book_id in range(1, self.books + 1):
+            author_id = bisect.bisect(author_weights, rng.random() * author_weights[-1]) + 1
+            h = _mix(self.seed * 7 + book_id)
+            book_type = 'Non-fiction' if h % 3 == 0 else 'Fiction'
+            summary = ' '.join(WORDS[(h >> (8 * i)) % 1600] for i in range(6))
+            copies = sum(copies for library_id, copies in self.stock(book_id))
+            yield '%d\t%s\t%s\t%s\t%d\t%s\t%d\n' % (book_id, title(book_id), book_type,
+                author(author_id), 1800 + (h >> 48) % 225, summary, copies)
+
+    def stock_rows(self):
+        for book_id in range(1, self.books + 1):
+            for library_id, copies in self.stock(book_id):
+                yield '%d\t%d\t%d\n' % (library_id, book_id, copies)
+
+    def user_rows(self):
+        password = hashlib.sha512(PASSWORD.encode()).hexdigest()
+        for user_id in range(1, self.users + 1):
+            yield '%d\t%s %sson\t%s@example.com\t%s\t%s\n' % (user_id,
+                WORDS[(user_id * 7) % 1600].capitalize(), WORDS[(user_id * 13 + user_id // 1600) % 1600].capitalize(),
+                username(user_id), username(user_id), password)
+
+    def checkout_rows(self, batch_size=DEFAULT_BATCH_SIZE):
+        book_weights = self._zipf_weights(self.books, BOOK_SKEW)
+        user_weights = self._zipf_weights(self.users, USER_SKEW)
+        book_draws = self._random('loan books')
+        user_draws = self._random('loan users')
+        rng = self._random('loans')
+
+        end_day = self.end_date.toordinal()
+        first_day = end_day - HISTORY_DAYS + 1
+        days = [date.fromordinal(day).isoformat() for day in range(first_day, end_day + LOAN_DAYS + 1)]
+
+        for start in range(0, self.checkouts, batch_size):
+            count = min(batch_size, self.checkouts - start)
+            books = book_draws.choices(self.book_by_rank, cum_weights=book_weights, k=count)
+            users = user_draws.choices(self.user_by_rank, cum_weights=user_weights, k=count)
+            for i in range(count):
+                book_id = books[i]
+                stocked, first, copies = self._stocking(book_id)
+                library_id = (first + rng.randrange(stocked) * self.step) % self.libraries + 1
+                day = (HISTORY_DAYS * (start + i)) // self.checkouts
+                due = day + LOAN_DAYS
+
+                recent = (HISTORY_DAYS - day) <= RECENT_DAYS
+                kept = rng.random()
+                returned = day + (rng.randint(1, LOAN_DAYS) if kept < 0.85 else rng.randint(LOAN_DAYS + 1, LOAN_DAYS + 30))
+                if (rng.random() < (max(RECENT_OPEN_SHARE, self.open_share) if recent else self.open_share)
+                        or returned >= HISTORY_DAYS):
+                    due_date = days[due]
+                    return_date = '\\N'
+                    fee = 0
+                else:
+                    # return_book clears the due date, so it no longer counts as overdue
+                    due_date = '\\N'
+                    return_date = days[returned]
+                    fee = late_fee(returned - due)
+                yield '%d\t%d\t%d\t%s\t%s\t%s\t%s\n' % (library_id, book_id, users[i], days[day],
+                    due_date, return_date, fee)
+
+TABLES = [
+    ('libraries', 'library_id, library_name', 'library_rows'),
+    ('inventory', 'book_id, title, book_type, author, publish_date, summary, copies', 'book_rows'),
+    ('library_stock', 'library_id, book_id, book_copies', 'stock_rows'),
+    ('users', 'id, name, contact_info, username, password', 'user_rows'),
+    ('checkout', 'library_id, book_id, user_id, check_out_date, due_date, return_date, late_fees', 'checkout_rows'),
+]
+
+# Every table generated data lands in, directly or through triggers.
+CLEARED_TABLES = ['reserve', 'checkout', 'library_stock', 'book_search', 'book_availability',
+    'library_totals', 'loan_totals', 'late_fee_runs', 'libraries', 'inventory', 'users']
+
+'''
+Replaces the contents of the library tables with a generated dataset.
+
+Rows are streamed from the Dataset into COPY, batch_size rows per COPY and
+transaction, so memory stays flat. The summary tables are kept up to date by
+their triggers as usual, and the id sequences are moved past the generated
+ids. Works on a schema with or without the migrations applied; loading
+before migrating lets the indexes be built in bulk afterwards.
+Parameters:
+    dataset(Dataset): The rows to write.
+    batch_size(int): Rows per COPY.
+    progress(function): Optional callback, called after each batch with the
+    table name and its rows written so far.
+Returns:
+    (dict): Rows written per table, the seconds taken and rows per minute.
+'''
+def load_dataset(dataset, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    start = time.monotonic()
+    existing = [table for table in CLEARED_TABLES
+                if exec_get_one('SELECT to_regclass(%(table)s)', {'table': table})[0] != None]
+    exec_commit('TRUNCATE %s RESTART IDENTITY CASCADE' % ', '.join(existing))
+
+    result = {}
+    for table, columns, rows in TABLES:
+        generator = getattr(dataset, rows)
+        rows = generator(batch_size) if rows == 'checkout_rows' else generator()
+        result[table] = _copy_rows(table, columns, rows, batch_size, progress)
+
+    exec_commit("""
+        SELECT setval('users_id_seq', GREATEST(%(users)s, 1), %(users)s > 0),
+        setval('inventory_book_id_seq', GREATEST(%(books)s, 1), %(books)s > 0),
+        setval('libraries_library_id_seq', GREATEST(%(libraries)s, 1), %(libraries)s > 0)""",
+        {'users': dataset.users, 'books': dataset.books, 'libraries': dataset.libraries})
+    exec_commit('ANALYZE')
+    # servers drop their caches of the old catalog, where the schema is migrated
+    if (exec_get_one("SELECT to_regclass('catalog_version_seq')")[0] != None):
+        exec_commit("SELECT notify_catalog(ARRAY['reset'])")
+
+    result['seconds'] = round(time.monotonic() - start, 2)
+    rows = sum(result[table] for table, columns, generator in TABLES)
+    result['rows_per_minute'] = round(rows * 60 / result['seconds']) if result['seconds'] else rows
+    return result
+
+def _copy_rows(table, columns, rows, batch_size, progress):
+    written = 0
+    while True:
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            buffer.write(row)
+            count += 1
+            if (count == batch_size):
+                break
+        if (count == 0):
+            return written
+
+        buffer.seek(0)
+        with transaction() as cur:
+            cur.copy_expert('COPY %s(%s) FROM STDIN' % (table, columns), buffer)
+        written += count
+        if (progress != None):
+            progress(table, written)
+        if (count < batch_size):
+            return written
+
+'''
+Generates and loads a dataset in one call, sized by a preset and/or explicit
+counts (which override the preset's).
+Parameters:
+    preset(str): One of PRESETS.
+    seed(int): Random seed; the same seed gives the same rows.
+    options: books, users, libraries, checkouts, end_date and open_share for
+    the Dataset, batch_size and progress for load_dataset.
+Returns:
+    (Dataset, dict): The dataset and load_dataset's result.
+'''
+def generate(preset='tiny', seed=DEFAULT_SEED, batch_size=DEFAULT_BATCH_SIZE, progress=None, **options):
+    sizes = dict(PRESETS[preset])
+    sizes.update(options)
+    dataset = Dataset(seed=seed, **sizes)
+    return dataset, load_dataset(dataset, batch_size, progress)
+
+'''
+Command line entry point, run from src/:
+    python -m db.generate --preset small
+    python -m db.generate --preset tiny --checkouts 50000 --seed 7
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replace the library tables with a generated dataset.')
+    parser.add_argument('--preset', choices=PRESETS.keys(), default='tiny')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    for size in ['books', 'users', 'libraries', 'checkouts']:
+        parser.add_argument('--' + size, type=int, help='override the preset')
+    parser.add_argument('--open-share', type=float, default=DEFAULT_OPEN_SHARE,
+                        help='share of older loans never returned')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    sizes = {size: getattr(args, size) for size in ['books', 'users', 'libraries', 'checkouts']
+             if getattr(args, size) != None}
+
+    def report(table, rows):
+        print('%s: %d rows' % (table, rows), file=sys.stderr)
+
+    dataset, result = generate(args.preset, args.seed, args.batch_size, report,
+                               open_share=args.open_share, **sizes)
+    print('Generated %s in %.1fs (%d rows per minute)' % (', '.join('%d %s' % (result[table], table)
+          for table, columns, rows in TABLES), result['seconds'], result['rows_per_minute']))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+import argparse
+import sys
+import time
+from .swen344_db_utils import *
+
+# Open loans updated per transaction.
+DEFAULT_CHUNK_SIZE = 100000
+
+'''
+Recalculates the late fees of every open overdue loan as of a date, using
+the same tiered rules as a return (the late_fee SQL function).
+
+Loans are walked in user id order, about chunk_size open loans per
+transaction, through the open loans index. Each chunk also advances the
+run's checkpoint in late_fee_runs, so a run interrupted part way resumes
+after the last committed chunk, and a finished run is not repeated. Only
+loans whose fee changes are written, so running the job twice for a date
+changes nothing the second time.
+Parameters:
+    as_of(str): The date fees accrue to, today by default.
+    chunk_size(int): Open loans per transaction, 0 to update every loan in
+    one statement.
+    progress(function): Optional callback, called after each chunk with the
+    number of loans updated so far.
+Returns:
+    (dict): The accrual date, loans updated, chunks run, whether an earlier
+    run was resumed and the seconds taken.
+'''
+def accrue_late_fees(as_of=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    start = time.monotonic()
+    as_of, last_user_id, finished = _start_run(as_of)
+    result = {'as_of': str(as_of), 'loans': 0, 'chunks': 0, 'resumed': last_user_id > 0}
+
+    while (not finished):
+        updated, finished = _accrue_chunk(as_of, chunk_size)
+        result['loans'] += updated
+        result['chunks'] += 1
+        if (progress != None):
+            progress(result['loans'])
+
+    result['seconds'] = round(time.monotonic() - start, 3)
+    return result
+
+def _start_run(as_of):
+    with transaction() as cur:
+        cur.execute("""
+            INSERT INTO late_fee_runs(as_of)
+            VALUES (COALESCE(%(as_of)s::date, CURRENT_DATE))
+            ON CONFLICT (as_of) DO UPDATE SET as_of = EXCLUDED.as_of
+            RETURNING as_of, last_user_id, finished_at IS NOT NULL""",
+            {'as_of': as_of})
+        return cur.fetchone()
+
+def _accrue_chunk(as_of, chunk_size):
+    with transaction() as cur:
+        # the checkpoint row lock makes concurrent runs take turns, each
+        # continuing from the other's last chunk
+        cur.execute("""
+            SELECT last_user_id, finished_at IS NOT NULL FROM late_fee_runs
+            WHERE as_of = %(as_of)s FOR UPDATE""", {'as_of': as_of})
+        last_user_id, finished = cur.fetchone()
+        if (finished):
+            return 0, True
+
+        # the chunk ends with a whole borrower, so no loan is split across chunks
+        bound = None
+        if (chunk_size):
+            cur.execute("""
+                SELECT user_id FROM checkout
+                WHERE return_date IS NULL AND user_id > %(after)s
+                ORDER BY user_id OFFSET %(offset)s LIMIT 1""",
+                {'after': last_user_id, 'offset': chunk_size - 1})
+            row = cur.fetchone()
+            bound = row[0] if row != None else None
+
+        cur.execute("""
+            UPDATE checkout SET late_fees = late_fee(%(as_of)s - due_date)
+            WHERE return_date IS NULL
+            AND due_date < %(as_of)s
+            AND user_id > %(after)s
+            AND (%(bound)s::integer IS NULL OR user_id <= %(bound)s)
+            AND late_fees IS DISTINCT FROM late_fee(%(as_of)s - due_date)""",
+            {'as_of': as_of, 'after': last_user_id, 'bound': bound})
+        updated = cur.rowcount
+
+        cur.execute("""
+            UPDATE late_fee_runs
+            SET last_user_id = COALESCE(%(bound)s, last_user_id),
+            loans_updated = (loans_updated + %(updated)s),
+            finished_at = CASE WHEN %(bound)s::integer IS NULL THEN now() END
+            WHERE as_of = %(as_of)s""",
+            {'as_of': as_of, 'bound': bound, 'updated': updated})
+
+    return updated, bound == None
+
+'''
+Command line entry point for the nightly job:
+    cd src && python -m db.late_fees
+    cd src && python -m db.late_fees --as-of 2022-12-31 --chunk-size 50000
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Accrue late fees on open overdue loans.')
+    parser.add_argument('--as-of', default=None, help='date fees accrue to, YYYY-MM-DD (default today)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='open loans per transaction, 0 for a single statement')
+    args = parser.parse_args(argv)
+
+    def report(loans):
+        print('%d loans updated' % loans, file=sys.stderr)
+
+    result = accrue_late_fees(args.as_of, args.chunk_size, report)
+    print('Late fees as of %s: %d loans updated in %d chunks in %.2fs%s' %
+          (result['as_of'], result['loans'], result['chunks'], result['seconds'],
+           ' (resumed)' if result['resumed'] else ''))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
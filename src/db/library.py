@@ -1,16 +1,117 @@
-import csv
-from datetime import datetime
 import hashlib
 import secrets
 import string
 from .swen344_db_utils import *
+from .migrate import rebuild_schema
+from .bulk_load import load_catalog_csv
+from .session_cache import SessionCache
+from .suggest import PrefixIndex, TITLE, AUTHOR, DEFAULT_SUGGESTIONS
+from .catalog_cache import CatalogCache, CatalogListener
+
+# Sessions validated by login() or authenticate(), shared by this process.
+sessions = SessionCache()
+# Type-ahead index over titles and authors, built on first use or by load_suggestions().
+suggestions = PrefixIndex()
+# Book listings and availability, kept coherent by the catalog listener.
+catalog = CatalogCache()
 
+'''
+Drops and recreates every table with the sample data, for tests. Destroys
+all data; deploys use python -m db.migrate instead.
+'''
 def rebuild_tables():
-    drop_sql = """
-        DROP SCHEMA IF EXISTS library CASCADE;
-    """
-    exec_commit(drop_sql)
-    exec_sql_file('src/db/library_schema.sql')
+    version = rebuild_schema()
+    sessions.clear()
+    catalog_published(version, 'reset')
+
+'''
+Applies a catalog change event to this process's caches. Writers publish
+events with the notify_catalog SQL function in the same statement as the
+change, and every process hears them on the 'catalog' channel through
+catalog_listener. Each change ends with the new catalog version.
+Events:
+    inventory:<book_id>  a book's inventory row changed (book listings).
+    stock:<book_id>      a book's library stock changed (its availability).
+    title:<book_id>      a new book was added (type-ahead suggestions).
+    inventory:*, stock:*, title:*  many books changed at once.
+    reset                the tables were rebuilt.
+    version:<n>          the catalog is now at version n.
+Parameter:
+    event(str): The notification payload.
+'''
+def catalog_changed(event):
+    kind, _, book_id = event.partition(':')
+
+    if (kind == 'version'):
+        catalog.version_seen(int(book_id))
+    elif (kind == 'inventory'):
+        catalog.invalidate_kind('books')
+    elif (kind == 'stock' and book_id == '*'):
+        catalog.invalidate_kind('availability')
+    elif (kind == 'stock'):
+        catalog.invalidate([('availability', int(book_id))])
+    elif (kind == 'title' and book_id == '*'):
+        suggestions.invalidate()
+    elif (kind == 'title'):
+        _suggest_book(int(book_id))
+    else:
+        catalog.clear()
+        suggestions.invalidate()
+
+def _suggest_book(book_id):
+    if (suggestions.tracking()):
+        book = exec_get_one("SELECT title, author FROM inventory WHERE book_id = %(book_id)s",
+                            {'book_id': book_id})
+        if (book != None):
+            suggestions.add(book[0], TITLE)
+            suggestions.add(book[1], AUTHOR)
+
+'''
+Applies a writer's own catalog events right away, so its next read is never
+stale, and leaves the catalog version unknown until the listener hears the
+version the change published.
+Parameters:
+    version(int): The version returned by notify_catalog.
+    events(str): The events the writer published.
+'''
+def catalog_published(version, *events):
+    for event in events:
+        catalog_changed(event)
+    catalog.expect_version(version)
+
+'''
+Changes made while the listener was disconnected were missed, so every
+connection starts with empty caches and publishes a fresh catalog version.
+'''
+def _catalog_connected():
+    catalog_changed('reset')
+    catalog.forget_version()
+    catalog.expect_version(exec_get_one("SELECT notify_catalog(ARRAY[]::TEXT[])")[0])
+
+catalog_listener = CatalogListener(catalog_changed, _catalog_connected)
+
+'''
+Returns the catalog version that cached catalog reads reflect, for HTTP
+validators. Answering from it needs no database access.
+Returns:
+    (int): The catalog version, None while unknown or not listening.
+'''
+def catalog_version():
+    if (not catalog_listener.running()):
+        return None
+    return catalog.version()
+
+'''
+Reads through the catalog cache. The cache is only used while this process
+is listening for catalog changes; otherwise the database is read directly.
+Parameters:
+    key(tuple): The cache key.
+    loader(function): Reads the value from the database.
+'''
+def _cached(key, loader):
+    if (not catalog_listener.running()):
+        return loader()
+    return catalog.get_or_load(key, loader)
 
 '''
 Checks to see if the username and password
@@ -40,6 +141,7 @@ def login(username, password):
             WHERE username = %(username)s
             AND password = %(password)s""",
             {'key': key, 'username': username, 'password': hashed})
+        sessions.put(username, key, user[0])
 
         message = {'Login successful.': str(key)}
         return message
@@ -47,6 +149,32 @@ def login(username, password):
     else:
         return 'Login unsuccessful, incorrect password.'
 
+'''
+Checks a username and session key, consulting the session cache before
+the database. Sessions found in the database are cached for next time.
+Parameters:
+    username(str): A username.
+    key(int): A session key.
+Returns:
+    (int): The user's id, None if the session is not valid.
+'''
+def authenticate(username, key):
+    user_id = sessions.get(username, key)
+    if (user_id != None):
+        return user_id
+
+    user = exec_get_one("""
+        SELECT id FROM users
+        WHERE username = %(username)s
+        AND session_key = %(key)s""",
+        {'username': username, 'key': key})
+
+    if (user == None):
+        return None
+
+    sessions.put(username, key, user[0])
+    return user[0]
+
 '''
 Returns all of the users in the system.
 Returns:
@@ -55,6 +183,33 @@ Returns:
 def get_all_users():
     return exec_get_all("SELECT * FROM users ORDER BY id ASC")
 
+'''
+Returns one page of users ordered by id, starting after the given id.
+Parameters:
+    after(int): Last user id of the previous page, 0 for the first page.
+    limit(int): Maximum number of users to return.
+Returns:
+    (list): A list of users (id, name, contact_info).
+'''
+def get_users_page(after, limit):
+    return exec_get_all("""
+        SELECT id, name, contact_info FROM users
+        WHERE id > %(after)s
+        ORDER BY id ASC LIMIT %(limit)s""",
+        {'after': after, 'limit': limit})
+
+'''
+Streams every user ordered by id through a server-side cursor.
+Parameter:
+    batch_size(int): Number of users fetched per round trip.
+Returns:
+    (generator): Lists of users (id, name, contact_info).
+'''
+def stream_all_users(batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT id, name, contact_info FROM users
+        ORDER BY id ASC""", batch_size=batch_size)
+
 '''
 Returns a user's id given their username.
 Parameter: 
@@ -82,9 +237,36 @@ Returns:
     (list): A list of books (tuples).
 '''
 def get_all_books():
+    return _cached(('books', 'all'), lambda: exec_get_all("""
+        SELECT * FROM inventory
+        ORDER BY book_id ASC"""))
+
+'''
+Returns one page of books ordered by book id, starting after the given id.
+Parameters:
+    after(int): Last book id of the previous page, 0 for the first page.
+    limit(int): Maximum number of books to return.
+Returns:
+    (list): A list of books (tuples).
+'''
+def get_books_page(after, limit):
     return exec_get_all("""
         SELECT * FROM inventory
-    """)
+        WHERE book_id > %(after)s
+        ORDER BY book_id ASC LIMIT %(limit)s""",
+        {'after': after, 'limit': limit})
+
+'''
+Streams every book in inventory ordered by book id through a server-side cursor.
+Parameter:
+    batch_size(int): Number of books fetched per round trip.
+Returns:
+    (generator): Lists of books (tuples).
+'''
+def stream_all_books(batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT * FROM inventory
+        ORDER BY book_id ASC""", batch_size=batch_size)
 
 '''
 Returns all the books currently checked out by a user.
@@ -118,16 +300,33 @@ def get_checked_out_books():
         ORDER BY inventory.book_type, inventory.author ASC
     """)
 
+# Genre names used in URLs mapped to the book_type stored in inventory.
+BOOK_TYPES = {'fiction': 'Fiction', 'non-fiction': 'Non-fiction'}
+
+'''
+Returns all of the books in the inventory of the given genre.
+Parameter:
+    type(str): A genre as used in URLs, either fiction or non-fiction.
+Returns:
+    (list): A list of books (tuples), empty for an unknown genre.
+'''
+def get_books_by_type(type):
+    if (type not in BOOK_TYPES):
+        return []
+
+    return _cached(('books', BOOK_TYPES[type]), lambda: exec_get_all("""
+        SELECT * FROM inventory
+        WHERE inventory.book_type = %(book_type)s
+        ORDER BY inventory.book_id ASC""",
+        {'book_type': BOOK_TYPES[type]}))
+
 '''
 Returns all of the nonfiction books in the inventory.
 Returns:
     (list): A list of books (tuples).
 '''
 def get_nonfiction_books():
-    return exec_get_all("""
-        SELECT * FROM inventory
-        WHERE inventory.book_type = 'Non-fiction'
-    """)
+    return get_books_by_type('non-fiction')
 
 '''
 Returns all of the fiction books in the inventory.
@@ -135,10 +334,7 @@ Returns:
     (list): A list of books (tuples).
 '''
 def get_fiction_books():
-    return exec_get_all("""
-        SELECT * FROM inventory
-        WHERE inventory.book_type = 'Fiction'
-    """)
+    return get_books_by_type('fiction')
 
 '''
 Returns all the books in the inventory that are written by a particular author.
@@ -165,41 +361,151 @@ def search_by_title(title):
         WHERE inventory.title = %(title)s""", {'title': title})
 
 '''
-Returns all books that matches multiple search terms.
+Returns all of the books in the inventory whose title or author matches
+the search term, with a single query.
+Parameter:
+    term(str): A book title or an author's name.
+Returns:
+    (list): A list of books (tuples).
+'''
+def search_by_title_or_author(term):
+    return exec_get_all("""
+        SELECT * FROM inventory
+        WHERE inventory.title = %(term)s
+        OR inventory.author = %(term)s
+        ORDER BY inventory.book_id""", {'term': term})
+
+# Default and maximum number of results from search_catalog.
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Most matches search_catalog ranks for one query.
+SEARCH_CANDIDATES = 500
+
+_trigram_search = None
+
+'''
+Checks once whether the pg_trgm extension is installed, which enables
+typo tolerant matching in search_catalog.
+'''
+def trigram_search_available():
+    global _trigram_search
+    if (_trigram_search == None):
+        _trigram_search = exec_get_one("""
+            SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')""")[0]
+    return _trigram_search
+
+# Statements behind search_catalog, also run by the async API. A common word
+# matches thousands of books, so only the first SEARCH_CANDIDATES matches
+# found are ranked, rather than every match.
+RANKED_SEARCH_SQL = """
+    WITH matches AS (
+        SELECT book_search.book_id, ts_rank(book_search.document, search) AS rank
+        FROM book_search, websearch_to_tsquery('english', %(query)s) AS search
+        WHERE book_search.document @@ search
+        LIMIT %(candidates)s
+    ), ranked AS (
+        SELECT * FROM matches
+        ORDER BY rank DESC, book_id LIMIT %(limit)s
+    )
+    SELECT inventory.*, ranked.rank
+    FROM ranked
+    INNER JOIN inventory ON inventory.book_id = ranked.book_id
+    ORDER BY ranked.rank DESC, inventory.book_id"""
+
+# With pg_trgm: as above, but when no book matches the words themselves,
+# rank titles and authors by trigram word similarity instead. The trigram
+# indexes are only scanned then, as scanning them costs more than the
+# full-text search.
+TRIGRAM_SEARCH_SQL = """
+    WITH matches AS (
+        SELECT book_search.book_id, ts_rank(book_search.document, search) AS rank
+        FROM book_search, websearch_to_tsquery('english', %(query)s) AS search
+        WHERE book_search.document @@ search
+        LIMIT %(candidates)s
+    ), ranked AS (
+        SELECT * FROM matches
+        UNION ALL
+        (SELECT book_id, GREATEST(
+            word_similarity(%(query)s, title),
+            word_similarity(%(query)s, author))
+        FROM inventory
+        WHERE NOT EXISTS (SELECT 1 FROM matches)
+        AND (%(query)s <%% title OR %(query)s <%% author)
+        LIMIT %(candidates)s)
+        ORDER BY rank DESC, book_id LIMIT %(limit)s
+    )
+    SELECT inventory.*, ranked.rank
+    FROM ranked
+    INNER JOIN inventory ON inventory.book_id = ranked.book_id
+    ORDER BY ranked.rank DESC, inventory.book_id"""
+
+'''
+Ranked full-text search over book titles, authors and summaries. Accepts
+web search syntax ("quoted phrases", -excluded words, or). When pg_trgm is
+installed and no book matches the words, titles and authors are matched on
+trigram word similarity instead, so misspellings such as "Tolkin" still
+find a book.
+Parameters:
+    query(str): The search text.
+    limit(int): Maximum number of books to return.
+Returns:
+    (list): Books (tuples) with their rank appended, best match first.
+'''
+def search_catalog(query, limit=DEFAULT_SEARCH_LIMIT):
+    args = {'query': query, 'limit': limit, 'candidates': SEARCH_CANDIDATES}
+    if (trigram_search_available()):
+        return exec_get_all(TRIGRAM_SEARCH_SQL, args)
+
+    return exec_get_all(RANKED_SEARCH_SQL, args)
+
+def _suggestion_entries():
+    for rows in exec_stream("SELECT title, author FROM inventory"):
+        for title, author in rows:
+            yield title, TITLE
+            yield author, AUTHOR
+
+'''
+Builds the in-memory title and author prefix index from the inventory,
+streaming the rows so only the index itself is held in memory. Servers
+call it as they start, once the catalog listener is connected, so no
+request waits for the build.
+'''
+def load_suggestions():
+    suggestions.build(_suggestion_entries())
+
+'''
+Returns type-ahead suggestions for titles and authors from the in-memory
+prefix index, without querying the database once the index is built. If
+it is not, the calls that arrive meanwhile wait for a single build.
+Parameters:
+    prefix(str): The text typed so far.
+    k(int): Maximum number of suggestions.
+Returns:
+    (list): Matching titles and authors in alphabetical order.
+'''
+def get_suggestions(prefix, k=DEFAULT_SUGGESTIONS):
+    suggestions.ensure_built(_suggestion_entries)
+    return suggestions.suggest(prefix, k)
+
+'''
+Returns all books that matches multiple search terms, with a single query.
 Parameters:
     type(str): First search term, either fiction or non-fiction.
     string(str): Second search term, either a title or author.
 Returns:
-    (list): A list of books that matches the search terms.
+    (list): A list of books that matches the search terms, empty for an
+    unknown genre.
 '''
 def search_by_multiple_terms(type, string):
-    if (type == 'fiction'):
-        if(search_by_author(string) != None):
-            return exec_get_all("""
-                SELECT * FROM inventory
-                WHERE inventory.author = %(author)s
-                AND inventory.book_type = 'Fiction'""",
-                {'author': string})
-        elif(search_by_title(string) != None):
-            return exec_get_all("""
-                SELECT * FROM inventory
-                WHERE inventory.title = %(title)s
-                AND inventory.book_type = 'Fiction'""",
-                {'title': string})
-
-    elif (type == 'non-fiction'):
-        if(search_by_author(string) != None):
-            return exec_get_all("""
-                SELECT * FROM inventory
-                WHERE inventory.author = %(author)s
-                AND inventory.book_type = 'Non-fiction'""",
-                {'author': string})
-        elif(search_by_title(string) != None):
-            return exec_get_all("""
-                SELECT * FROM inventory
-                WHERE inventory.title = %(title)s
-                AND inventory.book_type = 'Non-fiction'""",
-                {'title': string})
+    if (type not in BOOK_TYPES):
+        return []
+
+    return exec_get_all("""
+        SELECT * FROM inventory
+        WHERE inventory.book_type = %(book_type)s
+        AND (inventory.author = %(term)s OR inventory.title = %(term)s)
+        ORDER BY inventory.book_id""",
+        {'book_type': BOOK_TYPES[type], 'term': string})
 
 '''
 Returns the number of book copies at the specified library given
@@ -225,25 +531,49 @@ Returns:
     (str): A string format of all the libraries.
 '''
 def get_libraries_with_book(book_id):
-    libraries = exec_get_all("""
-        SELECT libraries.library_name
-        FROM library_stock
-        INNER JOIN libraries ON libraries.library_id = library_stock.library_id
-        WHERE book_id = %(book_id)s""",
-        {'book_id': book_id})
+    return get_libraries_for_books([book_id]).get(book_id, '')
+
+'''
+Returns the library names that have each of the given books in their
+inventory. Books missing from the catalog cache are looked up in the
+book_availability summary with a single query and cached, including the
+ones not stocked anywhere.
+Parameter:
+    book_ids(list): A list of book ids.
+Returns:
+    (dict): Book id mapped to a comma separated string of library names.
+    Books not stocked anywhere are left out.
+'''
+def get_libraries_for_books(book_ids):
+    if (not book_ids):
+        return {}
+
+    if (not catalog_listener.running()):
+        return _load_libraries_for_books(book_ids)
+
+    generation = catalog.generation()
+    found = catalog.lookup([('availability', book_id) for book_id in book_ids])
+    libraries = {key[1]: names for key, names in found.items()}
 
-    string = ''
-    index = 0
-    for library in libraries:
-        if (index == 0):
-            string = library[0]
-            index += 1
+    missing = [book_id for book_id in book_ids if book_id not in libraries]
+    if (missing):
+        loaded = _load_libraries_for_books(missing)
+        loaded = {book_id: loaded.get(book_id, '') for book_id in missing}
+        catalog.put_many({('availability', book_id): names for book_id, names in loaded.items()},
+                         generation)
+        libraries.update(loaded)
 
-        elif (index < libraries.__len__()):
-            string = string + ', ' + library[0]
-            index += 1
+    return {book_id: names for book_id, names in libraries.items() if names}
 
-    return string
+# book_availability holds each book's library list, maintained by triggers
+# on library_stock (see migration 005)
+def _load_libraries_for_books(book_ids):
+    rows = exec_get_all("""
+        SELECT book_id, libraries FROM book_availability
+        WHERE book_id = ANY(%(book_ids)s)""",
+        {'book_ids': list(book_ids)})
+
+    return dict(rows)
 
 '''
 Returns the corresponding book id given the book title.
@@ -303,23 +633,25 @@ Returns:
     or not.
 '''
 def edit_account(username, contact_info, key):
-    user = exec_get_one("""
-        SELECT * FROM users
-        WHERE username = %(username)s
-        AND session_key = %(key)s""",
-        {'username': username, 'key': key})
+    user_id = authenticate(username, key)
 
-    if (user != None):
-        exec_commit("""
+    # the session key is checked again by the update itself, so a session
+    # replaced since it was cached cannot be used
+    if (user_id != None):
+        user = exec_get_one("""
             UPDATE users
             SET contact_info = %(info)s
-            WHERE username = %(username)s""",
-            {'info': contact_info, 'username': username})
+            WHERE id = %(user_id)s
+            AND session_key = %(key)s
+            RETURNING id""",
+            {'info': contact_info, 'user_id': user_id, 'key': key})
 
-        return "User's account info updated successfully."
-    
-    else:
-        return 'Cannot update account info, user does not exist.'
+        if (user != None):
+            return "User's account info updated successfully."
+
+        sessions.invalidate(username)
+
+    return 'Cannot update account info, user does not exist.'
 
 '''
 Deletes a user's account given their name.
@@ -329,23 +661,21 @@ Returns:
     (str): A message indicating whether or not account was deleted.
 '''
 def delete_account(username, key):
-    user = exec_get_one("""
-        SELECT * FROM users
-        WHERE username = %(username)s
-        AND session_key = %(key)s""",
-        {'username': username, 'key': key})
+    user_id = authenticate(username, key)
 
-    if (user != None):
-        exec_commit("""
+    if (user_id != None):
+        user = exec_get_one("""
             DELETE FROM users
-            WHERE username = %(username)s
-            AND session_key = %(key)s""",
-            {'username': username, 'key': key})
+            WHERE id = %(user_id)s
+            AND session_key = %(key)s
+            RETURNING id""",
+            {'user_id': user_id, 'key': key})
+        sessions.invalidate(username)
 
-        return 'Account successfully deleted.'
+        if (user != None):
+            return 'Account successfully deleted.'
 
-    else:
-        return 'Cannot remove user, does not exist or wrong session key.'
+    return 'Cannot remove user, does not exist or wrong session key.'
 
 '''
 When books are checked out, they have a pre-assigned maximum lending
@@ -362,9 +692,58 @@ def add_due_date(user_id, book_id):
         AND book_id = %(book_id)s""",
         {'user_id': user_id, 'book_id': book_id})
 
+# The single statement behind checkout_book, also run by the async API.
+CHECKOUT_SQL = """
+    WITH account AS (
+        SELECT users.id, EXISTS (
+            SELECT 1 FROM checkout
+            WHERE checkout.user_id = users.id
+            AND checkout.due_date < %(check_out_date)s) AS overdue
+        FROM users
+        WHERE username = %(username)s
+        AND session_key = %(key)s
+        LIMIT 1
+    ), book AS (
+        SELECT inventory.book_id FROM inventory
+        WHERE inventory.title = %(title)s
+        ORDER BY inventory.book_id LIMIT 1
+    ), stock AS (
+        UPDATE library_stock SET book_copies = (book_copies - 1)
+        FROM account, book
+        WHERE NOT account.overdue
+        AND library_stock.library_id = %(library_id)s
+        AND library_stock.book_id = book.book_id
+        AND library_stock.book_copies > 0
+        RETURNING library_stock.book_id
+    ), master AS (
+        UPDATE inventory SET copies = (copies - 1)
+        FROM stock
+        WHERE inventory.book_id = stock.book_id
+    ), loan AS (
+        INSERT INTO checkout (library_id, book_id, user_id, check_out_date, due_date)
+        SELECT %(library_id)s, stock.book_id, account.id, %(check_out_date)s,
+        %(check_out_date)s::date + interval '2 weeks'
+        FROM stock, account
+    ), notified AS (
+        SELECT stock.book_id, notify_catalog(ARRAY['inventory:' || stock.book_id,
+        'stock:' || stock.book_id]) AS version
+        FROM stock
+    )
+    SELECT account.id, account.overdue, notified.book_id, notified.version
+    FROM account LEFT JOIN notified ON true"""
+
 '''
 User checks out a book at a given library. If a user is overdue on a book,
 no further checkouts will be allowed.
+
+The session check, overdue check, stock updates and the checkout row (with
+its 2 week due date) are all done by one statement, so a checkout is a single
+round trip and either fully happens or not at all. The catalog change is
+published by the same statement. Since the session is
+checked inside that statement, checkout does not consult the session cache,
+it only records a valid session in it. Stock is only taken while copies
+remain; concurrent checkouts of the last copy wait on the stock row's lock
+and all but one of them find it gone.
 Parameter:
     library_id(int): A library id.
     title(str): A book title.
@@ -372,64 +751,48 @@ Parameter:
     key(int): Session key.
     check_out_date(str): The date the book is checked out.
 Returns:
-    (tuple): Info regarding the checkout - date checked out, due date etc
+    (str): A message indicating whether the book was checked out.
 '''
 def checkout_book(library_id, title, username, key, check_out_date):
-    user = exec_get_one("""
-        SELECT * FROM users
-        WHERE username = %(username)s
-        AND session_key = %(key)s""",
-        {'username': username, 'key': key})
+    result = exec_get_one(CHECKOUT_SQL,
+        {'library_id': library_id, 'title': title, 'username': username,
+         'key': key, 'check_out_date': check_out_date})
+    return checkout_outcome(result, title, username, key)
 
-    if (user == None):
+'''
+Turns the row returned by CHECKOUT_SQL into checkout_book's message,
+recording the session and publishing the catalog change.
+Parameters:
+    result(tuple): The statement's row, None if the session was not valid.
+    title(str): The book title.
+    username(str): A username.
+    key(int): Session key.
+Returns:
+    (str): A message indicating whether the book was checked out.
+'''
+def checkout_outcome(result, title, username, key):
+    if (result == None):
+        sessions.invalidate(username)
         return 'No authentication, cannot checkout book.'
 
-    user_id = get_user_id(username)
-
-    # check if there's any overdue books, if there are, user cannot make further checkouts
-    due_dates = exec_get_all("""
-        SELECT due_date FROM checkout
-        WHERE user_id = %(user_id)s
-        AND due_date IS NOT NULL""",
-        {'user_id': user_id})
-
-    overdue = 0
-    for dates in due_dates:
-        if (datetime.strptime(check_out_date, '%Y-%m-%d').date() > dates[0]):
-            overdue += 1
-            break
-    
-    if (overdue == 1):
+    user_id, overdue, book_id, version = result
+    sessions.put(username, key, user_id)
+    if (overdue):
         raise Exception("Cannot checkout book because user has an overdue book")
 
-    else:
-        book_id = get_book_id(title)
-
-        # updates master inventory count
-        exec_commit("""
-            UPDATE inventory SET copies = (copies - 1)
-            WHERE book_id = %(book_id)s""", {'book_id': book_id})
-
-        # updates library inventory count
-        exec_commit("""
-            UPDATE library_stock SET book_copies = (book_copies - 1)
-            WHERE book_id = %(book_id)s
-            AND library_stock.library_id = %(library_id)s""",
-            {'book_id': book_id, 'library_id': library_id})
-
-        exec_commit("""
-            INSERT INTO checkout (library_id, book_id, user_id, check_out_date)
-            VALUES (%(library_id)s, %(book_id)s, %(user_id)s, %(check_out_date)s)""",
-            {'library_id': library_id, 'book_id': book_id, 'user_id': user_id, 'check_out_date': check_out_date})
-
-        # add maximum lending time of 2 weeks
-        add_due_date(user_id, book_id)
+    if (book_id == None):
+        return 'No copies of ' + title + ' are available at this library.'
 
-        return title + ' successfully checked out.'
+    catalog_published(version, 'inventory:%d' % book_id, 'stock:%d' % book_id)
+    return title + ' successfully checked out.'
 
 '''
 User returns a book at a given library. Also calculates the late
 fees if the book was overdue.
+
+The return date, late fee (see the late_fee SQL function) and both stock
+counts are updated by one statement, which also publishes the catalog
+change, so a return is a single round trip and cannot be half applied.
 Parameter:
     library_id(int): A library id.
     book_id(int): A book id.
@@ -439,40 +802,52 @@ Returns:
     (tuple): The full checkout history - date checked out, date returned etc
 '''
 def return_book(library_id, book_id, user_id, return_date):
-    # updates master inventory
-    exec_commit("""
-        UPDATE inventory SET copies = (copies + 1)
-        WHERE book_id = %(book_id)s""", {'book_id': book_id})
-
-    # updates library inventory
-    exec_commit("""
-        UPDATE library_stock SET book_copies = (book_copies + 1)
-        WHERE book_id = %(book_id)s
-        AND library_stock.library_id = %(library_id)s""",
-        {'book_id': book_id, 'library_id': library_id})
-    
-    # calculate any late fees
-    days_late, fee = apply_late_fees(user_id, book_id, return_date)
-    if(fee > 0.0):
-        print('\nYou returned your book', int(days_late), 'days late. You have a late fee of $', fee)
-
-    # updates table to show return date & sets previous due date to null
-    exec_commit("""
-        UPDATE checkout SET return_date = %(return_date)s,
-        due_date = NULL
-        WHERE book_id = %(book_id)s
-        AND user_id = %(user_id)s
-        AND checkout.library_id = %(library_id)s""",
+    returned = exec_get_one("""
+        WITH loan AS (
+            SELECT ctid, GREATEST(%(return_date)s::date - due_date, 0) AS days_late
+            FROM checkout
+            WHERE user_id = %(user_id)s
+            AND book_id = %(book_id)s
+            AND library_id = %(library_id)s
+            AND return_date IS NULL
+            ORDER BY check_out_date LIMIT 1
+            FOR UPDATE
+        ), returned AS (
+            UPDATE checkout SET return_date = %(return_date)s,
+            due_date = NULL,
+            late_fees = CASE WHEN loan.days_late > 0
+                THEN late_fee(loan.days_late) ELSE checkout.late_fees END
+            FROM loan
+            WHERE checkout.ctid = loan.ctid
+            RETURNING checkout.*, loan.days_late
+        ), stock AS (
+            UPDATE library_stock SET book_copies = (book_copies + 1)
+            WHERE book_id = %(book_id)s
+            AND library_id = %(library_id)s
+            AND EXISTS (SELECT 1 FROM returned)
+        ), master AS (
+            UPDATE inventory SET copies = (copies + 1)
+            WHERE book_id = %(book_id)s
+            AND EXISTS (SELECT 1 FROM returned)
+        ), notified AS (
+            SELECT notify_catalog(ARRAY['inventory:' || %(book_id)s, 'stock:' || %(book_id)s])
+            AS version
+            FROM returned
+        )
+        SELECT returned.*, notified.version FROM returned, notified""",
         {'return_date': return_date, 'book_id': book_id, 'user_id': user_id, 'library_id': library_id})
 
-    # return
-    sql = exec_get_all("""
-            SELECT * FROM checkout
-            WHERE user_id = %(user_id)s
-            AND book_id = %(book_id)s""",
-            {'user_id': user_id, 'book_id': book_id})[0]
+    if (returned == None):
+        raise Exception("Cannot return book, user has not checked it out from this library")
 
-    return sql
+    catalog_published(returned[-1], 'inventory:%d' % book_id, 'stock:%d' % book_id)
+    returned = returned[:-1]
+    days_late = returned[-1]
+    fee = returned[-2]
+    if(days_late > 0):
+        print('\nYou returned your book', days_late, 'days late. You have a late fee of $', fee)
+
+    return returned[:-1]
 
 '''
 User reserves a book, only reserves successfully if there are no copies
@@ -494,25 +869,21 @@ def reserve_book(library_id, reserve_book_id, user_id):
 
 '''
 Loads the set of information on books from a file and adds it to the database.
+Titles already in the inventory get the extra copies added. See
+bulk_load.load_catalog_csv for batch size, library stock and progress options.
 Parameter:
     filename(str): Csv file with test data.
+Returns:
+    (dict): Row count, updated and inserted title counts.
 '''
-def insert_data_from_csv(filename):
-    with open(filename) as csv_file:
-        csv_reader = csv.reader(csv_file)
-        next(csv_reader)
+def insert_data_from_csv(filename, **options):
+    return load_catalog_csv(filename, on_batch=_catalog_batch_loaded, **options)
 
-        for record in csv_reader:
-            title = record[0]
-            author = record[1]
-            summary = record[2]
-            book_type = record[3]
-            copies = record[5]
-
-            exec_commit("""
-                INSERT INTO inventory(title, book_type, author, publish_date, summary, copies)
-                VALUES (%(title)s, %(book_type)s, %(author)s, NULL, %(summary)s, %(copies)s)""",
-                {'title': title, 'book_type': book_type, 'author': author, 'summary': summary, 'copies': copies})
+def _catalog_batch_loaded(batch):
+    # one rebuild on the next lookup costs less than a sorted insert per row
+    catalog_changed('inventory:*')
+    catalog_changed('stock:*')
+    catalog_changed('title:*')
 
 '''
 Checks to see if the book already exists in the inventory. If there is, simply
@@ -531,19 +902,32 @@ def add_new_book(title, book_type, author, add_copies):
 
     # if there is, just update the number of copies
     if(book_id != 0):
-            sql = f"""
-            UPDATE inventory SET copies = (copies + {add_copies})
-            WHERE book_id = {book_id}"""
-            exec_commit(sql)
+        version = exec_get_one("""
+            WITH updated AS (
+                UPDATE inventory SET copies = (copies + %(add_copies)s)
+                WHERE book_id = %(book_id)s
+                RETURNING book_id
+            )
+            SELECT notify_catalog(ARRAY['inventory:' || book_id]) FROM updated""",
+            {'add_copies': add_copies, 'book_id': book_id})[0]
+        catalog_published(version, 'inventory:%d' % book_id)
 
     # if not, just add the new book to the inventory
     else:
-        exec_commit("""
-            INSERT INTO inventory(title, book_type, author, copies)
-            VALUES (%(title)s, %(book_type)s, %(author)s, %(add_copies)s)""",
+        book_id, version = exec_get_one("""
+            WITH inserted AS (
+                INSERT INTO inventory(title, book_type, author, copies)
+                VALUES (%(title)s, %(book_type)s, %(author)s, %(add_copies)s)
+                RETURNING book_id
+            )
+            SELECT book_id, notify_catalog(ARRAY['inventory:' || book_id, 'title:' || book_id])
+            FROM inserted""",
             {'title': title, 'book_type': book_type, 'author': author, 'add_copies': add_copies})
+        suggestions.add(title, TITLE)
+        suggestions.add(author, AUTHOR)
+        catalog_published(version, 'inventory:%d' % book_id)
 
-    return get_book_id(title)
+    return book_id
 
 '''
 Adds a new book to the specified library's inventory if it is not alrady there,
@@ -554,23 +938,19 @@ Parameters:
     book_copies(int): Number of copies of the book.
 '''
 def add_to_library(library_id, book_id, book_copies):
-    # first check to see if the book already exists in the library's system
-    copies = get_book_copies(library_id, book_id)
-
-    # if there is, just update the number of copies
-    if(copies != None):
-            sql = f"""
-            UPDATE library_stock SET book_copies = (book_copies + {book_copies})
-            WHERE book_id = {book_id}
-            AND library_id = {library_id}"""
-            exec_commit(sql)
-    
-    # if not, add it into the system
-    else:
-        exec_commit("""
+    # one upsert: adds the copies to the library's existing stock of the book,
+    # otherwise adds the book to the library's system
+    version = exec_get_one("""
+        WITH stocked AS (
             INSERT INTO library_stock(library_id, book_id, book_copies)
-            VALUES (%(library_id)s, %(book_id)s, %(book_copies)s)""",
-            {'library_id': library_id, 'book_id': book_id, 'book_copies': book_copies})
+            VALUES (%(library_id)s, %(book_id)s, %(book_copies)s)
+            ON CONFLICT (library_id, book_id)
+            DO UPDATE SET book_copies = (library_stock.book_copies + EXCLUDED.book_copies)
+            RETURNING book_id
+        )
+        SELECT notify_catalog(ARRAY['stock:' || book_id]) FROM stocked""",
+        {'library_id': library_id, 'book_id': book_id, 'book_copies': book_copies})[0]
+    catalog_published(version, 'stock:%d' % book_id)
 
 '''
 Returns a listing of a user's lending history including their late history.
@@ -605,6 +985,65 @@ def get_all_histories(library_id):
         WHERE library_id = %(library_id)s""",
         {'library_id': library_id})
 
+# Columns of the streamed loan exports, in order.
+CHECKOUT_EXPORT_COLUMNS = ['library_id', 'library', 'book_id', 'title', 'author', 'user_id',
+    'name', 'check_out_date', 'due_date', 'return_date', 'late_fees']
+HISTORY_EXPORT_COLUMNS = ['title', 'name', 'check_out_date', 'due_date', 'return_date']
+USER_HISTORY_EXPORT_COLUMNS = ['title', 'check_out_date', 'due_date', 'return_date']
+
+'''
+Streams every loan in the checkout table with its book, user and library
+through a server-side cursor. The rows are not sorted, so the first batch
+is sent without reading the whole table first.
+Parameter:
+    batch_size(int): Number of loans fetched per round trip.
+Returns:
+    (generator): Lists of loans, columns as in CHECKOUT_EXPORT_COLUMNS.
+'''
+def stream_checkouts(batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT checkout.library_id, libraries.library_name, checkout.book_id,
+        inventory.title, inventory.author, checkout.user_id, users.name,
+        check_out_date, due_date, return_date, late_fees
+        FROM checkout
+        INNER JOIN users ON users.id = checkout.user_id
+        INNER JOIN inventory ON inventory.book_id = checkout.book_id
+        INNER JOIN libraries ON libraries.library_id = checkout.library_id""",
+        batch_size=batch_size)
+
+'''
+Streams the same histories as get_all_histories through a server-side cursor.
+Parameters:
+    library_id(int): A library's id.
+    batch_size(int): Number of loans fetched per round trip.
+Returns:
+    (generator): Lists of loans, columns as in HISTORY_EXPORT_COLUMNS.
+'''
+def stream_all_histories(library_id, batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT inventory.title, users.name, check_out_date, due_date, return_date
+        FROM checkout
+        INNER JOIN inventory ON inventory.book_id = checkout.book_id
+        INNER JOIN users ON users.id = checkout.user_id
+        WHERE library_id = %(library_id)s""",
+        {'library_id': library_id}, batch_size=batch_size)
+
+'''
+Streams the same history as get_user_history through a server-side cursor.
+Parameters:
+    user_id(int): A user id.
+    batch_size(int): Number of loans fetched per round trip.
+Returns:
+    (generator): Lists of loans, columns as in USER_HISTORY_EXPORT_COLUMNS.
+'''
+def stream_user_history(user_id, batch_size=DEFAULT_STREAM_BATCH):
+    return exec_stream("""
+        SELECT inventory.title, check_out_date, due_date, return_date
+        FROM checkout
+        INNER JOIN inventory ON inventory.book_id = checkout.book_id
+        WHERE user_id = %(user_id)s""",
+        {'user_id': user_id}, batch_size=batch_size)
+
 '''
 Runs a report listing all books in all libraries, organized by library location
 and book title with the count of books at each location.
@@ -624,33 +1063,42 @@ def report_on_all_libraries():
         print(book)
 
     print('Number of books at each location:')
-    print('Fairport:', total_books_at_library(2))
-    print('Henrietta:', total_books_at_library(3))
-    print('Penfield:', total_books_at_library(1))
-    print('Pittsford:', total_books_at_library(4))
+    for library_name, titles, copies in get_library_totals():
+        print(library_name + ':', copies)
 
     return books
 
 '''
-Calculates the total number of books at a specified library,
-adding up all the copies of each book there.
+Returns the total number of books at a specified library, all the
+copies of each book there, from the library_totals summary.
 Parameter:
     library_id(int): A library's id.
 Returns:
     (int): Total number of books at this library.
 '''
 def total_books_at_library(library_id):
-    count = 0
-    copies = exec_get_all("""
-        SELECT book_copies
-        FROM library_stock
+    total = exec_get_one("""
+        SELECT copies FROM library_totals
         WHERE library_id = %(library_id)s""",
         {'library_id': library_id})
 
-    for copy in copies:
-        count += copy[0]
+    if (total == None):
+        return 0
+    return total[0]
 
-    return count
+'''
+Returns the number of titles and copies stocked by every library, from the
+library_totals summary.
+Returns:
+    (list): (library_name, titles, copies) tuples ordered by library name.
+'''
+def get_library_totals():
+    return exec_get_all("""
+        SELECT libraries.library_name, COALESCE(library_totals.titles, 0),
+        COALESCE(library_totals.copies, 0)
+        FROM libraries
+        LEFT JOIN library_totals ON library_totals.library_id = libraries.library_id
+        ORDER BY libraries.library_name ASC""")
 
 '''
 Calculates the late-fee charge if a book is past due.
@@ -664,99 +1112,135 @@ Returns:
     (float): Late fee.
 '''
 def apply_late_fees(user_id, book_id, return_date):
-    fee = 0.0
-    due_date = exec_get_one("""
-        SELECT due_date
-        FROM checkout
+    late = exec_get_one("""
+        UPDATE checkout
+        SET late_fees = late_fee(%(return_date)s::date - due_date)
         WHERE user_id = %(user_id)s
-        AND book_id = %(book_id)s""",
-        {'user_id': user_id, 'book_id': book_id})[0]
-    
-    if (datetime.strptime(return_date, '%Y-%m-%d').date() > due_date):
-        days_late = datetime.strptime(return_date, '%Y-%m-%d').date() - due_date
-        days_late = float(str(days_late).split(' ')[0])
-        
-        if (days_late <= 6):
-            fee = days_late * 0.25
-        else:
-            fee = 6 * 0.25
-            fee += 2*(days_late - 6)
-    
-        sql = f"""
-            UPDATE checkout
-            SET late_fees = {fee}
-            WHERE user_id = {user_id}
-            AND book_id = {book_id}"""
-        exec_commit(sql)
-        
-        return days_late, fee
+        AND book_id = %(book_id)s
+        AND due_date < %(return_date)s
+        RETURNING %(return_date)s::date - due_date, late_fees""",
+        {'user_id': user_id, 'book_id': book_id, 'return_date': return_date})
 
-    return 0, fee
+    if (late != None):
+        return late[0], float(late[1])
+
+    return 0, 0.0
 
 '''
-Presents a table listing of each book and who has checked it out.
+Totals the late fees accrued on a user's open loans, as last calculated by the
+nightly late fee job (late_fees.accrue_late_fees).
+Parameter:
+    user_id(int): A user's id.
+Returns:
+    (int): Number of overdue open loans.
+    (float): Late fees owed on them.
 '''
-def checkout_table():
-    books = exec_get_all("""
-        SELECT inventory.title, inventory.author, users.name,
-        check_out_date, return_date, late_fees
-        FROM checkout
-        INNER JOIN users ON users.id = checkout.user_id
-        INNER JOIN inventory ON inventory.book_id = checkout.book_id
-    """)
+def get_outstanding_late_fees(user_id):
+    owed = exec_get_one("""
+        SELECT count(*), COALESCE(sum(late_fees), 0) FROM checkout
+        WHERE user_id = %(user_id)s
+        AND return_date IS NULL
+        AND late_fees > 0""",
+        {'user_id': user_id})
+
+    return owed[0], float(owed[1])
 
+'''
+Presents a table listing of each book and who has checked it out. The
+loans are streamed, so the table can be any size.
+'''
+def checkout_table():
     output = '%-45s  %-18s  %-15s  %-15s  %-10s' % ('book', 'name', 'check_out_date', 'returned_date', 'late_fees')
     print(output)
     print('-' * 110)
 
-    for book in books:
-        title_author = book[0] + ' by ' + book[1]
-        name = book[2]
-        checkout_date = book[3]
-        return_date = book[4]
-        late_fees = book[5]
+    for books in stream_checkouts():
+        for book in books:
+            title_author = book[3] + ' by ' + book[4]
+            name = book[6]
+            checkout_date = book[7]
+            return_date = book[9]
+            late_fees = book[10]
 
-        output = '%-45s  %-18s  %-15s  %-15s  %8s' % (title_author, name, checkout_date, return_date, late_fees)
-        print(output)
+            output = '%-45s  %-18s  %-15s  %-15s  %8s' % (title_author, name, checkout_date, return_date, late_fees)
+            print(output)
 
 '''
 Generates a report that lists each book that has been checked out,
 the number of days for which it was checked out, and lastly prints
-the average number of days it takes for a book to be returns.
+the average number of days it takes for a book to be returned. Loans are
+streamed, and the average comes from the loan_totals rollup.
 '''
 def generate_report():
-    average = 0
-
-    books = exec_get_all("""
-        SELECT inventory.title, users.name, check_out_date, return_date
-        FROM checkout
-        INNER JOIN users ON users.id = checkout.user_id
-        INNER JOIN inventory ON inventory.book_id = checkout.book_id
-    """)
-
     output = '%-25s  %-20s  %-15s  %-15s  %-10s' % ('Title', 'User', 'Checkout', 'Return', 'Days borrowed')
     print(output)
 
-    for book in books:
-        title = book[0]
-        name = book[1]
-        checkout_date = book[2]
-        return_date = book[3]
-
-        if (return_date != None):
-            days_borrowed = return_date - checkout_date
-            days_borrowed = int(str(days_borrowed).split(' ')[0])
-            average += days_borrowed
-        else:
-            days_borrowed = None
-
-        output = '%-25s  %-20s  %-15s  %-15s  %-10s' % (title, name, checkout_date, return_date, days_borrowed)
-        print(output)
+    for books in exec_stream("""
+            SELECT inventory.title, users.name, check_out_date, return_date,
+            return_date - check_out_date
+            FROM checkout
+            INNER JOIN users ON users.id = checkout.user_id
+            INNER JOIN inventory ON inventory.book_id = checkout.book_id"""):
+        for title, name, checkout_date, return_date, days_borrowed in books:
+            output = '%-25s  %-20s  %-15s  %-15s  %-10s' % (title, name, checkout_date, return_date, days_borrowed)
+            print(output)
 
-    average = average / books.__len__()
-    print('\nAverage return time = ', round(average, 2), 'days')
+    average = get_loan_report()[-1][4]
+    print('\nAverage return time = ', average, 'days')
 
-def main():
-    rebuild_tables()
+'''
+Reports the stock and the loans of every library, with set-based queries
+over the library_totals and loan_totals summaries, so the cost does not
+grow with the number of loans.
+Parameters:
+    start(str): Optional first check out date counted, inclusive.
+    end(str): Optional last check out date counted, inclusive.
+Returns:
+    (list): (library_id, library_name, titles, copies, loans, open_loans,
+    late_fees) tuples ordered by library name.
+'''
+def get_library_report(start=None, end=None):
+    return exec_get_all("""
+        SELECT libraries.library_id, libraries.library_name,
+        COALESCE(library_totals.titles, 0), COALESCE(library_totals.copies, 0),
+        COALESCE(loans.loans, 0), COALESCE(loans.loans - loans.returned, 0),
+        COALESCE(loans.late_fees, 0)
+        FROM libraries
+        LEFT JOIN library_totals ON library_totals.library_id = libraries.library_id
+        LEFT JOIN (
+            SELECT library_id, sum(loans) AS loans, sum(returned) AS returned,
+            sum(late_fees) AS late_fees
+            FROM loan_totals
+            WHERE (%(start)s::date IS NULL OR check_out_date >= %(start)s::date)
+            AND (%(end)s::date IS NULL OR check_out_date <= %(end)s::date)
+            GROUP BY library_id
+        ) AS loans ON loans.library_id = libraries.library_id
+        ORDER BY libraries.library_name ASC""",
+        {'start': start, 'end': end})
 
-main()
\ No newline at end of file
+'''
+Reports loan counts, the average number of days books were borrowed
+before being returned and the late fees charged, per library and overall,
+from the loan_totals rollup.
+Parameters:
+    start(str): Optional first check out date counted, inclusive.
+    end(str): Optional last check out date counted, inclusive.
+Returns:
+    (list): (library_id, library_name, loans, returned, average_days,
+    late_fees) tuples ordered by library name, followed by the overall
+    totals with a library id and name of None. average_days is None when no
+    book was returned.
+'''
+def get_loan_report(start=None, end=None):
+    return exec_get_all("""
+        SELECT libraries.library_id, libraries.library_name,
+        COALESCE(sum(loan_totals.loans), 0), COALESCE(sum(loan_totals.returned), 0),
+        round(sum(loan_totals.days_borrowed)::DECIMAL / NULLIF(sum(loan_totals.returned), 0), 2),
+        COALESCE(sum(loan_totals.late_fees), 0)
+        FROM libraries
+        LEFT JOIN loan_totals ON loan_totals.library_id = libraries.library_id
+        AND (%(start)s::date IS NULL OR loan_totals.check_out_date >= %(start)s::date)
+        AND (%(end)s::date IS NULL OR loan_totals.check_out_date <= %(end)s::date)
+        GROUP BY ROLLUP ((libraries.library_id, libraries.library_name))
+        ORDER BY GROUPING(libraries.library_id), libraries.library_name ASC""",
+        {'start': start, 'end': end})
@@ -2,9 +2,16 @@ DROP SCHEMA IF EXISTS library CASCADE;
 DROP TABLE IF EXISTS reserve;
 DROP TABLE IF EXISTS checkout;
 DROP TABLE IF EXISTS library_stock;
+DROP TABLE IF EXISTS book_search;
+DROP TABLE IF EXISTS book_availability;
+DROP TABLE IF EXISTS library_totals;
+DROP TABLE IF EXISTS loan_totals;
+DROP TABLE IF EXISTS late_fee_runs;
 DROP TABLE IF EXISTS libraries;
 DROP TABLE IF EXISTS inventory;
 DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS schema_migrations;
+DROP SEQUENCE IF EXISTS catalog_version_seq;
 
 CREATE TABLE users(
     id SERIAL NOT NULL PRIMARY KEY,
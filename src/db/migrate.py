@@ -0,0 +1,138 @@
+import argparse
+import os
+import re
+import sys
+from .swen344_db_utils import *
+
+MIGRATIONS_PATH = 'src/db/migrations'
+# Base schema and sample data that the migrations build on.
+SCHEMA_PATH = 'src/db/library_schema.sql'
+# Arbitrary key for the advisory lock that serializes concurrent migrators.
+MIGRATION_LOCK_KEY = 344001
+
+'''
+Lists the migration scripts shipped in src/db/migrations. Each file is
+named <version>_<description>.sql and versions are applied in order.
+Returns:
+    (list): (version, name, path) tuples sorted by version.
+'''
+def available_migrations():
+    folder = os.path.join(os.path.dirname(__file__), '../../', MIGRATIONS_PATH)
+    migrations = []
+    for filename in os.listdir(folder):
+        match = re.match(r'^(\d+)_(.+)\.sql$', filename)
+        if (match != None):
+            migrations.append((int(match.group(1)), match.group(2), f'{MIGRATIONS_PATH}/{filename}'))
+
+    return sorted(migrations)
+
+'''
+Returns the newest migration version shipped with the code.
+'''
+def latest_version():
+    migrations = available_migrations()
+    return migrations[-1][0] if migrations else 0
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+            version INTEGER NOT NULL PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT now() NOT NULL
+        )""")
+
+'''
+Returns the newest migration version applied to the database. Only reads,
+so it is cheap enough to call on every start.
+Returns:
+    (int): The schema version, 0 if no migration has been applied.
+'''
+def schema_version():
+    if (exec_get_one("SELECT to_regclass('schema_migrations')")[0] == None):
+        return 0
+    return exec_get_one("SELECT COALESCE(max(version), 0) FROM schema_migrations")[0]
+
+'''
+Applies every migration newer than the database's schema version. Each
+migration runs in its own transaction together with its bookkeeping row,
+so a failed migration leaves no trace and can simply be re-run. Safe to
+call from several processes at once. When the schema is already at the
+latest version it only reads the version, see schema_version.
+Returns:
+    (list): Versions that were applied by this call.
+'''
+def apply_migrations():
+    migrations = available_migrations()
+    if (not migrations or schema_version() >= migrations[-1][0]):
+        return []
+
+    applied = []
+    for version, name, path in migrations:
+        full_path = os.path.join(os.path.dirname(__file__), f'../../{path}')
+        with open(full_path, 'r') as file:
+            sql = file.read()
+
+        with transaction() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%(key)s)", {'key': MIGRATION_LOCK_KEY})
+            _ensure_migrations_table(cur)
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %(version)s",
+                {'version': version})
+            if (cur.fetchone() != None):
+                continue
+
+            cur.execute(sql)
+            cur.execute("""
+                INSERT INTO schema_migrations(version, name)
+                VALUES (%(version)s, %(name)s)""",
+                {'version': version, 'name': name})
+            applied.append(version)
+
+    return applied
+
+'''
+Reports whether the base tables from library_schema.sql exist.
+'''
+def schema_exists():
+    return exec_get_one("SELECT to_regclass('users')")[0] != None
+
+'''
+Drops every library table and recreates them from library_schema.sql with
+its sample data, then applies every migration. Destroys all data. Running
+servers hear a catalog reset and drop their caches.
+Returns:
+    (int): The catalog version published with the reset.
+'''
+def rebuild_schema():
+    exec_commit("DROP SCHEMA IF EXISTS library CASCADE;")
+    exec_sql_file(SCHEMA_PATH)
+    apply_migrations()
+    return exec_get_one("SELECT notify_catalog(ARRAY['reset'])")[0]
+
+'''
+Command line entry point for deploys. Creates the schema in an empty
+database, then applies any newer migrations; run it before starting the
+server. Does nothing if the schema is up to date. A migration that indexes
+existing tables blocks writes to them until it commits, and says so.
+    cd src && python -m db.migrate
+    cd src && python -m db.migrate --rebuild
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or migrate the library schema.')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='drop every table and recreate them with the sample data (destroys all data)')
+    args = parser.parse_args(argv)
+
+    if (args.rebuild):
+        rebuild_schema()
+        print('Rebuilt the schema')
+    elif (not schema_exists()):
+        exec_sql_file(SCHEMA_PATH)
+        print('Created the schema')
+
+    applied = apply_migrations()
+    if (applied):
+        print('Applied migrations:', ', '.join(str(version) for version in applied))
+    print('Schema version:', schema_version())
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
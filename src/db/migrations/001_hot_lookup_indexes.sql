@@ -0,0 +1,51 @@
+-- Indexes for the lookups on every hot path. Primary keys were the only
+-- indexes before this, so each of these filters was a sequential scan.
+--
+-- Needs a maintenance window on a live database: like every migration it
+-- runs in one transaction, so it blocks writes to users, inventory,
+-- library_stock and checkout until the last index is built, while reads go
+-- on. CREATE INDEX CONCURRENTLY cannot run in a transaction, and folding
+-- the duplicate stock rows must be atomic with the constraint that keeps
+-- them out.
+
+-- login, session checks and get_user_id all filter on username; the
+-- session checks also match session_key, which the composite covers.
+CREATE INDEX IF NOT EXISTS users_username_session_key_idx
+    ON users (username, session_key);
+
+-- search_by_title, get_book_id, search_by_author and the genre listings.
+CREATE INDEX IF NOT EXISTS inventory_title_idx ON inventory (title);
+CREATE INDEX IF NOT EXISTS inventory_author_idx ON inventory (author);
+CREATE INDEX IF NOT EXISTS inventory_book_type_idx ON inventory (book_type);
+
+-- A library holds one stock row per book. Fold any duplicates into a single
+-- row before enforcing that, so the constraint can be added to live data.
+CREATE TEMP TABLE library_stock_merged ON COMMIT DROP AS
+    SELECT library_id, book_id, sum(book_copies) AS book_copies
+    FROM library_stock
+    GROUP BY library_id, book_id
+    HAVING count(*) > 1;
+
+DELETE FROM library_stock
+    USING library_stock_merged
+    WHERE library_stock.library_id = library_stock_merged.library_id
+    AND library_stock.book_id = library_stock_merged.book_id;
+
+INSERT INTO library_stock (library_id, book_id, book_copies)
+    SELECT library_id, book_id, book_copies FROM library_stock_merged;
+
+-- The unique index also serves every lookup by library_id. It is built
+-- before it becomes the constraint, whose lock also blocks reads, so that
+-- lock is only held for the rest of the migration rather than for the build.
+CREATE UNIQUE INDEX library_stock_library_book_key ON library_stock (library_id, book_id);
+ALTER TABLE library_stock
+    ADD CONSTRAINT library_stock_library_book_key UNIQUE USING INDEX library_stock_library_book_key;
+
+-- Availability ("available at") is looked up by book.
+CREATE INDEX IF NOT EXISTS library_stock_book_idx ON library_stock (book_id);
+
+-- Overdue checks, due dates, returns and late fees by user and book.
+CREATE INDEX IF NOT EXISTS checkout_user_book_idx ON checkout (user_id, book_id);
+
+-- Librarian histories by library.
+CREATE INDEX IF NOT EXISTS checkout_library_idx ON checkout (library_id);
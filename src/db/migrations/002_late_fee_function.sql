@@ -0,0 +1,9 @@
+-- Late fee for a loan returned days_late days after its due date:
+-- $0.25 a day for the first 6 days, then $2.00 for every day after that.
+CREATE OR REPLACE FUNCTION late_fee(days_late INTEGER) RETURNS DECIMAL AS $$
+    SELECT CASE
+        WHEN days_late IS NULL OR days_late <= 0 THEN 0.0
+        WHEN days_late <= 6 THEN days_late * 0.25
+        ELSE 6 * 0.25 + 2 * (days_late - 6)
+    END
+$$ LANGUAGE SQL IMMUTABLE;
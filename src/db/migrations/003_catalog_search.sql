@@ -0,0 +1,57 @@
+-- Full-text document for a book. Title and author weigh more than the
+-- summary when ranking.
+CREATE OR REPLACE FUNCTION book_document(title TEXT, author TEXT, summary TEXT)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('english', title), 'A')
+        || setweight(to_tsvector('english', author), 'A')
+        || setweight(to_tsvector('english', summary), 'C')
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Each book's document is stored rather than recomputed, so ranking a
+-- query's matches only reads them. It is kept in its own table so that
+-- inventory's columns are unchanged.
+CREATE TABLE book_search(
+    book_id INTEGER NOT NULL PRIMARY KEY REFERENCES inventory(book_id) ON DELETE CASCADE,
+    document tsvector NOT NULL
+);
+
+INSERT INTO book_search(book_id, document)
+    SELECT book_id, book_document(title, author, summary) FROM inventory;
+
+CREATE INDEX book_search_document_idx ON book_search USING GIN (document);
+
+-- Statement level, so a bulk load refreshes its documents in one pass.
+CREATE OR REPLACE FUNCTION book_search_sync() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO book_search(book_id, document)
+        SELECT book_id, book_document(title, author, summary) FROM changed_books
+    ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER inventory_search_insert
+    AFTER INSERT ON inventory
+    REFERENCING NEW TABLE AS changed_books
+    FOR EACH STATEMENT EXECUTE FUNCTION book_search_sync();
+
+CREATE TRIGGER inventory_search_update
+    AFTER UPDATE ON inventory
+    REFERENCING NEW TABLE AS changed_books
+    FOR EACH STATEMENT EXECUTE FUNCTION book_search_sync();
+
+-- Typo tolerance through trigram similarity on titles and authors. pg_trgm
+-- is one of PostgreSQL's contrib modules; where it is not installed, catalog
+-- search falls back to full-text matching only. The indexes block writes to
+-- inventory while they are built, see 001.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS inventory_title_trgm_idx
+            ON inventory USING GIN (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS inventory_author_trgm_idx
+            ON inventory USING GIN (author gin_trgm_ops);
+    END IF;
+END
+$$;
@@ -0,0 +1,22 @@
+-- Catalog version, bumped by every inventory and stock change and published
+-- on the 'catalog' channel as 'version:<n>'. The API uses it for ETags.
+-- It starts at the creation time in milliseconds, so versions are not
+-- reused after the tables are rebuilt.
+CREATE SEQUENCE catalog_version_seq;
+SELECT setval('catalog_version_seq', (extract(epoch FROM clock_timestamp()) * 1000)::bigint);
+
+-- Publishes catalog change events, followed by the new catalog version,
+-- and returns that version. Notifications are delivered when the calling
+-- transaction commits, in commit order.
+CREATE OR REPLACE FUNCTION notify_catalog(events TEXT[]) RETURNS BIGINT AS $$
+DECLARE
+    event TEXT;
+    version BIGINT := nextval('catalog_version_seq');
+BEGIN
+    FOREACH event IN ARRAY events LOOP
+        PERFORM pg_notify('catalog', event);
+    END LOOP;
+    PERFORM pg_notify('catalog', 'version:' || version);
+    RETURN version;
+END
+$$ LANGUAGE plpgsql;
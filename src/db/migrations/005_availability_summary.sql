@@ -0,0 +1,150 @@
+-- Availability projections of library_stock, kept current by triggers so
+-- that reads do not join library_stock with libraries on every call:
+--   book_availability  the names of the libraries stocking each book, in
+--                      library id order (books stocked nowhere have no row).
+--   library_totals     how many titles and copies each library stocks.
+CREATE TABLE book_availability(
+    book_id INTEGER NOT NULL PRIMARY KEY REFERENCES inventory(book_id) ON DELETE CASCADE,
+    libraries TEXT NOT NULL
+);
+
+CREATE TABLE library_totals(
+    library_id INTEGER NOT NULL PRIMARY KEY REFERENCES libraries(library_id) ON DELETE CASCADE,
+    titles INTEGER NOT NULL DEFAULT 0,
+    copies BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO book_availability(book_id, libraries)
+    SELECT library_stock.book_id,
+    string_agg(libraries.library_name, ', ' ORDER BY library_stock.library_id)
+    FROM library_stock
+    INNER JOIN libraries ON libraries.library_id = library_stock.library_id
+    GROUP BY library_stock.book_id;
+
+INSERT INTO library_totals(library_id, titles, copies)
+    SELECT libraries.library_id, count(library_stock.book_id),
+    COALESCE(sum(library_stock.book_copies), 0)
+    FROM libraries
+    LEFT JOIN library_stock ON library_stock.library_id = libraries.library_id
+    GROUP BY libraries.library_id;
+
+-- Recomputes the library lists of the given books. The rows are locked
+-- before the lists are read, so two transactions stocking the same book at
+-- different libraries cannot overwrite each other's list.
+CREATE OR REPLACE FUNCTION refresh_book_availability(book_ids INTEGER[]) RETURNS void AS $$
+BEGIN
+    IF cardinality(book_ids) = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO book_availability(book_id, libraries)
+        SELECT DISTINCT book_id, '' FROM unnest(book_ids) AS book_id ORDER BY book_id
+    ON CONFLICT (book_id) DO NOTHING;
+    PERFORM 1 FROM book_availability
+        WHERE book_id = ANY(book_ids) ORDER BY book_id FOR UPDATE;
+
+    UPDATE book_availability SET libraries = stocked.libraries
+    FROM (
+        SELECT library_stock.book_id,
+        string_agg(libraries.library_name, ', ' ORDER BY library_stock.library_id) AS libraries
+        FROM library_stock
+        INNER JOIN libraries ON libraries.library_id = library_stock.library_id
+        WHERE library_stock.book_id = ANY(book_ids)
+        GROUP BY library_stock.book_id
+    ) AS stocked
+    WHERE book_availability.book_id = stocked.book_id;
+
+    DELETE FROM book_availability
+    WHERE book_id = ANY(book_ids)
+    AND NOT EXISTS (SELECT 1 FROM library_stock WHERE library_stock.book_id = book_availability.book_id);
+END
+$$ LANGUAGE plpgsql;
+
+-- Statement level, like book_search_sync, so a bulk load updates each
+-- library's totals once. Totals are adjusted by the change rather than
+-- recounted.
+CREATE OR REPLACE FUNCTION library_stock_inserted() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_book_availability(ARRAY(SELECT DISTINCT book_id FROM new_stock));
+
+    INSERT INTO library_totals(library_id, titles, copies)
+        SELECT library_id, count(*), COALESCE(sum(book_copies), 0)
+        FROM new_stock GROUP BY library_id ORDER BY library_id
+    ON CONFLICT (library_id) DO UPDATE
+    SET titles = (library_totals.titles + EXCLUDED.titles),
+    copies = (library_totals.copies + EXCLUDED.copies);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION library_stock_deleted() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_book_availability(ARRAY(SELECT DISTINCT book_id FROM old_stock));
+
+    UPDATE library_totals SET titles = (library_totals.titles - removed.titles),
+    copies = (library_totals.copies - removed.copies)
+    FROM (
+        SELECT library_id, count(*) AS titles, COALESCE(sum(book_copies), 0) AS copies
+        FROM old_stock GROUP BY library_id
+    ) AS removed
+    WHERE library_totals.library_id = removed.library_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Checkouts and returns only change book_copies, so the library lists are
+-- only recomputed for rows that moved to another book or library.
+CREATE OR REPLACE FUNCTION library_stock_updated() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_book_availability(ARRAY(
+        SELECT book_id FROM (
+            SELECT library_id, book_id FROM new_stock
+            EXCEPT ALL SELECT library_id, book_id FROM old_stock) AS added
+        UNION
+        SELECT book_id FROM (
+            SELECT library_id, book_id FROM old_stock
+            EXCEPT ALL SELECT library_id, book_id FROM new_stock) AS removed));
+
+    INSERT INTO library_totals(library_id, titles, copies)
+        SELECT library_id, sum(titles), sum(copies) FROM (
+            SELECT library_id, 1 AS titles, COALESCE(book_copies, 0) AS copies FROM new_stock
+            UNION ALL
+            SELECT library_id, -1, -COALESCE(book_copies, 0) FROM old_stock
+        ) AS changes
+        GROUP BY library_id ORDER BY library_id
+    ON CONFLICT (library_id) DO UPDATE
+    SET titles = (library_totals.titles + EXCLUDED.titles),
+    copies = (library_totals.copies + EXCLUDED.copies);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER library_stock_availability_insert
+    AFTER INSERT ON library_stock
+    REFERENCING NEW TABLE AS new_stock
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stock_inserted();
+
+CREATE TRIGGER library_stock_availability_delete
+    AFTER DELETE ON library_stock
+    REFERENCING OLD TABLE AS old_stock
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stock_deleted();
+
+CREATE TRIGGER library_stock_availability_update
+    AFTER UPDATE ON library_stock
+    REFERENCING OLD TABLE AS old_stock NEW TABLE AS new_stock
+    FOR EACH STATEMENT EXECUTE FUNCTION library_stock_updated();
+
+-- A renamed library changes the lists of every book it stocks.
+CREATE OR REPLACE FUNCTION libraries_renamed() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_book_availability(ARRAY(
+        SELECT DISTINCT library_stock.book_id FROM library_stock
+        INNER JOIN renamed ON renamed.library_id = library_stock.library_id));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER libraries_availability_rename
+    AFTER UPDATE ON libraries
+    REFERENCING NEW TABLE AS renamed
+    FOR EACH STATEMENT EXECUTE FUNCTION libraries_renamed();
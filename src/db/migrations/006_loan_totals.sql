@@ -0,0 +1,101 @@
+-- Loans rolled up per library and check out day, kept current by triggers
+-- on checkout, so loan reports over any date range sum at most one row per
+-- library and day instead of scanning every loan. Loans without a library
+-- or check out date are not counted.
+CREATE TABLE loan_totals(
+    library_id INTEGER NOT NULL REFERENCES libraries(library_id) ON DELETE CASCADE,
+    check_out_date DATE NOT NULL,
+    loans INTEGER NOT NULL DEFAULT 0,
+    returned INTEGER NOT NULL DEFAULT 0,
+    days_borrowed BIGINT NOT NULL DEFAULT 0,
+    late_fees DECIMAL NOT NULL DEFAULT 0.0,
+    PRIMARY KEY(library_id, check_out_date)
+);
+
+INSERT INTO loan_totals(library_id, check_out_date, loans, returned, days_borrowed, late_fees)
+    SELECT library_id, check_out_date, count(*), count(return_date),
+    COALESCE(sum(return_date - check_out_date), 0), COALESCE(sum(late_fees), 0)
+    FROM checkout
+    WHERE library_id IS NOT NULL AND check_out_date IS NOT NULL
+    GROUP BY library_id, check_out_date;
+
+-- Statement level, so a batch of returns or late fees updates each library
+-- and day once. Totals are adjusted by the change rather than recounted;
+-- rows are upserted in key order so concurrent statements do not deadlock.
+CREATE OR REPLACE FUNCTION checkout_inserted() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO loan_totals(library_id, check_out_date, loans, returned, days_borrowed, late_fees)
+        SELECT library_id, check_out_date, count(*), count(return_date),
+        COALESCE(sum(return_date - check_out_date), 0), COALESCE(sum(late_fees), 0)
+        FROM new_loans
+        WHERE library_id IS NOT NULL AND check_out_date IS NOT NULL
+        GROUP BY library_id, check_out_date ORDER BY library_id, check_out_date
+    ON CONFLICT (library_id, check_out_date) DO UPDATE
+    SET loans = (loan_totals.loans + EXCLUDED.loans),
+    returned = (loan_totals.returned + EXCLUDED.returned),
+    days_borrowed = (loan_totals.days_borrowed + EXCLUDED.days_borrowed),
+    late_fees = (loan_totals.late_fees + EXCLUDED.late_fees);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION checkout_updated() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO loan_totals(library_id, check_out_date, loans, returned, days_borrowed, late_fees)
+        SELECT library_id, check_out_date, sum(loans), sum(returned), sum(days_borrowed),
+        sum(late_fees)
+        FROM (
+            SELECT library_id, check_out_date, 1 AS loans,
+            (return_date IS NOT NULL)::INTEGER AS returned,
+            COALESCE(return_date - check_out_date, 0) AS days_borrowed,
+            COALESCE(late_fees, 0) AS late_fees
+            FROM new_loans
+            UNION ALL
+            SELECT library_id, check_out_date, -1, -(return_date IS NOT NULL)::INTEGER,
+            -COALESCE(return_date - check_out_date, 0), -COALESCE(late_fees, 0)
+            FROM old_loans
+        ) AS changes
+        WHERE library_id IS NOT NULL AND check_out_date IS NOT NULL
+        GROUP BY library_id, check_out_date ORDER BY library_id, check_out_date
+    ON CONFLICT (library_id, check_out_date) DO UPDATE
+    SET loans = (loan_totals.loans + EXCLUDED.loans),
+    returned = (loan_totals.returned + EXCLUDED.returned),
+    days_borrowed = (loan_totals.days_borrowed + EXCLUDED.days_borrowed),
+    late_fees = (loan_totals.late_fees + EXCLUDED.late_fees);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION checkout_deleted() RETURNS trigger AS $$
+BEGIN
+    UPDATE loan_totals SET loans = (loan_totals.loans - removed.loans),
+    returned = (loan_totals.returned - removed.returned),
+    days_borrowed = (loan_totals.days_borrowed - removed.days_borrowed),
+    late_fees = (loan_totals.late_fees - removed.late_fees)
+    FROM (
+        SELECT library_id, check_out_date, count(*) AS loans, count(return_date) AS returned,
+        COALESCE(sum(return_date - check_out_date), 0) AS days_borrowed,
+        COALESCE(sum(late_fees), 0) AS late_fees
+        FROM old_loans
+        GROUP BY library_id, check_out_date
+    ) AS removed
+    WHERE loan_totals.library_id = removed.library_id
+    AND loan_totals.check_out_date = removed.check_out_date;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER checkout_totals_insert
+    AFTER INSERT ON checkout
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION checkout_inserted();
+
+CREATE TRIGGER checkout_totals_update
+    AFTER UPDATE ON checkout
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION checkout_updated();
+
+CREATE TRIGGER checkout_totals_delete
+    AFTER DELETE ON checkout
+    REFERENCING OLD TABLE AS old_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION checkout_deleted();
@@ -0,0 +1,16 @@
+-- Open loans by borrower, for the nightly late fee job, which walks them in
+-- user id order. Returned loans, the bulk of checkout, are left out. Blocks
+-- writes to checkout while it is built, see 001.
+CREATE INDEX checkout_open_loans_idx ON checkout(user_id) INCLUDE (due_date)
+    WHERE return_date IS NULL;
+
+-- Progress of each late fee run, one row per accrual date. A chunk's fees and
+-- its checkpoint are committed together, so an interrupted run resumes after
+-- the last finished chunk and concurrent runs share the work.
+CREATE TABLE late_fee_runs(
+    as_of DATE NOT NULL PRIMARY KEY,
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    loans_updated BIGINT NOT NULL DEFAULT 0,
+    started_at TIMESTAMP NOT NULL DEFAULT now(),
+    finished_at TIMESTAMP
+);
@@ -0,0 +1,22 @@
+-- Most updates of inventory only change copies, on every checkout, return
+-- and added copy. Refresh the search documents of the books whose title,
+-- author or summary actually changed, rather than of every updated row.
+CREATE OR REPLACE FUNCTION book_search_update() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO book_search(book_id, document)
+        SELECT new_books.book_id, book_document(new_books.title, new_books.author, new_books.summary)
+        FROM new_books
+        INNER JOIN old_books ON old_books.book_id = new_books.book_id
+        WHERE (new_books.title, new_books.author, new_books.summary)
+            IS DISTINCT FROM (old_books.title, old_books.author, old_books.summary)
+    ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER inventory_search_update ON inventory;
+
+CREATE TRIGGER inventory_search_update
+    AFTER UPDATE ON inventory
+    REFERENCING OLD TABLE AS old_books NEW TABLE AS new_books
+    FOR EACH STATEMENT EXECUTE FUNCTION book_search_update();
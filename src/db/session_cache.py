@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Most sessions kept in memory, least recently used are evicted first.
+DEFAULT_MAXSIZE = 10000
+# Seconds a cached session is trusted before it is checked against the database again.
+DEFAULT_TTL = 300
+
+'''
+A thread-safe TTL/LRU cache of validated sessions.
+
+Entries are keyed by username and remember the session key issued at
+login together with the user's id, so logging in again replaces the old
+key and a stale key can never be a hit. A lookup only hits when both the
+username and the session key match an unexpired entry.
+'''
+class SessionCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # username -> (key, user_id, expires)
+
+    '''
+    Returns the cached user id for this session, or None.
+    '''
+    def get(self, username, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if (entry != None and entry[0] == str(key) and entry[2] > now):
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry[1]
+
+            if (entry != None and entry[2] <= now):
+                del self._entries[username]
+            self.misses += 1
+            return None
+
+    def put(self, username, key, user_id):
+        with self._lock:
+            self._entries[username] = (str(key), user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while (self._entries.__len__() > self.maxsize):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    '''
+    Returns the cache size and its hit/miss counters.
+    '''
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': self._entries.__len__(), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,128 @@
+import threading
+from bisect import bisect_left
+
+TITLE = 'title'
+AUTHOR = 'author'
+_KINDS = (TITLE, AUTHOR)
+
+# Default and maximum number of suggestions returned.
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+
+'''
+An in-memory, case-insensitive prefix index over book titles and authors.
+
+Entries live in one sorted list of lowercase search keys, with the
+original text and its kind in parallel lists, so a lookup is a binary
+search followed by a short forward scan and memory is three list slots
+per distinct title or author plus the strings themselves.
+'''
+class PrefixIndex:
+    def __init__(self):
+        self.built = False
+        self._lock = threading.Lock()
+        # held for a whole build, so concurrent callers wait for one build
+        self._build_lock = threading.Lock()
+        self._generation = 0
+        self._pending = None
+        self._keys = []
+        self._texts = []
+        self._kinds = bytearray()
+
+    '''
+    Builds the index unless it is built. Concurrent callers share one
+    build: the first reads the entries, the others wait for it.
+    Parameter:
+        load(function): Returns the (text, kind) entries.
+    '''
+    def ensure_built(self, load):
+        if (self.built):
+            return
+        with self._build_lock:
+            if (not self.built):
+                self._build(load())
+
+    '''
+    Replaces the index contents.
+    Parameter:
+        entries(iterable): (text, kind) pairs, kind being TITLE or AUTHOR.
+    '''
+    def build(self, entries):
+        with self._build_lock:
+            self._build(entries)
+
+    def _build(self, entries):
+        # entries added while the build reads are kept aside and merged in,
+        # and an invalidation meanwhile leaves the new index unbuilt
+        with self._lock:
+            generation = self._generation
+            self._pending = []
+
+        unique = {}
+        for text, kind in entries:
+            unique.setdefault((text.lower(), _KINDS.index(kind)), text)
+        ordered = sorted(unique.items())
+
+        with self._lock:
+            self._keys = [key for (key, _), _ in ordered]
+            self._texts = [text for _, text in ordered]
+            self._kinds = bytearray(kind for (_, kind), _ in ordered)
+            for text, kind in self._pending:
+                self._insert(text, kind)
+            self._pending = None
+            self.built = (generation == self._generation)
+
+    '''
+    Marks the index out of date, to be rebuilt by the next ensure_built.
+    Lookups answer from the old entries until then.
+    '''
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.built = False
+
+    '''
+    Whether add() is kept: the index is built or being built.
+    '''
+    def tracking(self):
+        return self.built or self._pending != None
+
+    '''
+    Adds one title or author, keeping the index sorted.
+    '''
+    def add(self, text, kind):
+        with self._lock:
+            if (self._pending != None):
+                self._pending.append((text, kind))
+            elif (self.built):
+                self._insert(text, kind)
+
+    def _insert(self, text, kind):
+        key = text.lower()
+        kind = _KINDS.index(kind)
+        i = bisect_left(self._keys, key)
+        while (i < self._keys.__len__() and self._keys[i] == key):
+            if (self._kinds[i] == kind):
+                return
+            i += 1
+        self._keys.insert(i, key)
+        self._texts.insert(i, text)
+        self._kinds.insert(i, kind)
+
+    '''
+    Returns up to k titles and authors starting with prefix, in
+    alphabetical order.
+    '''
+    def suggest(self, prefix, k=DEFAULT_SUGGESTIONS):
+        prefix = prefix.lower()
+        matches = []
+        with self._lock:
+            i = bisect_left(self._keys, prefix)
+            while (i < self._keys.__len__() and matches.__len__() < k
+                    and self._keys[i].startswith(prefix)):
+                matches.append({'text': self._texts[i], 'type': _KINDS[self._kinds[i]]})
+                i += 1
+        return matches
+
+    def __len__(self):
+        return self._keys.__len__()
@@ -1,49 +1,500 @@
+import contextvars
+import functools
+import logging
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import re
+import threading
+import time
 import yaml
 import os
+from contextlib import contextmanager
 
+# Pool sizing defaults, overridable with pool_min / pool_max in config/db.yml.
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 10
+# Seconds to wait for a free connection before giving up.
+DEFAULT_POOL_TIMEOUT = 30
+# Idle connections older than this many seconds are pinged on checkout.
+DEFAULT_POOL_PING_AFTER = 30
+# Rows fetched per round trip by exec_stream.
+DEFAULT_STREAM_BATCH = 1000
+# Queries slower than this many milliseconds are logged, overridable with
+# slow_query_ms in config/db.yml. Slow SELECTs also log their EXPLAIN ANALYZE
+# plan unless slow_query_explain is false.
+DEFAULT_SLOW_QUERY_MS = 500
+# Queries kept per QueryStats for inspection; totals count every query.
+MAX_RECORDED_QUERIES = 100
+# Longest statement text written to the slow query log.
+MAX_LOGGED_SQL = 1000
+
+logger = logging.getLogger(__name__)
+
+_config = None
+_config_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+'''
+Reads config/db.yml once and caches it for the life of the process.
+'''
+def load_config():
+    global _config
+    if (_config == None):
+        with _config_lock:
+            if (_config == None):
+                yml_path = os.path.join(os.path.dirname(__file__), '../../config/db.yml')
+                with open(yml_path, 'r') as file:
+                    _config = yaml.load(file, Loader=yaml.FullLoader)
+    return _config
+
+_query_stats = contextvars.ContextVar('query_stats', default=None)
+
+'''
+Totals for the queries run while it is the current stats (see
+collect_query_stats): query count, rows returned or changed, time spent
+in the database and time spent waiting for a pooled connection, plus the
+first MAX_RECORDED_QUERIES queries as (normalized sql, ms, rows).
+'''
+class QueryStats:
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+        self.connections = 0
+        self.connection_time = 0.0
+        self.recorded = []
+
+    def add_query(self, sql, seconds, rows):
+        self.queries += 1
+        self.rows += rows
+        self.db_time += seconds
+        if (len(self.recorded) < MAX_RECORDED_QUERIES):
+            self.recorded.append((normalize_sql(sql), round(seconds * 1000, 3), rows))
+
+    def add_connection(self, seconds):
+        self.connections += 1
+        self.connection_time += seconds
+
+    def summary(self):
+        return {'queries': self.queries, 'rows': self.rows,
+                'db_ms': round(self.db_time * 1000, 3),
+                'connections': self.connections,
+                'connection_ms': round(self.connection_time * 1000, 3)}
+
+'''
+Makes a new QueryStats current for this thread or task and returns it
+with the token that stop_query_stats() needs to restore the previous one.
+'''
+def start_query_stats():
+    stats = QueryStats()
+    return stats, _query_stats.set(stats)
+
+def stop_query_stats(token):
+    _query_stats.reset(token)
+
+'''
+Returns the current QueryStats, or None when nothing is collecting.
+'''
+def current_query_stats():
+    return _query_stats.get()
+
+'''
+Collects the stats of the queries run inside a with block.
+'''
+@contextmanager
+def collect_query_stats():
+    stats, token = start_query_stats()
+    try:
+        yield stats
+    finally:
+        stop_query_stats(token)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$%])-?\d+(?:\.\d+)?\b")
+_COMMENT = re.compile(r"--[^\n]*")
+_WHITESPACE = re.compile(r"\s+")
+
+'''
+Reduces a statement to its shape for logs and grouping: comments dropped,
+whitespace collapsed and literals replaced with ?. Parameters stay as
+their %(name)s placeholders.
+'''
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    if (isinstance(sql, bytes)):
+        sql = sql.decode()
+    sql = _COMMENT.sub(' ', str(sql))
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+def _slow_query_settings():
+    config = load_config()
+    return (config.get('slow_query_ms', DEFAULT_SLOW_QUERY_MS),
+            config.get('slow_query_explain', True))
+
+'''
+The cursor every connection hands out. Each execute() is timed and added
+to the current QueryStats, and statements slower than slow_query_ms are
+logged as warnings. A slow SELECT run outside a transaction also has its
+plan captured (see SlowQueryExplainer).
+'''
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, sql, args=None):
+        start = time.perf_counter()
+        try:
+            super().execute(sql, args)
+        except psycopg2.Error:
+            self._record(sql, args, time.perf_counter() - start, plannable=False)
+            raise
+        self._record(sql, args, time.perf_counter() - start)
+
+    def executemany(self, sql, args_list):
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, args_list)
+        finally:
+            # the statement ran once per argument set, so there is no one plan
+            self._record(sql, None, time.perf_counter() - start, plannable=False)
+
+    def _record(self, sql, args, seconds, plannable=True):
+        rows = max(self.rowcount, 0)
+        stats = _query_stats.get()
+        if (stats != None):
+            stats.add_query(sql, seconds, rows)
+
+        threshold, explain = _slow_query_settings()
+        if (threshold != None and seconds * 1000 >= threshold):
+            logger.warning('slow query (%.1f ms, %d rows): %s', seconds * 1000, rows,
+                           normalize_sql(sql)[:MAX_LOGGED_SQL])
+            # inside a transaction the statement may depend on, or hold, locks
+            # and rows another connection cannot see, so only explain it when
+            # it ran on its own
+            if (explain and plannable and self.name == None and self.connection.autocommit):
+                slow_queries.explain(self.mogrify(sql, args))
+
+'''
+Logs EXPLAIN ANALYZE plans for slow queries from a background thread on
+its own connection, so the caller is not kept waiting while the query
+runs a second time. Only single SELECT statements are explained, inside a
+transaction that is rolled back, and each statement shape at most once
+every interval seconds. A query that turns slow while another is being
+explained is skipped.
+'''
+class SlowQueryExplainer:
+    def __init__(self, interval=300):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._busy = False
+        self._explained = {}    # normalized sql -> time last explained
+
+    def explain(self, statement):
+        if (not _explainable(statement)):
+            return False
+        shape = normalize_sql(statement)
+        now = time.monotonic()
+        with self._lock:
+            if (self._busy or now - self._explained.get(shape, -self.interval) < self.interval):
+                return False
+            self._busy = True
+            self._explained[shape] = now
+        threading.Thread(target=self._run, args=(statement, shape), daemon=True,
+                         name='explain-slow-query').start()
+        return True
+
+    def _run(self, statement, shape):
+        try:
+            conn = psycopg2.connect(**connect_args())
+            try:
+                cur = conn.cursor()
+                cur.execute(b'EXPLAIN (ANALYZE, BUFFERS) ' + statement)
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+                logger.warning('plan for slow query: %s\n%s', shape, plan)
+            finally:
+                conn.rollback()
+                conn.close()
+        except psycopg2.Error as e:
+            logger.warning('could not explain slow query: %s: %s', shape, e)
+        finally:
+            with self._lock:
+                self._busy = False
+
+    '''
+    Waits for a running explain to finish, for tests.
+    '''
+    def wait(self, timeout=None):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            with self._lock:
+                if (not self._busy):
+                    return True
+            if (timeout != None and time.monotonic() > deadline):
+                return False
+            time.sleep(0.01)
+
+slow_queries = SlowQueryExplainer()
+
+def _explainable(statement):
+    # EXPLAIN ANALYZE runs the statement again, so only one read-only statement
+    statement = statement.decode() if isinstance(statement, bytes) else statement
+    statement = _COMMENT.sub(' ', statement).strip().rstrip(';')
+    return statement[:6].upper() == 'SELECT' and ';' not in _STRING_LITERAL.sub('', statement)
+
+def connect_args():
+    config = load_config()
+    return {'dbname': config['database'], 'user': config['user'],
+            'password': config['password'], 'host': config['host'],
+            'port': config['port']}
+
+'''
+Opens a new, unpooled connection. Prefer borrow() for regular queries.
+'''
 def connect():
-    config = {}
-    yml_path = os.path.join(os.path.dirname(__file__), '../../config/db.yml')
-    with open(yml_path, 'r') as file:
-        config = yaml.load(file, Loader=yaml.FullLoader)
-    return psycopg2.connect(dbname=config['database'],
-                            user=config['user'],
-                            password=config['password'],
-                            host=config['host'],
-                            port=config['port'])
+    return psycopg2.connect(cursor_factory=InstrumentedCursor, **connect_args())
+
+'''
+A thread-safe pool of psycopg2 connections.
+
+minconn connections are opened up front and more are opened on demand up
+to maxconn; returned connections are kept for reuse. Callers block for up
+to timeout seconds when every connection is checked out. On checkout a
+connection that is closed or mid-transaction is replaced, and one that has
+sat idle for longer than ping_after seconds is verified with a trivial
+query first.
+
+Pooled connections are handed out in autocommit mode, so single statements
+need no separate COMMIT/ROLLBACK round trip. Code that needs a multi-statement
+transaction should use transaction() instead of toggling this itself.
+'''
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, timeout=DEFAULT_POOL_TIMEOUT,
+                 ping_after=DEFAULT_POOL_PING_AFTER):
+        if (minconn < 0 or maxconn < 1 or minconn > maxconn):
+            raise psycopg2.pool.PoolError('invalid pool size: min %s, max %s' % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.closed = False
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []         # (connection, time it was returned)
+        self._in_use = set()
+
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.monotonic()))
+
+    def getconn(self):
+        if (self.closed):
+            raise psycopg2.pool.PoolError('connection pool is closed')
+        if (not self._slots.acquire(timeout=self.timeout)):
+            raise psycopg2.pool.PoolError('timed out waiting for a database connection')
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use.add(conn)
+        return conn
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if (not self._idle):
+                    break
+                conn, returned_at = self._idle.pop()
+            if (self._healthy(conn, returned_at)):
+                return conn
+            self._discard(conn)
+        return self._open()
+
+    def _open(self):
+        conn = connect()
+        conn.autocommit = True
+        return conn
+
+    def _healthy(self, conn, returned_at):
+        if (conn.closed):
+            return False
+        if (conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            return False
+        if (time.monotonic() - returned_at < self.ping_after):
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            if (conn not in self._in_use):
+                raise psycopg2.pool.PoolError("connection doesn't belong to this pool")
+            self._in_use.discard(conn)
+
+        try:
+            if (not conn.closed and not close):
+                # never hand out a connection with a transaction still open
+                if (conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+                    conn.rollback()
+                conn.autocommit = True
+            keep = not (close or conn.closed or self.closed)
+        except psycopg2.Error:
+            keep = False
+
+        with self._lock:
+            if (keep and len(self._idle) < self.maxconn):
+                self._idle.append((conn, time.monotonic()))
+            else:
+                keep = False
+        if (not keep):
+            self._discard(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def closeall(self):
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    '''
+    Returns a snapshot of pool usage.
+    '''
+    def stats(self):
+        with self._lock:
+            return {'min': self.minconn, 'max': self.maxconn,
+                    'idle': len(self._idle), 'in_use': len(self._in_use)}
+
+def _create_pool(minconn=None, maxconn=None):
+    config = load_config()
+    if (minconn == None):
+        minconn = config.get('pool_min', DEFAULT_POOL_MIN)
+    if (maxconn == None):
+        maxconn = config.get('pool_max', DEFAULT_POOL_MAX)
+    return ConnectionPool(minconn, maxconn,
+                          timeout=config.get('pool_timeout', DEFAULT_POOL_TIMEOUT),
+                          ping_after=config.get('pool_ping_after', DEFAULT_POOL_PING_AFTER))
+
+'''
+(Re)creates the process-wide connection pool. Sizes default to pool_min
+and pool_max from config/db.yml. get_pool() calls this lazily.
+'''
+def init_pool(minconn=None, maxconn=None):
+    global _pool
+    with _pool_lock:
+        if (_pool != None):
+            _pool.closeall()
+        _pool = _create_pool(minconn, maxconn)
+    return _pool
+
+def get_pool():
+    global _pool
+    if (_pool == None):
+        with _pool_lock:
+            if (_pool == None):
+                _pool = _create_pool()
+    return _pool
+
+'''
+Closes every idle pooled connection and forgets the pool.
+'''
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if (_pool != None):
+            _pool.closeall()
+            _pool = None
+
+'''
+Borrows an autocommit connection from the pool for the duration of a with
+block. Any transaction left open is rolled back before it is returned.
+'''
+@contextmanager
+def borrow():
+    pool = get_pool()
+    start = time.perf_counter()
+    conn = pool.getconn()
+    stats = _query_stats.get()
+    if (stats != None):
+        stats.add_connection(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+'''
+Runs a with block as one transaction on one pooled connection and yields
+its cursor. Commits when the block finishes, rolls back if it raises.
+'''
+@contextmanager
+def transaction():
+    with borrow() as conn:
+        conn.autocommit = False
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
 
 def exec_sql_file(path):
     full_path = os.path.join(os.path.dirname(__file__), f'../../{path}')
-    conn = connect()
-    cur = conn.cursor()
-    with open(full_path, 'r') as file:
-        cur.execute(file.read())
-    conn.commit()
-    conn.close()
+    with borrow() as conn:
+        cur = conn.cursor()
+        with open(full_path, 'r') as file:
+            cur.execute(file.read())
+        conn.commit()
 
 def exec_get_one(sql, args={}):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(sql, args)
-    one = cur.fetchone()
-    conn.close()
+    with borrow() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, args)
+        one = cur.fetchone()
     return one
 
 def exec_get_all(sql, args={}):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(sql, args)
-    # https://www.psycopg.org/docs/cursor.html#cursor.fetchall
+    with borrow() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, args)
+        # https://www.psycopg.org/docs/cursor.html#cursor.fetchall
 
-    list_of_tuples = cur.fetchall()
-    conn.close()
+        list_of_tuples = cur.fetchall()
     return list_of_tuples
 
 def exec_commit(sql, args={}):
-    conn = connect()
-    cur = conn.cursor()
-    result = cur.execute(sql, args)
-    conn.commit()
-    conn.close()
-    return result
\ No newline at end of file
+    with borrow() as conn:
+        cur = conn.cursor()
+        result = cur.execute(sql, args)
+        conn.commit()
+    return result
+
+'''
+Runs a query through a server-side (named) cursor and yields its rows in
+lists of up to batch_size, so memory stays flat regardless of result size.
+The pooled connection is held until the generator is exhausted or closed.
+'''
+def exec_stream(sql, args={}, batch_size=DEFAULT_STREAM_BATCH):
+    with borrow() as conn:
+        # named cursors only live inside a transaction
+        conn.autocommit = False
+        cur = conn.cursor(name='exec_stream')
+        cur.itersize = batch_size
+        cur.execute(sql, args)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if (not rows):
+                break
+            yield rows
+        cur.close()
@@ -0,0 +1,85 @@
+'''
+Production settings for serving the API with gunicorn, a pre-fork WSGI
+server. From src/, where gunicorn picks this file up by itself:
+    gunicorn server:app
+    gunicorn server:app --workers 8 --threads 4 --bind 0.0.0.0:8000
+
+Settings come from the environment, and any can be overridden on the
+command line:
+    WEB_BIND              address to listen on (127.0.0.1:8000)
+    WEB_CONCURRENCY       worker processes (2 per CPU + 1)
+    WEB_THREADS           request threads per worker (4)
+    WEB_TIMEOUT           seconds a silent worker is given before it is restarted (60)
+    WEB_GRACEFUL_TIMEOUT  seconds workers get to finish their requests on reload or shutdown (30)
+    WEB_MAX_REQUESTS      requests a worker serves before it is replaced, 0 for never (0)
+
+The app is imported once in the master and the workers are forked from
+it, so they start without importing it again. Database connections,
+caches and the catalog listener are not shared across a fork. The master
+closes its pool before forking, and each worker opens its own after.
+Every worker has its own pool, caches and /metrics counters. A request
+thread can hold two pooled connections at once: a streamed /books listing
+keeps its cursor's connection while it looks up each batch's availability.
+So each worker holds up to max(pool_max, 2 * threads) pooled connections,
+plus one for the catalog listener.
+
+Reloading:
+    kill -HUP <master>    re-reads these settings and replaces the workers
+    kill -USR2 <master>   starts a new master on new code, then
+                          kill -QUIT <old master> once it is up
+    kill -TERM <master>   graceful shutdown
+Workers being replaced stop accepting connections and finish their
+in-flight requests, for up to the graceful timeout. Preloading means
+HUP does not pick up code changes, so use USR2 for those.
+'''
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+
+'''
+Runs in the master before every fork, including forks that replace a dead
+worker. A connection inherited by a child shares its socket with the
+master, so the master must not hold any.
+'''
+def pre_fork(server, worker):
+    from db.swen344_db_utils import close_pool
+    close_pool()
+
+'''
+Runs in each new worker. Opens the worker's own pool, sized for two
+connections per thread, and starts from empty caches. The catalog
+listener is started here rather than by the first request, and clears the
+catalog cache again as it connects; the type-ahead index is built after
+that, before the worker takes requests.
+'''
+def post_fork(server, worker):
+    from db import library
+    from db.swen344_db_utils import DEFAULT_POOL_MAX, init_pool, load_config
+
+    pool_max = load_config().get('pool_max', DEFAULT_POOL_MAX)
+    init_pool(maxconn = max(pool_max, 2 * server.cfg.threads))
+    library.sessions.clear()
+    library.catalog.clear()
+    library.catalog.forget_version()
+    library.suggestions.invalidate()
+    if (not library.catalog_listener.running()):
+        server.log.warning('worker %s: catalog listener not connected, caching is off', worker.pid)
+    library.load_suggestions()
+
+def worker_exit(server, worker):
+    from db import library
+    from db.swen344_db_utils import close_pool
+
+    library.catalog_listener.stop()
+    close_pool()
@@ -1,20 +1,40 @@
+import logging
 from flask import Flask
 from flask_restful import Resource, Api
 from api.hello_world import HelloWorld
 from api.users import *
 from api.books import *
+from api.reports import *
+from api.exports import *
+from api import instrumentation, metrics
+from db import library
 
 app = Flask(__name__)
 api = Api(app)
+instrumentation.init_app(app)
+metrics.init_app(app)
 
 api.add_resource(HelloWorld, '/')
 api.add_resource(Login, '/login')
 api.add_resource(User, '/user')
 api.add_resource(Users, '/users')
 api.add_resource(Checkout, '/checkout')
+api.add_resource(SessionStats, '/sessions/stats')
 api.add_resource(Books, '/books')
+api.add_resource(SearchBooks, '/books/search')
+api.add_resource(SuggestBooks, '/books/suggest')
 api.add_resource(SearchBooksSingleTerm, '/books/<type>')
 api.add_resource(SearchBooksMultipleTerms, '/books/<type>/<string>')
+api.add_resource(LibraryReport, '/reports/libraries')
+api.add_resource(LoanReport, '/reports/loans')
+api.add_resource(CheckoutExport, '/exports/checkouts')
+api.add_resource(LibraryHistoryExport, '/exports/libraries/<int:library_id>/history')
+api.add_resource(UserHistoryExport, '/exports/users/<int:user_id>/history')
+api.add_resource(metrics.Metrics, '/metrics')
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # the listener resets the caches as it connects, so connect it first
+    library.catalog_listener.running()
+    library.load_suggestions()
     app.run(debug=True)
\ No newline at end of file
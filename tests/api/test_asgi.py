@@ -0,0 +1,111 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from starlette.testclient import TestClient
+from src.db import async_db_utils, async_library
+
+# the apps import their modules as db.* and api.*, as when run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+from asgi import app as asgi_app
+from server import app as wsgi_app
+from db import library
+
+READS = ['/', '/books', '/books?after=3&limit=4', '/books?stream=ndjson', '/books/fiction',
+         '/books/non-fiction', '/books/Harper Lee', '/books/Stephen King',
+         '/books/fiction/Rick Riordan', '/books/search?q=thief', '/books/search?q=tolkein&limit=5',
+         '/books/suggest?prefix=th', '/users', '/users?after=1&limit=1', '/users?stream=ndjson',
+         '/books?limit=0']
+
+# requests both apps reject, as (method, path, form, headers)
+ERRORS = [('GET', '/books?limit=abc', None, {}), ('GET', '/books?stream=csv', None, {}),
+          ('GET', '/books/search', None, {}), ('GET', '/books/search?q=a&limit=x', None, {}),
+          ('GET', '/books/suggest', None, {}), ('GET', '/books/suggest?prefix=a&k=0', None, {}),
+          ('PUT', '/user', {'username': 'gleason34', 'contact_info': 'g@example.com'}, {}),
+          ('DELETE', '/user?username=gleason34', None, {}),
+          ('POST', '/checkout', {'library_id': 'one', 'title': 'Frankenstein'}, {'session': '1'}),
+          ('POST', '/checkout', {'library_id': 4, 'title': 'Frankenstein'}, {})]
+
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        library.rebuild_tables()
+
+    def test_same_responses_as_wsgi(self):
+        """The async app answers every read like the Flask app"""
+        wsgi = wsgi_app.test_client()
+        with TestClient(asgi_app, base_url = 'http://localhost') as client:
+            for path in READS:
+                expected = wsgi.get(path)
+                actual = client.get(path)
+                self.assertEqual(expected.status_code, actual.status_code, path)
+                if (expected.mimetype == 'application/x-ndjson'):
+                    self.assertEqual(expected.get_data(as_text = True), actual.text, path)
+                else:
+                    self.assertEqual(expected.get_json(), actual.json() if expected.is_json else None, path)
+                self.assertEqual(expected.headers.get('Link'), actual.headers.get('link'), path)
+
+    def test_same_errors_as_wsgi(self):
+        """Bad requests get the Flask app's status and JSON message"""
+        wsgi = wsgi_app.test_client()
+        with TestClient(asgi_app, base_url = 'http://localhost') as client:
+            for method, path, form, headers in ERRORS:
+                expected = wsgi.open(path, method = method, data = form, headers = headers)
+                actual = client.request(method, path, data = form, headers = headers)
+                self.assertEqual(400, expected.status_code, path)
+                self.assertEqual(expected.status_code, actual.status_code, path)
+                self.assertEqual(expected.get_json(), actual.json(), path)
+
+    def test_suggestions_rebuilt_off_the_event_loop(self):
+        """After a catalog change, the type-ahead index is rebuilt before answering"""
+        with TestClient(asgi_app, base_url = 'http://localhost') as client:
+            self.assertTrue(library.suggestions.built)
+            library.suggestions.invalidate()
+            self.assertEqual([{'text': 'The Dead Romantics', 'type': 'title'}],
+                client.get('/books/suggest?prefix=the d').json())
+            self.assertTrue(library.suggestions.built)
+
+    def test_account_and_checkout(self):
+        """Accounts, logins and checkouts work through the async app"""
+        account = {'name': 'Art Garfunkel', 'contact_info': 'art@example.com', 'username': 'art',
+                   'password': 'pw'}
+        with TestClient(asgi_app, base_url = 'http://localhost') as client:
+            self.assertEqual('Account created successfully.', client.post('/user', data = account).json())
+            self.assertEqual('Request failed, cannot create account - user already exists.',
+                client.post('/user', data = account).json())
+            self.assertEqual('Login unsuccessful, incorrect password.',
+                client.post('/login', data = {'username': 'art', 'password': 'nope'}).json())
+            key = client.post('/login', data = {'username': 'art', 'password': 'pw'}).json()['Login successful.']
+
+            self.assertEqual("User's account info updated successfully.", client.put('/user',
+                data = {'username': 'art', 'contact_info': 'a@example.com'}, headers = {'session': key}).json())
+            self.assertEqual('The Lightning Thief successfully checked out.', client.post('/checkout',
+                data = {'library_id': 1, 'title': 'The Lightning Thief', 'username': 'art',
+                        'checkout_date': '2022-01-01'}, headers = {'session': key}).json())
+            self.assertEqual(3, client.get('/books/fiction/Rick Riordan').json()['7']['copies'])
+            self.assertEqual('"2022-01-15"', client.get('/user?user_id=3').json()['7']['due date'])
+            self.assertEqual('No authentication, cannot checkout book.', client.post('/checkout',
+                data = {'library_id': 1, 'title': 'The Lightning Thief', 'username': 'art',
+                        'checkout_date': '2022-01-01'}, headers = {'session': 'wrong'}).json())
+            self.assertEqual('Account successfully deleted.',
+                client.delete('/user?username=art', headers = {'session': key}).json())
+
+    def test_books_and_availability_are_concurrent(self):
+        """A listing and its availability are loaded at the same time"""
+        async def read():
+            await async_db_utils.init_pool(2, 2)
+            try:
+                start = time.perf_counter()
+                books, availability = await async_library.books_with_availability("""
+                    SELECT inventory.* FROM inventory, pg_sleep(0.3)
+                    WHERE book_type = %(type)s ORDER BY book_id""", {'type': 'Fiction'},
+                    key = ('books', 'slow fiction'))
+                return books, availability, time.perf_counter() - start
+            finally:
+                await async_db_utils.close_pool()
+
+        books, availability, seconds = asyncio.run(read())
+        self.assertEqual(6, books.__len__())
+        self.assertEqual('Penfield, Fairport, Henrietta', availability[7])
+        self.assertLess(seconds, 0.55)
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+from flask import Flask
+from flask_restful import Api, Resource
+
+# the api modules import db.*, as when run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+from api.conditional import catalog_conditional
+from db import library
+
+class Created(Resource):
+    @catalog_conditional
+    def get(self):
+        return {'created': True}, 201
+
+class Tagged(Resource):
+    @catalog_conditional
+    def get(self):
+        return {'tagged': True}, 200, {'X-Tag': 'yes'}
+
+class TestCatalogConditional(unittest.TestCase):
+
+    def setUp(self):
+        # a known catalog version, without the listener
+        patcher = patch.object(library, 'catalog_version', lambda: 7)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app = Flask(__name__)
+        api = Api(app)
+        api.add_resource(Created, '/created')
+        api.add_resource(Tagged, '/tagged')
+        self.client = app.test_client()
+
+    def test_body_and_status(self):
+        """A (body, status) return keeps its status and gets the ETag"""
+        response = self.client.get('/created')
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({'created': True}, response.get_json())
+        self.assertEqual(304, self.client.get('/created',
+            headers = {'If-None-Match': response.headers['ETag']}).status_code)
+
+    def test_body_status_and_headers(self):
+        response = self.client.get('/tagged')
+        self.assertEqual('yes', response.headers['X-Tag'])
+        self.assertEqual('"catalog-7"', response.headers['ETag'])
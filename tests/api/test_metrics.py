@@ -0,0 +1,31 @@
+import os
+import sys
+import threading
+import unittest
+
+# the api modules import db.*, as when run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../src'))
+from api.metrics import Registry
+
+class TestRegistry(unittest.TestCase):
+
+    def test_exited_threads_are_retired(self):
+        """A thread's counters outlive it in the totals but are no longer kept apart"""
+        registry = Registry(buckets = (0.01, 0.1))
+
+        def request():
+            registry.inc('http_requests_total', (('route', '/books'),))
+            registry.observe((('route', '/books'),), 0.05)
+
+        for _ in range(20):
+            thread = threading.Thread(target = request)
+            thread.start()
+            thread.join()
+        request()
+
+        counters, histograms = registry.collect()
+        self.assertEqual(21, counters[('http_requests_total', (('route', '/books'),))])
+        histogram = histograms[(('route', '/books'),)]
+        self.assertEqual([0, 21, 0, 21], histogram[:3] + histogram[-1:])
+        self.assertAlmostEqual(1.05, histogram[-2])
+        self.assertEqual(1, registry._threads.__len__())
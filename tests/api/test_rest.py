@@ -1,10 +1,14 @@
+import csv
+import io
+import json
+import time
 import unittest
 from tests.test_utils import *
-from src.db.library import rebuild_tables
+from src.db.library import add_to_library, get_library_report, get_loan_report, rebuild_tables
 
 class TestRest(unittest.TestCase):
 
-    def set_up(self):
+    def setUp(self):
         rebuild_tables()
 
     def test01_get_all_users(self):
@@ -244,4 +248,161 @@ class TestRest(unittest.TestCase):
             "checkout_date": "2022-12-10"
         }
         result = post_rest_call(self, 'http://localhost:5000/checkout', body, session)
-        print('\nTest checkout book by title, no authentication:', result)
\ No newline at end of file
+        print('\nTest checkout book by title, no authentication:', result)
+
+    def test21_books_page(self):
+        # keyset pagination - three books after book 2
+        actual = get_rest_call(self, 'http://localhost:5000/books', {'after': 2, 'limit': 3})
+        self.assertEqual(['3', '4', '5'], list(actual.keys()))
+
+        # last page is short
+        actual = get_rest_call(self, 'http://localhost:5000/books', {'after': 8, 'limit': 3})
+        self.assertEqual(['9', '10'], list(actual.keys()))
+
+        # bad page size
+        get_rest_call(self, 'http://localhost:5000/books', {'limit': 0}, 400)
+
+    def test22_users_stream(self):
+        response = requests.get('http://localhost:5000/users', {'stream': 'ndjson'})
+        self.assertEqual(200, response.status_code)
+        users = [json.loads(line) for line in response.text.splitlines()]
+
+        # same users, in the same order, as the buffered listing
+        expected = get_rest_call(self, 'http://localhost:5000/users')
+        self.assertEqual(list(expected.keys()), [str(user['id']) for user in users])
+
+    def test23_search_fiction_and_title(self):
+        # multiple search terms - fiction books with this title
+        actual = get_rest_call(self, 'http://localhost:5000/books/fiction/Frankenstein')
+        self.assertEqual(['9'], list(actual.keys()))
+
+        # unknown genre
+        actual = get_rest_call(self, 'http://localhost:5000/books/poetry/Frankenstein')
+        self.assertEqual([], actual)
+
+    def test24_search_catalog(self):
+        # full-text search matches words inside titles, authors and summaries
+        actual = get_rest_call(self, 'http://localhost:5000/books/search', {'q': 'Tolkien'})
+        self.assertEqual(['6'], list(actual.keys()))
+        self.assertEqual('The Lord of the Rings', actual['6']['title'])
+
+        # ranked, best match first
+        actual = get_rest_call(self, 'http://localhost:5000/books/search', {'q': 'artificial intelligence'})
+        self.assertEqual('3', list(actual.keys())[0])
+
+        actual = get_rest_call(self, 'http://localhost:5000/books/search', {'q': 'vampires'})
+        self.assertEqual([], actual)
+
+        # query is required
+        get_rest_call(self, 'http://localhost:5000/books/search', {}, 400)
+
+    def test25_suggest_books(self):
+        expected = [
+            {'text': 'Mary Shelley', 'type': 'author'},
+            {'text': 'Maria Popova', 'type': 'author'}
+        ]
+        actual = get_rest_call(self, 'http://localhost:5000/books/suggest', {'prefix': 'mar'})
+        self.assertEqual(sorted(expected, key = lambda match: match['text']), actual)
+
+        actual = get_rest_call(self, 'http://localhost:5000/books/suggest', {'prefix': 'the', 'k': 2})
+        self.assertEqual(2, actual.__len__())
+
+        get_rest_call(self, 'http://localhost:5000/books/suggest', {'prefix': 'the', 'k': 0}, 400)
+
+    def test26_books_etag(self):
+        response = requests.get('http://localhost:5000/books')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('"catalog-'))
+
+        # unchanged catalog - 304 with no body, for every catalog resource
+        for url in ['http://localhost:5000/books', 'http://localhost:5000/books/fiction',
+                    'http://localhost:5000/books/fiction/Frankenstein']:
+            response = requests.get(url, headers = {'If-None-Match': etag})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual('', response.text)
+
+        # a stock change anywhere gives a new version
+        add_to_library(1, 9, 1)
+        deadline = time.monotonic() + 5
+        response = requests.get('http://localhost:5000/books', headers = {'If-None-Match': etag})
+        while response.status_code == 304 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            response = requests.get('http://localhost:5000/books', headers = {'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+    def test27_library_report(self):
+        # same numbers as the library report, keyed by library id
+        expected = get_library_report()
+        actual = get_rest_call(self, 'http://localhost:5000/reports/libraries')
+        self.assertEqual([str(row[0]) for row in expected], list(actual.keys()))
+        self.assertEqual([(row[1], row[3], row[4]) for row in expected],
+            [(report['name'], report['copies'], report['loans']) for report in actual.values()])
+
+        actual = get_rest_call(self, 'http://localhost:5000/reports/libraries',
+            {'from': '2020-09-09', 'to': '2020-09-30'})
+        self.assertEqual([row[4] for row in get_library_report('2020-09-09', '2020-09-30')],
+            [report['loans'] for report in actual.values()])
+
+    def test28_loan_report(self):
+        expected = get_loan_report(None, '2020-09-10')
+        actual = get_rest_call(self, 'http://localhost:5000/reports/loans', {'to': '2020-09-10'})
+        self.assertEqual(expected[-1][2:4], (actual['loans'], actual['returned']))
+        self.assertEqual([row[2] for row in expected[:-1]],
+            [report['loans'] for report in actual['libraries'].values()])
+        self.assertEqual('2020-09-10', actual['to'])
+
+        # bad date and backwards range
+        get_rest_call(self, 'http://localhost:5000/reports/loans', {'from': 'yesterday'}, 400)
+        get_rest_call(self, 'http://localhost:5000/reports/loans', {'from': '2020-10-01', 'to': '2020-09-01'}, 400)
+
+    def test29_export_checkouts(self):
+        response = requests.get('http://localhost:5000/exports/checkouts')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv; charset=utf-8', response.headers['Content-Type'])
+        rows = list(csv.reader(io.StringIO(response.text)))
+        self.assertEqual('library_id', rows[0][0])
+
+        # same loans as ndjson
+        response = requests.get('http://localhost:5000/exports/checkouts', {'format': 'ndjson'})
+        loans = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(rows.__len__() - 1, loans.__len__())
+        self.assertEqual(rows[0], list(loans[0].keys()))
+
+        response = requests.get('http://localhost:5000/exports/users/1/history', {'format': 'ndjson'})
+        self.assertEqual(200, response.status_code)
+        get_rest_call(self, 'http://localhost:5000/exports/checkouts', {'format': 'xml'}, 400)
+
+    def test30_query_stats_headers(self):
+        response = requests.get('http://localhost:5000/books', {'limit': 3})
+        self.assertEqual(200, response.status_code)
+        self.assertGreaterEqual(int(response.headers['X-DB-Queries']), 1)
+        self.assertGreaterEqual(int(response.headers['X-DB-Rows']), 3)
+        self.assertGreater(float(response.headers['X-DB-Time']), 0)
+        self.assertIn('X-DB-Connection-Time', response.headers)
+
+        # pages that do not touch the database say so
+        response = requests.get('http://localhost:5000/no-such-page')
+        self.assertEqual(404, response.status_code)
+        self.assertEqual('0', response.headers['X-DB-Queries'])
+
+    def test31_metrics(self):
+        before = get_metrics(self)
+        key = (('route', '/books/<type>'), ('method', 'GET'))
+        get_rest_call(self, 'http://localhost:5000/books/fiction')
+        get_rest_call(self, 'http://localhost:5000/books/non-fiction')
+        after = get_metrics(self)
+
+        requests_key = ('http_requests_total', key + (('status', '200'),))
+        self.assertEqual(before.get(requests_key, 0) + 2, after[requests_key])
+        count_key = ('http_request_duration_seconds_count', key)
+        self.assertEqual(before.get(count_key, 0) + 2, after[count_key])
+        self.assertEqual(after[count_key],
+            after[('http_request_duration_seconds_bucket', key + (('le', '+Inf'),))])
+        self.assertGreater(after[('http_request_db_queries_total', (('route', '/books/<type>'),))], 0)
+
+        # the scrape itself is the only request in flight
+        self.assertEqual(1, after[('http_requests_in_flight', ())])
+        self.assertGreaterEqual(after[('db_pool_max_connections', ())], 1)
+        self.assertIn(('cache_hit_ratio', (('cache', 'catalog'),)), after)
+        self.assertIn(('cache_hits_total', (('cache', 'sessions'),)), after)
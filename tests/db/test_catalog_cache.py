@@ -0,0 +1,63 @@
+import unittest
+from src.db.catalog_cache import CatalogCache, CatalogListener
+
+class TestCatalogCache(unittest.TestCase):
+
+    def test_read_through(self):
+        cache = CatalogCache()
+        loads = []
+        loader = lambda: loads.append(1) or ['book']
+        self.assertEqual(['book'], cache.get_or_load(('books', 'all'), loader))
+        self.assertEqual(['book'], cache.get_or_load(('books', 'all'), loader))
+        self.assertEqual(1, loads.__len__())
+        stats = cache.stats()
+        self.assertEqual((1, 1), (stats['hits'], stats['misses']))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = CatalogCache(maxsize = 2)
+        cache.put_many({('availability', 1): 'a', ('availability', 2): 'b'}, cache.generation())
+        cache.lookup([('availability', 1)])
+        cache.put_many({('availability', 3): 'c'}, cache.generation())
+        self.assertEqual({('availability', 1): 'a', ('availability', 3): 'c'},
+            cache.lookup([('availability', 1), ('availability', 2), ('availability', 3)]))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_invalidate(self):
+        cache = CatalogCache()
+        cache.put_many({('books', 'all'): [], ('books', 'Fiction'): [], ('availability', 1): 'a'},
+            cache.generation())
+        cache.invalidate([('availability', 1)])
+        self.assertEqual(2, cache.stats()['size'])
+        cache.invalidate_kind('books')
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_value_loaded_during_invalidation_is_not_cached(self):
+        """A slow read that raced a write cannot put stale data back"""
+        cache = CatalogCache()
+        generation = cache.generation()
+        cache.invalidate([('availability', 1)])
+        cache.put_many({('availability', 1): 'stale'}, generation)
+        self.assertEqual({}, cache.lookup([('availability', 1)]))
+
+    def test_version_waits_for_own_change(self):
+        """A writer's process reports no version until it hears its own change"""
+        cache = CatalogCache()
+        self.assertEqual(None, cache.version())
+        cache.version_seen(5)
+        self.assertEqual(5, cache.version())
+
+        cache.expect_version(7)
+        cache.version_seen(6)
+        self.assertEqual(None, cache.version())
+        cache.version_seen(7)
+        self.assertEqual(7, cache.version())
+
+        # already heard before the writer reported it
+        cache.version_seen(8)
+        cache.expect_version(8)
+        self.assertEqual(8, cache.version())
+
+    def test_listening_does_not_start_the_listener(self):
+        listener = CatalogListener(lambda payload: None, lambda: None)
+        self.assertFalse(listener.listening())
+        self.assertEqual(None, listener._thread)
@@ -0,0 +1,94 @@
+import unittest
+from src.db import library
+from src.db.generate import *
+from src.db.migrate import apply_migrations
+from src.db.swen344_db_utils import exec_get_all, exec_get_one, exec_sql_file
+from tests.test_utils import *
+
+SIZES = {'books': 300, 'users': 200, 'libraries': 7, 'checkouts': 5000}
+
+def checksum(table, order):
+    return exec_get_one("SELECT md5(string_agg(t::text, ',' ORDER BY %s)) FROM %s AS t" % (order, table))[0]
+
+class TestGenerate(unittest.TestCase):
+
+    def setUp(self):
+        library.rebuild_tables()
+
+    def tearDown(self):
+        library.rebuild_tables()
+
+    def test_generate_dataset(self):
+        """A generated dataset fills every table and its summaries"""
+        dataset, result = generate(batch_size = 700, **SIZES)
+        self.assertEqual({'libraries': 7, 'inventory': 300, 'users': 200, 'checkout': 5000},
+            {table: result[table] for table in ['libraries', 'inventory', 'users', 'checkout']})
+        assert_sql_count(self, "SELECT DISTINCT title FROM inventory", 300)
+        assert_sql_count(self, "SELECT * FROM book_search", 300)
+
+        # stock matches the dataset and the maintained totals
+        self.assertEqual(sorted(dataset.stock(42)), exec_get_all("""
+            SELECT library_id, book_copies FROM library_stock WHERE book_id = 42 ORDER BY library_id"""))
+        self.assertEqual(exec_get_one("SELECT sum(book_copies) FROM library_stock")[0],
+            exec_get_one("SELECT sum(copies) FROM library_totals")[0])
+        self.assertEqual((5000,), exec_get_one("SELECT sum(loans) FROM loan_totals"))
+
+        # every loan is at a library stocking the book, returned loans have no
+        # due date left and only they carry fees
+        assert_sql_count(self, """
+            SELECT * FROM checkout LEFT JOIN library_stock USING (library_id, book_id)
+            WHERE library_stock.book_id IS NULL""", 0)
+        assert_sql_count(self, """
+            SELECT * FROM checkout
+            WHERE (return_date IS NULL) = (due_date IS NULL)""", 0)
+        assert_sql_count(self, """
+            SELECT * FROM checkout
+            WHERE return_date IS NULL AND late_fees <> 0""", 0)
+        self.assertGreater(exec_get_one("SELECT count(*) FROM checkout WHERE late_fees > 0")[0], 0)
+
+        # generated users can log in, and new rows get fresh ids
+        self.assertIn('Login successful.', library.login(username(5), PASSWORD))
+        self.assertEqual(301, library.add_new_book('Dune', 'Fiction', 'Frank Herbert', 1))
+
+    def test_generate_is_deterministic(self):
+        """The same seed gives the same rows whatever the batch size"""
+        generate(seed = 7, batch_size = 1000, **SIZES)
+        first = [checksum('inventory', 'book_id'), checksum('checkout', 't::text')]
+        generate(seed = 7, batch_size = 333, **SIZES)
+        self.assertEqual(first, [checksum('inventory', 'book_id'), checksum('checkout', 't::text')])
+        generate(seed = 8, **SIZES)
+        self.assertNotEqual(first[1], checksum('checkout', 't::text'))
+
+    def test_generated_loans_are_skewed(self):
+        """A few books and borrowers account for most loans, and some are overdue"""
+        generate(books = 1000, users = 1000, libraries = 10, checkouts = 20000)
+        top_books = exec_get_one("""
+            SELECT sum(loans) FROM (SELECT count(*) AS loans FROM checkout
+            GROUP BY book_id ORDER BY loans DESC LIMIT 10) AS top""")[0]
+        self.assertGreater(top_books, 20000 * 0.2)
+
+        open_loans, overdue = exec_get_one("""
+            SELECT count(*), count(*) FILTER (WHERE due_date < %(end)s)
+            FROM checkout WHERE return_date IS NULL""", {'end': DEFAULT_END_DATE})
+        self.assertGreater(overdue, 0)
+        self.assertLess(open_loans, 20000 * 0.1)
+
+    def test_returned_loans_allow_checkout(self):
+        """A generated borrower whose loans were all returned can check out"""
+        dataset, _ = generate(**SIZES)
+        user_id = exec_get_one("""
+            SELECT user_id FROM checkout GROUP BY user_id
+            HAVING bool_and(return_date IS NOT NULL)
+            ORDER BY count(*) DESC LIMIT 1""")[0]
+        key = library.login(username(user_id), PASSWORD)['Login successful.']
+        library_id = dataset.stock(1)[0][0]
+        self.assertEqual(title(1) + ' successfully checked out.',
+            library.checkout_book(library_id, title(1), username(user_id), key, '2025-01-05'))
+
+    def test_generate_before_migrations(self):
+        """Data can be loaded into the bare schema and migrated afterwards"""
+        exec_sql_file('src/db/library_schema.sql')
+        generate(**SIZES)
+        apply_migrations()
+        self.assertEqual((5000,), exec_get_one("SELECT sum(loans) FROM loan_totals"))
+        assert_sql_count(self, "SELECT * FROM book_availability", 300)
@@ -0,0 +1,378 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from unittest.mock import patch
+from src.db import library
+from src.db.library import *
+from src.db.late_fees import accrue_late_fees
+from tests.test_utils import *
+
+class TestLibrary(unittest.TestCase):
+
+    def setUp(self):
+        rebuild_tables()
+
+    def test_libraries_for_books(self):
+        """Availability for several books comes back from one lookup"""
+        expected = {
+            6: 'Penfield',
+            8: 'Fairport, Henrietta',
+            9: 'Pittsford'
+        }
+        self.assertEqual(expected, get_libraries_for_books([6, 8, 9]))
+
+    def test_libraries_for_books_not_stocked(self):
+        """Books with no stock are left out, and no ids means no query"""
+        add_new_book('Dune', 'Fiction', 'Frank Herbert', 1)
+        self.assertEqual({}, get_libraries_for_books([11]))
+        self.assertEqual({}, get_libraries_for_books([]))
+        self.assertEqual('', get_libraries_with_book(11))
+
+    def test_books_page(self):
+        """Pages are ordered by id and start after the cursor"""
+        page = get_books_page(8, 5)
+        self.assertEqual([9, 10], [book[0] for book in page])
+
+    def test_stream_all_books(self):
+        """Streaming yields every book in id order, batch by batch"""
+        batches = list(stream_all_books(batch_size=4))
+        self.assertEqual([4, 4, 2], [batch.__len__() for batch in batches])
+        self.assertEqual(list(range(1, 11)), [book[0] for batch in batches for book in batch])
+
+    def test_checkout_book(self):
+        """Checkout takes a copy from the library and the master inventory"""
+        key = login('gleason34', 'pancakes')['Login successful.']
+        result = checkout_book(4, 'Frankenstein', 'gleason34', key, '2022-12-08')
+        self.assertEqual('Frankenstein successfully checked out.', result)
+        self.assertEqual((0,), get_book_copies(4, 9))
+        self.assertEqual([(0,)], exec_get_all("SELECT copies FROM inventory WHERE book_id = 9"))
+        self.assertEqual([(date(2022, 12, 22),)], exec_get_all("""
+            SELECT due_date FROM checkout WHERE user_id = 2 AND book_id = 9"""))
+
+    def test_checkout_book_no_copies(self):
+        """Nothing changes when the library has no copies left"""
+        key = login('gleason34', 'pancakes')['Login successful.']
+        result = checkout_book(1, 'The Lord of the Rings', 'gleason34', key, '2022-12-08')
+        self.assertEqual('No copies of The Lord of the Rings are available at this library.', result)
+        self.assertEqual((0,), get_book_copies(1, 6))
+        self.assertEqual([(1,)], exec_get_all("SELECT copies FROM inventory WHERE book_id = 6"))
+        assert_sql_count(self, "SELECT * FROM checkout WHERE book_id = 6", 0)
+
+    def test_checkout_book_not_authenticated(self):
+        result = checkout_book(4, 'Frankenstein', 'gleason34', '123456', '2022-12-08')
+        self.assertEqual('No authentication, cannot checkout book.', result)
+        self.assertEqual((1,), get_book_copies(4, 9))
+
+    def test_checkout_book_overdue(self):
+        """Ada's book from Henrietta was due 2020-09-22"""
+        key = login('lovelace12', 'password')['Login successful.']
+        with self.assertRaises(Exception):
+            checkout_book(4, 'Frankenstein', 'lovelace12', key, '2022-12-08')
+        self.assertEqual((1,), get_book_copies(4, 9))
+
+    def test_checkout_book_concurrent(self):
+        """Concurrent checkouts of the last copy cannot oversubscribe it"""
+        key = login('gleason34', 'pancakes')['Login successful.']
+        with ThreadPoolExecutor(max_workers = 5) as executor:
+            results = list(executor.map(lambda _: checkout_book(4, 'Frankenstein',
+                'gleason34', key, '2022-12-08'), range(5)))
+
+        self.assertEqual(1, results.count('Frankenstein successfully checked out.'))
+        self.assertEqual((0,), get_book_copies(4, 9))
+        assert_sql_count(self, "SELECT * FROM checkout WHERE book_id = 9", 1)
+
+    def test_return_book_on_time(self):
+        """A book returned before its due date has no fee"""
+        result = return_book(3, 5, 1, '2020-09-20')
+        self.assertEqual((3, 5, 1, date(2020, 9, 8), None, date(2020, 9, 20), Decimal('0.0')), result)
+        self.assertEqual((2,), get_book_copies(3, 5))
+        self.assertEqual([(7,)], exec_get_all("SELECT copies FROM inventory WHERE book_id = 5"))
+
+    def test_return_book_late(self):
+        """Late fees are $0.25 a day for 6 days, then $2.00 a day"""
+        self.assertEqual(Decimal('0.75'), return_book(3, 5, 1, '2020-09-25')[6])
+        rebuild_tables()
+        self.assertEqual(Decimal('9.50'), return_book(3, 5, 1, '2020-10-02')[6])
+
+    def test_return_book_twice(self):
+        """A returned book cannot be returned again"""
+        return_book(3, 5, 1, '2020-09-20')
+        with self.assertRaises(Exception):
+            return_book(3, 5, 1, '2020-09-21')
+        self.assertEqual((2,), get_book_copies(3, 5))
+
+    def test_apply_late_fees(self):
+        self.assertEqual((10, 9.5), apply_late_fees(1, 5, '2020-10-02'))
+        self.assertEqual((0, 0.0), apply_late_fees(1, 5, '2020-09-01'))
+
+    def test_insert_data_from_csv(self):
+        """Csv rows are merged by title into inventory"""
+        result = insert_data_from_csv('src/db/Library.csv', batch_size = 5)
+        self.assertEqual({'rows': 19, 'updated': 0, 'inserted': 18}, result)
+        assert_sql_count(self, "SELECT * FROM inventory", 28)
+
+        # loading again only adds copies
+        result = insert_data_from_csv('src/db/Library.csv', library_id = 2)
+        self.assertEqual({'rows': 19, 'updated': 18, 'inserted': 0}, result)
+        assert_sql_count(self, "SELECT * FROM inventory", 28)
+        self.assertEqual([(4, 2)], exec_get_all("""
+            SELECT copies, book_copies FROM inventory
+            INNER JOIN library_stock ON library_stock.book_id = inventory.book_id
+            WHERE title = 'Nicholas Nickleby'"""))
+
+    def test_login_caches_session(self):
+        """Sessions issued by login are validated without the database"""
+        key = login('gleason34', 'pancakes')['Login successful.']
+        hits = sessions.stats()['hits']
+        self.assertEqual(2, authenticate('gleason34', key))
+        self.assertEqual(hits + 1, sessions.stats()['hits'])
+
+        # a new login replaces the cached key
+        new_key = login('gleason34', 'pancakes')['Login successful.']
+        self.assertEqual(None, authenticate('gleason34', key))
+        self.assertEqual(2, authenticate('gleason34', new_key))
+
+    def test_authenticate_wrong_key(self):
+        self.assertEqual(None, authenticate('gleason34', '123456'))
+
+    def test_delete_account_invalidates_session(self):
+        key = login('gleason34', 'pancakes')['Login successful.']
+        self.assertEqual('Account successfully deleted.', delete_account('gleason34', key))
+        self.assertEqual(None, authenticate('gleason34', key))
+        self.assertEqual('Cannot update account info, user does not exist.',
+            edit_account('gleason34', 'new@example.com', key))
+
+    def test_stale_cached_session_is_rejected(self):
+        """A session replaced behind the cache's back cannot be used"""
+        key = login('gleason34', 'pancakes')['Login successful.']
+        exec_commit("UPDATE users SET session_key = 'other' WHERE username = 'gleason34'")
+        self.assertEqual('Cannot update account info, user does not exist.',
+            edit_account('gleason34', 'new@example.com', key))
+        self.assertEqual(None, sessions.get('gleason34', key))
+
+    def test_search_by_title_or_author(self):
+        self.assertEqual([7], [book[0] for book in search_by_title_or_author('The Lightning Thief')])
+        self.assertEqual([8], [book[0] for book in search_by_title_or_author('Harper Lee')])
+        self.assertEqual([], search_by_title_or_author('Stephen King'))
+
+    def test_search_by_multiple_terms(self):
+        """Genre plus author or title"""
+        self.assertEqual([5], [book[0] for book in search_by_multiple_terms('fiction', 'Ashley Poston')])
+        self.assertEqual([4], [book[0] for book in search_by_multiple_terms('non-fiction', 'The Princess Spy')])
+        self.assertEqual([], search_by_multiple_terms('fiction', 'The Princess Spy'))
+        self.assertEqual([], search_by_multiple_terms('poetry', 'Ashley Poston'))
+
+    def test_search_catalog(self):
+        """Stemmed words anywhere in title, author or summary match"""
+        self.assertEqual([6], [book[0] for book in search_catalog('tolkien')])
+        self.assertEqual([1, 2, 3], [book[0] for book in search_catalog('exploring')])
+        self.assertEqual([1], [book[0] for book in search_catalog('exploring', limit = 1)])
+        self.assertEqual([], search_catalog('vampires'))
+
+    def test_search_catalog_ranks_candidates(self):
+        """Only the first SEARCH_CANDIDATES matches of a query are ranked"""
+        with patch.object(library, 'SEARCH_CANDIDATES', 2):
+            self.assertEqual(2, search_catalog('exploring').__len__())
+
+    def test_search_catalog_misspelled(self):
+        """With pg_trgm, a query no book's words match falls back to similar titles and authors"""
+        if (not trigram_search_available()):
+            self.skipTest('pg_trgm is not installed')
+        self.assertEqual([6], [book[0] for book in search_catalog('Tolkin')])
+
+    def test_search_documents_follow_text_changes(self):
+        """Changing copies leaves a book's search document alone, editing its text refreshes it"""
+        document = "SELECT xmin::text FROM book_search WHERE book_id = 9"
+        before = exec_get_one(document)
+        key = login('gleason34', 'pancakes')['Login successful.']
+        checkout_book(4, 'Frankenstein', 'gleason34', key, '2022-12-08')
+        self.assertEqual(before, exec_get_one(document))
+
+        exec_commit("UPDATE inventory SET summary = 'Vampires at sea.' WHERE book_id = 9")
+        self.assertNotEqual(before, exec_get_one(document))
+        self.assertEqual([9], [book[0] for book in search_catalog('vampires')])
+
+    def test_get_suggestions(self):
+        """The prefix index is built from inventory and kept current"""
+        self.assertEqual([{'text': 'The Dead Romantics', 'type': 'title'}], get_suggestions('the d'))
+        add_new_book('The Dispossessed', 'Fiction', 'Ursula K. Le Guin', 2)
+        self.assertEqual(['The Dead Romantics', 'The Dispossessed'],
+            [match['text'] for match in get_suggestions('the d')])
+        insert_data_from_csv('src/db/Library.csv')
+        self.assertEqual([{'text': 'Charles Dickens', 'type': 'author'}], get_suggestions('charles'))
+
+    def test_catalog_cache_follows_writers(self):
+        """Cached listings and availability reflect checkouts and new stock"""
+        self.assertEqual(1, [book for book in get_all_books() if book[0] == 9][0][6])
+        self.assertEqual('Pittsford', get_libraries_with_book(9))
+
+        key = login('gleason34', 'pancakes')['Login successful.']
+        checkout_book(4, 'Frankenstein', 'gleason34', key, '2022-12-08')
+        self.assertEqual(0, [book for book in get_all_books() if book[0] == 9][0][6])
+
+        add_to_library(1, 9, 2)
+        self.assertEqual('Penfield, Pittsford', get_libraries_with_book(9))
+        self.assertEqual((2,), get_book_copies(1, 9))
+
+    def wait_for_catalog_version(self, old_version = None):
+        # the listener has caught up once it heard the latest version
+        deadline = time.monotonic() + 5
+        while catalog_version() in (None, old_version) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return catalog_version()
+
+    def test_catalog_cache_listens_for_other_processes(self):
+        """Changes published by another process invalidate the cached entries"""
+        self.assertTrue(catalog_listener.running())
+        self.wait_for_catalog_version()
+        self.assertEqual('Pittsford', get_libraries_with_book(9))
+
+        # a change nobody announced is not seen, the answer is cached
+        exec_commit("DELETE FROM library_stock WHERE book_id = 9")
+        self.assertEqual('Pittsford', get_libraries_with_book(9))
+
+        exec_commit("SELECT pg_notify('catalog', 'stock:9')")
+        deadline = time.monotonic() + 5
+        while get_libraries_with_book(9) != '' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual('', get_libraries_with_book(9))
+
+    def test_catalog_version(self):
+        """Every catalog write publishes a new version"""
+        version = self.wait_for_catalog_version()
+        self.assertNotEqual(None, version)
+
+        add_to_library(1, 9, 1)
+        self.assertTrue(self.wait_for_catalog_version(version) > version)
+
+    def assert_summaries_match_stock(self):
+        # the trigger maintained summaries agree with the live joins
+        self.assertEqual(exec_get_all("""
+            SELECT library_stock.book_id,
+            string_agg(libraries.library_name, ', ' ORDER BY library_stock.library_id)
+            FROM library_stock
+            INNER JOIN libraries ON libraries.library_id = library_stock.library_id
+            GROUP BY library_stock.book_id ORDER BY library_stock.book_id"""),
+            exec_get_all("SELECT book_id, libraries FROM book_availability ORDER BY book_id"))
+        self.assertEqual(exec_get_all("""
+            SELECT library_name, count(book_id), COALESCE(sum(book_copies), 0)
+            FROM libraries
+            LEFT JOIN library_stock ON library_stock.library_id = libraries.library_id
+            GROUP BY library_name ORDER BY library_name"""),
+            get_library_totals())
+
+    def test_availability_summaries(self):
+        """Stock changes of every kind keep the availability summaries current"""
+        self.assert_summaries_match_stock()
+        self.assertEqual(('Fairport', 7, 10), get_library_totals()[0])
+        self.assertEqual(10, total_books_at_library(2))
+
+        key = login('gleason34', 'pancakes')['Login successful.']
+        checkout_book(4, 'Frankenstein', 'gleason34', key, '2022-12-08')
+        return_book(4, 9, 2, '2022-12-10')
+        checkout_book(4, 'Frankenstein', 'gleason34', key, '2022-12-11')
+        add_to_library(1, 9, 2)
+        insert_data_from_csv('src/db/Library.csv', library_id = 3)
+        exec_commit("DELETE FROM library_stock WHERE book_id = 8 AND library_id = 2")
+        exec_commit("UPDATE libraries SET library_name = 'Perinton' WHERE library_id = 2")
+        self.assert_summaries_match_stock()
+        self.assertEqual('Penfield, Pittsford', get_libraries_with_book(9))
+
+    def test_availability_concurrent_stocking(self):
+        """Stocking one book at several libraries at once loses no library"""
+        book_id = add_new_book('Dune', 'Fiction', 'Frank Herbert', 4)
+        with ThreadPoolExecutor(max_workers = 4) as pool:
+            list(pool.map(lambda library_id: add_to_library(library_id, book_id, 1), [1, 2, 3, 4]))
+        self.assertEqual('Penfield, Fairport, Henrietta, Pittsford', get_libraries_with_book(book_id))
+        self.assert_summaries_match_stock()
+
+    def test_library_report(self):
+        """Stock and loans of every library, by name"""
+        self.assertEqual([
+            (2, 'Fairport', 7, 10, 0, 0, 0),
+            (3, 'Henrietta', 7, 9, 1, 1, 0),
+            (1, 'Penfield', 7, 10, 1, 0, 0),
+            (4, 'Pittsford', 5, 5, 2, 0, 0)], get_library_report())
+        self.assertEqual([0, 0, 0, 2],
+            [row[4] for row in get_library_report('2020-09-09', '2020-09-30')])
+
+    def test_loan_report(self):
+        """Average days borrowed counts returned loans only"""
+        report = get_loan_report()
+        self.assertEqual((None, None, 4, 3, Decimal('8.33')), report[-1][:5])
+        self.assertEqual((4, 'Pittsford', 2, 2, Decimal('11.50')), report[3][:5])
+        self.assertEqual((2, 2, Decimal('11.50')), get_loan_report('2020-09-09')[-1][2:5])
+        self.assertEqual((0, 0, None), get_loan_report('2021-01-01', '2021-12-31')[-1][2:5])
+
+    def test_loan_totals_follow_loans(self):
+        """The loan rollup agrees with the loans after checkouts, returns and fees"""
+        key = login('gleason34', 'pancakes')['Login successful.']
+        checkout_book(4, 'Frankenstein', 'gleason34', key, '2022-12-08')
+        return_book(4, 9, 2, '2022-12-30')
+        return_book(3, 5, 1, '2020-10-02')
+        apply_late_fees(1, 5, '2020-10-02')
+        exec_commit("DELETE FROM users WHERE id = 2")
+
+        self.assertEqual(exec_get_all("""
+            SELECT library_id, check_out_date, count(*), count(return_date),
+            COALESCE(sum(return_date - check_out_date), 0), COALESCE(sum(late_fees), 0)
+            FROM checkout GROUP BY library_id, check_out_date
+            ORDER BY library_id, check_out_date"""),
+            exec_get_all("""
+            SELECT library_id, check_out_date, loans, returned, days_borrowed, late_fees
+            FROM loan_totals WHERE loans > 0
+            ORDER BY library_id, check_out_date"""))
+
+    def test_stream_exports(self):
+        """Streamed exports hold the same loans as the buffered queries"""
+        loans = [loan for batch in stream_checkouts(batch_size = 3) for loan in batch]
+        self.assertEqual(4, loans.__len__())
+        self.assertEqual(CHECKOUT_EXPORT_COLUMNS.__len__(), loans[0].__len__())
+        self.assertEqual(sorted(get_all_histories(4)),
+            sorted(loan for batch in stream_all_histories(4) for loan in batch))
+        self.assertEqual(sorted(get_user_history(1)),
+            sorted(loan for batch in stream_user_history(1) for loan in batch))
+
+    def test_accrue_late_fees(self):
+        """Open overdue loans accrue the same fee a return would charge, once per date"""
+        result = accrue_late_fees('2020-10-02')
+        self.assertEqual(('2020-10-02', 1, 1, False), (result['as_of'], result['loans'],
+            result['chunks'], result['resumed']))
+        self.assertEqual((1, 9.5), get_outstanding_late_fees(1))
+        self.assertEqual((0, 0.0), get_outstanding_late_fees(2))
+        self.assertEqual(0, accrue_late_fees('2020-10-02')['loans'])
+
+        # a fresh run for the same date has nothing left to change
+        exec_commit("DELETE FROM late_fee_runs")
+        self.assertEqual(0, accrue_late_fees('2020-10-02', chunk_size = 0)['loans'])
+        self.assertEqual(1, accrue_late_fees('2020-10-03', chunk_size = 0)['loans'])
+        self.assertEqual((1, 11.5), get_outstanding_late_fees(1))
+        self.assertEqual((0, 0.0), get_outstanding_late_fees(3))
+
+    def test_accrue_late_fees_resumes(self):
+        """An interrupted run carries on after its last committed chunk"""
+        exec_commit("""
+            INSERT INTO users(name, contact_info, username, password)
+            VALUES ('Art Garfunkel', 'AGarfunkel@gmail.com', 'garfunkel87', '')""")
+        exec_commit("""
+            INSERT INTO checkout(library_id, book_id, user_id, check_out_date, due_date) VALUES
+            (4, 9, 2, '2020-09-16', '2020-09-30'),
+            (3, 7, 2, '2020-09-28', '2020-10-12'),
+            (1, 1, 3, '2020-09-25', '2020-10-09')""")
+
+        def interrupt(loans):
+            raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            accrue_late_fees('2020-10-10', chunk_size = 1, progress = interrupt)
+        self.assertEqual((1, 25.5), get_outstanding_late_fees(1))
+        self.assertEqual((0, 0.0), get_outstanding_late_fees(2))
+
+        result = accrue_late_fees('2020-10-10', chunk_size = 1)
+        self.assertEqual((2, True), (result['loans'], result['resumed']))
+        self.assertEqual((1, 25.5), get_outstanding_late_fees(1))
+        self.assertEqual((1, 9.5), get_outstanding_late_fees(2))
+        self.assertEqual((1, 0.25), get_outstanding_late_fees(3))
+        self.assertEqual((3,), exec_get_one("SELECT loans_updated FROM late_fee_runs"))
@@ -0,0 +1,67 @@
+import io
+import os
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout
+from src.db.migrate import *
+from src.db import library
+from src.db.swen344_db_utils import collect_query_stats, exec_commit, exec_get_all, exec_sql_file
+from tests.test_utils import *
+
+class TestMigrate(unittest.TestCase):
+
+    def test_rebuild_applies_migrations(self):
+        """A rebuilt schema is at the latest version"""
+        library.rebuild_tables()
+        self.assertEqual(latest_version(), schema_version())
+
+    def test_apply_migrations_is_idempotent(self):
+        """Re-applying migrations on an up to date schema does nothing"""
+        library.rebuild_tables()
+        self.assertEqual([], apply_migrations())
+        self.assertEqual(latest_version(), schema_version())
+
+    def test_up_to_date_schema_only_reads_its_version(self):
+        """Migrating an up to date schema takes the two lookups of schema_version"""
+        library.rebuild_tables()
+        with collect_query_stats() as stats:
+            self.assertEqual([], apply_migrations())
+        self.assertEqual(2, stats.queries)
+
+    def test_migrate_command(self):
+        """The command leaves data alone unless asked to rebuild"""
+        library.rebuild_tables()
+        library.create_account('Art Garfunkel', 'art@example.com', 'art', 'pw')
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main([])
+        self.assertEqual('Schema version: %d\n' % latest_version(), output.getvalue())
+        assert_sql_count(self, "SELECT * FROM users", 3)
+
+        with redirect_stdout(io.StringIO()):
+            main(['--rebuild'])
+        assert_sql_count(self, "SELECT * FROM users", 2)
+        self.assertEqual(latest_version(), schema_version())
+
+    def test_import_does_not_touch_the_database(self):
+        """Importing the app opens no connection and leaves the tables alone"""
+        library.rebuild_tables()
+        library.create_account('Art Garfunkel', 'art@example.com', 'art', 'pw')
+        src = os.path.join(os.path.dirname(__file__), '../../src')
+        subprocess.run([sys.executable, '-c',
+            'import server, db.swen344_db_utils as db; assert db._pool is None'],
+            cwd = src, check = True)
+        assert_sql_count(self, "SELECT * FROM users", 3)
+
+    def test_duplicate_stock_rows_are_merged(self):
+        """Migrating a schema with duplicate stock rows folds them together"""
+        exec_sql_file('src/db/library_schema.sql')
+        exec_commit("INSERT INTO library_stock(library_id, book_id, book_copies) VALUES (1, 1, 2)")
+        self.assertEqual(0, schema_version())
+
+        self.assertEqual([version for version, _, _ in available_migrations()], apply_migrations())
+        self.assertEqual([(6,)], exec_get_all("""
+            SELECT book_copies FROM library_stock
+            WHERE library_id = 1 AND book_id = 1"""))
+        assert_sql_count(self, "SELECT * FROM library_stock", 26)
@@ -1,5 +1,6 @@
 import unittest
-from src.db.swen344_db_utils import connect
+from src.db.swen344_db_utils import *
+from src.db.async_db_utils import positional_sql
 
 class TestPostgreSQL(unittest.TestCase):
 
@@ -8,4 +9,60 @@ class TestPostgreSQL(unittest.TestCase):
         cur = conn.cursor()
         cur.execute('SELECT VERSION()')
         self.assertTrue(cur.fetchone()[0].startswith('PostgreSQL'))
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    def test_pool_reuses_connections(self):
+        pool = init_pool(1, 2)
+        with borrow() as conn:
+            first = conn
+        with borrow() as conn:
+            self.assertIs(first, conn)
+        self.assertEqual({'min': 1, 'max': 2, 'idle': 1, 'in_use': 0}, pool.stats())
+        close_pool()
+
+    def test_pool_replaces_closed_connections(self):
+        init_pool(1, 1)
+        with borrow() as conn:
+            conn.close()
+        with borrow() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            self.assertEqual((1,), cur.fetchone())
+        close_pool()
+
+    def test_query_stats(self):
+        init_pool(1, 1)
+        with collect_query_stats() as stats:
+            exec_get_all('SELECT * FROM generate_series(1, %(n)s)', {'n': 3})
+            exec_commit('SELECT 1')
+            with self.assertRaises(Exception):
+                exec_get_one('SELECT * FROM no_such_table')
+        self.assertIsNone(current_query_stats())
+        summary = stats.summary()
+        self.assertEqual((3, 4, 3), (summary['queries'], summary['rows'], summary['connections']))
+        self.assertEqual(('SELECT * FROM generate_series(?, %(n)s)', 3),
+            (stats.recorded[0][0], stats.recorded[0][2]))
+        close_pool()
+
+    def test_normalize_sql(self):
+        self.assertEqual("SELECT * FROM users WHERE name = ? AND id > ? AND t1.x = %(x)s",
+            normalize_sql("""
+                SELECT * FROM users -- everyone
+                WHERE name = 'O''Brien' AND id > 42 AND t1.x = %(x)s"""))
+
+    def test_positional_sql(self):
+        self.assertEqual(("SELECT $1 <% title, $2, $1 LIKE 'a%'", ('query', 'limit')),
+            positional_sql("SELECT %(query)s <%% title, %(limit)s, %(query)s LIKE 'a%%'"))
+
+    def test_slow_query_log(self):
+        config = load_config()
+        config['slow_query_ms'] = 0
+        try:
+            with self.assertLogs('src.db.swen344_db_utils', 'WARNING') as logs:
+                exec_get_one('SELECT count(*) FROM generate_series(1, %(n)s)', {'n': 10})
+                self.assertTrue(slow_queries.wait(5))
+        finally:
+            del config['slow_query_ms']
+            slow_queries._explained.clear()
+        self.assertIn('slow query', logs.output[0])
+        self.assertIn('Function Scan on generate_series', '\n'.join(logs.output))
@@ -0,0 +1,31 @@
+import time
+import unittest
+from src.db.session_cache import SessionCache
+
+class TestSessionCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = SessionCache()
+        cache.put('lovelace12', 1234, 1)
+        self.assertEqual(1, cache.get('lovelace12', '1234'))
+        self.assertEqual(None, cache.get('lovelace12', '4321'))
+        self.assertEqual(None, cache.get('gleason34', '1234'))
+        stats = cache.stats()
+        self.assertEqual((1, 2), (stats['hits'], stats['misses']))
+
+    def test_expired_entries_miss(self):
+        cache = SessionCache(ttl = 0.01)
+        cache.put('lovelace12', 1234, 1)
+        time.sleep(0.02)
+        self.assertEqual(None, cache.get('lovelace12', 1234))
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_least_recently_used_is_evicted(self):
+        cache = SessionCache(maxsize = 2)
+        cache.put('a', 1, 1)
+        cache.put('b', 2, 2)
+        cache.get('a', 1)
+        cache.put('c', 3, 3)
+        self.assertEqual(None, cache.get('b', 2))
+        self.assertEqual(1, cache.get('a', 1))
+        self.assertEqual(1, cache.stats()['evictions'])
@@ -0,0 +1,73 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from src.db.suggest import *
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.build([('The Hobbit', TITLE), ('J.R.R. Tolkien', AUTHOR),
+            ('The Lord of the Rings', TITLE), ('J.R.R. Tolkien', AUTHOR),
+            ('Thérèse Raquin', TITLE), ('Theo', AUTHOR)])
+
+    def test_prefix_is_case_insensitive(self):
+        self.assertEqual(['The Hobbit', 'The Lord of the Rings', 'Theo'],
+            [match['text'] for match in self.index.suggest('the')])
+        self.assertEqual(['Thérèse Raquin'], [match['text'] for match in self.index.suggest('THÉ')])
+
+    def test_top_k(self):
+        self.assertEqual([{'text': 'The Hobbit', 'type': 'title'}], self.index.suggest('THE', 1))
+
+    def test_duplicates_are_indexed_once(self):
+        self.assertEqual([{'text': 'J.R.R. Tolkien', 'type': 'author'}], self.index.suggest('j.r'))
+        self.assertEqual(5, self.index.__len__())
+
+    def test_add_keeps_order(self):
+        self.index.add('The Fellowship of the Ring', TITLE)
+        self.index.add('The Hobbit', TITLE)
+        self.assertEqual(['The Fellowship of the Ring', 'The Hobbit'],
+            [match['text'] for match in self.index.suggest('the ', 2)])
+        self.assertEqual(6, self.index.__len__())
+
+    def test_no_match(self):
+        self.assertEqual([], self.index.suggest('zz'))
+
+    def test_ensure_built_loads_once(self):
+        """Concurrent first lookups wait for a single build"""
+        index = PrefixIndex()
+        loads = []
+        def load():
+            loads.append(1)
+            return [('The Hobbit', TITLE)]
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            list(executor.map(lambda _: index.ensure_built(load), range(8)))
+        self.assertEqual(1, loads.__len__())
+        self.assertTrue(index.built)
+
+    def test_add_during_build_is_kept(self):
+        index = PrefixIndex()
+        def entries():
+            yield 'The Hobbit', TITLE
+            index.add('The Silmarillion', TITLE)
+        index.build(entries())
+        self.assertEqual(['The Hobbit', 'The Silmarillion'],
+            [match['text'] for match in index.suggest('the')])
+
+    def test_invalidate_during_build(self):
+        """A build raced by a change answers lookups but is rebuilt next time"""
+        index = PrefixIndex()
+        def entries():
+            yield 'The Hobbit', TITLE
+            index.invalidate()
+        index.build(entries())
+        self.assertFalse(index.built)
+        self.assertEqual(1, index.suggest('the').__len__())
+        index.ensure_built(lambda: [('The Hobbit', TITLE), ('The Silmarillion', TITLE)])
+        self.assertTrue(index.built)
+        self.assertEqual(2, index.suggest('the').__len__())
+
+    def test_add_before_build_is_ignored(self):
+        index = PrefixIndex()
+        index.add('The Hobbit', TITLE)
+        self.assertFalse(index.tracking())
+        self.assertEqual(0, index.__len__())
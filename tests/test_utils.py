@@ -37,3 +37,18 @@ def delete_rest_call(test, url, delete_header = {}, expected_code = 200):
     test.assertEqual(expected_code, response.status_code,
                      f'Response code to {url} not {expected_code}')
     return response.json()
+
+def get_metrics(test, url = 'http://localhost:5000/metrics'):
+    '''Scrapes a Prometheus text page into {(name, labels): value}'''
+    response = requests.get(url)
+    test.assertEqual(200, response.status_code)
+    test.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+    samples = {}
+    for line in response.text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        labels = tuple(pair.split('=', 1) for pair in labels.rstrip('}').split(',')) if labels else ()
+        samples[(name, tuple((key, value.strip('"')) for key, value in labels))] = float(value)
+    return samples